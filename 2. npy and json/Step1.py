@@ -1,11 +1,30 @@
 # convert_to_embeddings.py
 """
 Script to convert conversations into embeddings and save them as a NumPy .npy file.
-Metadata is saved as a JSON file.
+Metadata is saved as a JSON Lines file.
 """
 
+import os
+import sys
+from datetime import datetime, timedelta
+from functools import partial
+
+# Make the shared latent_memory package importable when running this script directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 import numpy as np
-import json
+
+from latent_memory.encoding import encode_parallel
+from latent_memory.ingest import ingest
+from latent_memory.metrics import timed
+from latent_memory.packing import line_tokens
+from latent_memory.precision import PRECISIONS, precision_report, quantization_file, quantize, save_quantization
+from latent_memory.storage.json_metadata import JSONLMetadataWriter
+from latent_memory.storage.npy_store import NpyStoreWriter
+from latent_memory.storage.sqlite_metadata import SQLiteMetadataWriter
+
+# Placeholder timestamp of the first conversation (replace with the real time of each conversation)
+FIRST_TIMESTAMP = datetime(2025, 4, 1, 10, 0, 0)
 
 # Example conversations (simulating past user interactions)
 conversations = [
@@ -16,55 +35,145 @@ conversations = [
     "How can I use LLMs to improve my coding workflow?"
 ]
 
-def convert_to_embeddings(conversations):
+def placeholder_timestamp(row):
+    """
+    Placeholder timestamp of a conversation: one day after the previous one, from FIRST_TIMESTAMP.
+
+    Args:
+        row (int): Position of the conversation in the store.
+
+    Returns:
+        timestamp (str): Timestamp formatted as "YYYY-MM-DD HH:MM:SS".
+    """
+    return (FIRST_TIMESTAMP + timedelta(days=row)).strftime("%Y-%m-%d %H:%M:%S")
+
+@timed("step1.convert_to_embeddings")
+def convert_to_embeddings(conversations, start=0, cache=None, token_counter=None, encoder=None, encode_workers=None, encode_pool="thread"):
     """
     Convert a list of conversations to embeddings and create metadata.
 
     Args:
         conversations (list): List of conversation strings.
+        start (int): Position of the first conversation in the store, used to number the conversation ids.
+        cache (EmbeddingCache): Optional on-disk cache consulted before calling the model; its model_id and
+            dimension must match the encoder's.
+        token_counter (callable): Counter of the tokens stored with each entry, token_counter(text) returning an int;
+            defaults to an estimate of four characters per token (see latent_memory/packing.py).
+        encoder: Encoder with encode(texts) returning a float32 matrix; defaults to the one set with
+            latent_memory.encoding.set_encoder (the random placeholder until a model is plugged in).
+        encode_workers (int): Batches encoded concurrently (1 encodes them in this thread).
+        encode_pool (str): "thread" for encoders that release the GIL, "process" for pure-Python ones.
 
     Returns:
         embeddings (np.ndarray): Array of embeddings.
         metadata (list): List of metadata entries as dicts.
     """
-    # Here your logic to load your model (e.g., Sentence Transformers, BERT, etc.)
-    # model = ...
-    
-    # Simulate embedding generation (replace with actual model encoding)
-    # For demonstration, we'll assume embeddings are 384-dimensional (as with all-MiniLM-L6-v2)
-    embeddings = np.random.rand(len(conversations), 384)  # Placeholder: replace with model.encode(conversations)
+    # Encode in length-sorted batches spread over a pool, keeping the order of the conversations
+    # (plug a real model in with latent_memory.encoding.set_encoder, or pass encoder)
+    encode = partial(encode_parallel, encoder=encoder, workers=encode_workers, pool=encode_pool)
+
+    # With a cache, only the conversations it has not seen before are sent to the model
+    embeddings = encode(conversations) if cache is None else cache.encode(conversations, encode, encoder)
 
     # Create metadata for each conversation
     metadata = [
         {
             "conversation_id": f"conv_{i}",
             "summary": conv,
-            "timestamp": f"2025-04-{i+1} 10:00:00"
+            "timestamp": placeholder_timestamp(i)
         }
-        for i, conv in enumerate(conversations)
+        for i, conv in enumerate(conversations, start)
     ]
 
+    # Store the token count of each conversation's context line, so Step3 packs contexts without re-tokenizing
+    for entry in metadata:
+        entry["tokens"] = line_tokens(entry["summary"], entry["timestamp"], token_counter)
+
     return embeddings, metadata
 
-def save_data(embeddings, metadata, embeddings_file="embeddings.npy", metadata_file="metadata.json"):
+@timed("step1.save_data")
+def save_data(embeddings, metadata, embeddings_file="embeddings.npy", metadata_file="metadata.jsonl", precision="float32", metadata_db=None):
     """
-    Save embeddings as a NumPy .npy file and metadata as a JSON file.
+    Save embeddings as a NumPy .npy file and metadata as a JSON Lines file.
 
     Args:
         embeddings (np.ndarray): Array of embeddings.
         metadata (list): List of metadata entries.
         embeddings_file (str): Path to save embeddings.
         metadata_file (str): Path to save metadata.
+        precision (str): Storage precision of the embeddings: "float32", "float16" or "int8".
+        metadata_db (str): Optional SQLite file that also receives the metadata, keyed by FAISS id, for indexed lookups in Step 3.
     """
+    # Store the embeddings at the requested precision (int8 scale and offset go to a sidecar file)
+    stored, quantization = quantize(embeddings, precision)
+    save_quantization(embeddings_file, quantization)
+
     # Save embeddings as .npy file
-    np.save(embeddings_file, embeddings)
+    np.save(embeddings_file, stored)
+
+    # Save metadata as JSON Lines, one entry per line, indexed by row and conversation_id
+    with JSONLMetadataWriter(metadata_file) as writer:
+        writer.append(metadata)
 
-    # Save metadata as JSON
-    with open(metadata_file, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    # Optionally also insert the metadata into SQLite, keyed by FAISS id
+    if metadata_db:
+        with SQLiteMetadataWriter(metadata_db) as writer:
+            writer.append(metadata)
 
     print(f"Saved embeddings to {embeddings_file} and metadata to {metadata_file}")
 
+@timed("step1.ingest_stream")
+def ingest_stream(source, batch_size=256, embeddings_file="embeddings.npy", metadata_file="metadata.jsonl", append=False, cache=None, precision="float32", metadata_db=None, token_counter=None, encoder=None, encode_workers=None, encode_pool="thread"):
+    """
+    Stream conversations into the store batch by batch instead of encoding the whole corpus in memory.
+    Each batch is written as soon as it is encoded, so a failure only loses the batch in progress.
+
+    Args:
+        source (iterable or str): Conversations, or path to a text file with one conversation per line.
+        batch_size (int): Number of conversations encoded and written per batch.
+        embeddings_file (str): Path to the embeddings .npy file.
+        metadata_file (str): Path to the metadata JSON Lines file.
+        append (bool): Add to an existing store instead of overwriting it.
+        cache (EmbeddingCache): Optional on-disk cache, so unchanged conversations are not re-encoded.
+        precision (str): Storage precision of a new store; int8 scale and offset are fitted on the first batch.
+        metadata_db (str): Optional SQLite file that also receives the metadata, keyed by FAISS id, for indexed lookups in Step 3.
+        token_counter (callable): Counter of the tokens stored with each entry (see convert_to_embeddings).
+        encoder: Encoder of the conversations (see convert_to_embeddings).
+        encode_workers (int): Batches encoded concurrently (see convert_to_embeddings).
+        encode_pool (str): "thread" or "process" (see convert_to_embeddings).
+
+    Returns:
+        total (int): Number of conversations ingested.
+    """
+    with NpyStoreWriter(embeddings_file, metadata_file, append=append, precision=precision, metadata_db=metadata_db) as writer:
+        convert = partial(
+            convert_to_embeddings, cache=cache, token_counter=token_counter, encoder=encoder,
+            encode_workers=encode_workers, encode_pool=encode_pool
+        )
+        total = ingest(source, convert, writer, batch_size)
+
+    print(f"Streamed {total} conversations to {embeddings_file} and {metadata_file}")
+    return total
+
+def report_precision(embeddings, metadata, precisions=PRECISIONS):
+    """
+    Compare the .npy file size and reconstruction error of each storage precision.
+
+    Args:
+        embeddings (np.ndarray): Array of embeddings.
+        metadata (list): List of metadata entries.
+        precisions (tuple): Precisions to compare.
+
+    Returns:
+        report (list): One dict per precision with file_bytes, size_vs_float64, max_abs_error, mean_abs_error and min_cosine.
+    """
+    def save(precision, directory):
+        embeddings_file = os.path.join(directory, "embeddings.npy")
+        save_data(embeddings, metadata, embeddings_file, os.path.join(directory, "metadata.jsonl"), precision=precision)
+        return [embeddings_file, quantization_file(embeddings_file)]
+
+    return precision_report(embeddings, save, precisions)
+
 if __name__ == "__main__":
     # Convert conversations to embeddings
     embeddings, metadata = convert_to_embeddings(conversations)
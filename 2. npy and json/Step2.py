@@ -1,69 +1,121 @@
 # store_in_vector_db.py
 """
 Script to store embeddings in a FAISS vector database for efficient semantic search.
-Loads embeddings from a NumPy .npy file and metadata from a JSON file.
+Loads embeddings from a NumPy .npy file and metadata from a JSON Lines file.
 """
 
+import os
+import sys
+from functools import partial
+
+# Make the shared latent_memory package importable when running this script directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 import numpy as np
-import faiss
-import json
 
-def load_data(embeddings_file="embeddings.npy", metadata_file="metadata.json"):
+from latent_memory.builder import build_index, consolidate_index, update_index
+from latent_memory.metrics import timed
+from latent_memory.precision import dequantize, load_quantization
+from latent_memory.storage.json_metadata import load_metadata
+
+@timed("step2.load_data")
+def load_data(embeddings_file="embeddings.npy", metadata_file="metadata.jsonl", start=0, mmap=False):
     """
     Load embeddings and metadata from files.
 
     Args:
         embeddings_file (str): Path to embeddings .npy file.
-        metadata_file (str): Path to metadata JSON file.
+        metadata_file (str): Path to metadata JSON Lines file.
+        start (int): First row to load, so only rows added since the last index build are read.
+        mmap (bool): Return a read-only memory-mapped view of the embeddings instead of reading them into memory.
 
     Returns:
         embeddings (np.ndarray): Array of embeddings.
         metadata (list): List of metadata entries.
     """
-    # Load embeddings from .npy file
-    embeddings = np.load(embeddings_file)
+    # Load embeddings from .npy file, reading only the rows from start onwards
+    embeddings = np.load(embeddings_file, mmap_mode='r')[start:]
+
+    # Undo the storage precision (float32 for FAISS). A memory-mapped float file is returned as is,
+    # since create_faiss_index converts it chunk by chunk; int8 files always need their scale and offset
+    quantization = load_quantization(embeddings_file)
+    if not mmap or quantization is not None:
+        embeddings = dequantize(embeddings, quantization, start)
 
-    # Load metadata from JSON
-    with open(metadata_file, 'r') as f:
-        metadata = json.load(f)
+    # Load metadata from JSON Lines; the offset index skips the rows before start without parsing them
+    metadata = load_metadata(metadata_file, start)
 
     return embeddings, metadata
 
-def create_faiss_index(embeddings, index_file="faiss_index.bin"):
+@timed("step2.create_faiss_index")
+def create_faiss_index(embeddings, index_file="faiss_index.bin", index_spec="flat", metadata=None, dedup_threshold=None, shards=None):
     """
     Create a FAISS index from embeddings and save it.
 
     Args:
         embeddings (np.ndarray): Array of embeddings.
         index_file (str): Path to save the FAISS index.
+        index_spec (str or dict): Index structure: "flat" (exact), "ivf-flat", "ivf-pq", "hnsw" or "auto"
+            to pick one from the number of embeddings. A dict can also set parameters such as nlist or M.
+        metadata (list): Metadata entries of the embeddings; when given, their timestamp and attribute columns are
+            saved next to the index (faiss_index.bin.columns.npz) for metadata-filtered search in Step3.
+        dedup_threshold (float): When given, embeddings whose cosine similarity to an already indexed one reaches it
+            (e.g. 0.95) are linked to that one instead of being added (see latent_memory/dedup.py).
+        shards (int): When given, partition the embeddings into this many contiguous shards, each saved as its own
+            index file (faiss_index.bin.shard0, ...) and searched in parallel by Step3 (see latent_memory/sharding.py).
 
     Returns:
-        index (faiss.Index): FAISS index for semantic search.
+        index (faiss.Index or ShardedIndex): FAISS index for semantic search.
     """
-    # Ensure embeddings are in the correct format (float32)
-    embeddings = embeddings.astype('float32')
+    return build_index(embeddings, index_file, index_spec, metadata, dedup_threshold, shards)
 
-    # Get the dimension of the embeddings
-    dimension = embeddings.shape[1]
+@timed("step2.update_faiss_index")
+def update_faiss_index(embeddings_file="embeddings.npy", metadata_file="metadata.jsonl", index_file="faiss_index.bin", index_spec="flat", dedup_threshold=None, shards=None):
+    """
+    Add the conversations appended to the store since the index was last saved, instead of rebuilding it.
+    Only the new rows are loaded; falls back to a full build when no index exists yet.
 
-    # Create a FAISS index (using Inner Product for cosine similarity)
-    index = faiss.IndexFlatIP(dimension)
+    Args:
+        embeddings_file (str): Path to embeddings .npy file.
+        metadata_file (str): Path to metadata JSON Lines file.
+        index_file (str): Path to the FAISS index.
+        index_spec (str or dict): Index structure used when no index exists yet (see create_faiss_index).
+        dedup_threshold (float): Merge near-duplicates of indexed conversations instead of adding them. Indexes built
+            with deduplication keep deduplicating with their own threshold when this is not given.
+        shards (int): Number of shards used when no index exists yet (see create_faiss_index).
 
-    # Add embeddings to the index
-    index.add(embeddings)
+    Returns:
+        index (faiss.Index or ShardedIndex): Updated FAISS index.
+    """
+    # Only the rows past those the index already covers are loaded
+    return update_index(partial(load_data, embeddings_file, metadata_file), index_file, index_spec, dedup_threshold, shards)
 
-    # Save the index
-    faiss.write_index(index, index_file)
-    print(f"Saved FAISS index to {index_file}")
+@timed("step2.consolidate_faiss_index")
+def consolidate_faiss_index(embeddings_file="embeddings.npy", metadata_file="metadata.jsonl", index_file="faiss_index.bin", max_age_days=90, members_per_centroid=20):
+    """
+    Replace the indexed conversations older than max_age_days by k-means centroid memories, so the live index stays
+    bounded while older topics remain retrievable (see latent_memory/consolidation.py). The store is not modified
+    and keeps the original conversations, which the merged record of each centroid links to.
 
-    return index
+    Args:
+        embeddings_file (str): Path to embeddings .npy file.
+        metadata_file (str): Path to metadata JSON Lines file.
+        index_file (str): Path to the FAISS index.
+        max_age_days (float): Conversations older than this are consolidated.
+        members_per_centroid (int): Average number of conversations replaced by one centroid.
+
+    Returns:
+        index (faiss.Index): Consolidated FAISS index.
+    """
+    # The embeddings are memory-mapped, so only the aged rows are read
+    return consolidate_index(partial(load_data, embeddings_file, metadata_file, mmap=True), index_file, max_age_days, members_per_centroid)
 
 if __name__ == "__main__":
     # Load embeddings and metadata
     embeddings, metadata = load_data()
 
     # Create and save the FAISS index
-    index = create_faiss_index(embeddings)
+    index = create_faiss_index(embeddings, metadata=metadata)
 
     # Verify the index
     print(f"Number of vectors in FAISS index: {index.ntotal}")
\ No newline at end of file
@@ -4,8 +4,23 @@ Script to convert conversations into embeddings and save them in a single HDF5 f
 Both embeddings and metadata are stored in the same file.
 """
 
-import numpy as np
-import h5py
+import os
+import sys
+from datetime import datetime, timedelta
+from functools import partial
+
+# Make the shared latent_memory package importable when running this script directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from latent_memory.encoding import encode_parallel
+from latent_memory.ingest import ingest
+from latent_memory.metrics import timed
+from latent_memory.packing import line_tokens
+from latent_memory.precision import PRECISIONS, precision_report
+from latent_memory.storage.hdf5_store import HDF5StoreWriter
+
+# Placeholder timestamp of the first conversation (replace with the real time of each conversation)
+FIRST_TIMESTAMP = datetime(2025, 4, 1, 10, 0, 0)
 
 # Example conversations (simulating past user interactions)
 conversations = [
@@ -16,33 +31,59 @@ conversations = [
     "How can I use LLMs to improve my coding workflow?"
 ]
 
-def convert_to_embeddings(conversations):
+def placeholder_timestamp(row):
+    """
+    Placeholder timestamp of a conversation: one day after the previous one, from FIRST_TIMESTAMP.
+
+    Args:
+        row (int): Position of the conversation in the store.
+
+    Returns:
+        timestamp (str): Timestamp formatted as "YYYY-MM-DD HH:MM:SS".
+    """
+    return (FIRST_TIMESTAMP + timedelta(days=row)).strftime("%Y-%m-%d %H:%M:%S")
+
+@timed("step1.convert_to_embeddings")
+def convert_to_embeddings(conversations, start=0, cache=None, token_counter=None, encoder=None, encode_workers=None, encode_pool="thread"):
     """
     Convert a list of conversations to embeddings and create metadata.
 
     Args:
         conversations (list): List of conversation strings.
+        start (int): Position of the first conversation in the store, used to number the conversation ids.
+        cache (EmbeddingCache): Optional on-disk cache consulted before calling the model; its model_id and
+            dimension must match the encoder's.
+        token_counter (callable): Counter of the tokens stored with each entry, token_counter(text) returning an int;
+            defaults to an estimate of four characters per token (see latent_memory/packing.py).
+        encoder: Encoder with encode(texts) returning a float32 matrix; defaults to the one set with
+            latent_memory.encoding.set_encoder (the random placeholder until a model is plugged in).
+        encode_workers (int): Batches encoded concurrently (1 encodes them in this thread).
+        encode_pool (str): "thread" for encoders that release the GIL, "process" for pure-Python ones.
 
     Returns:
         embeddings (np.ndarray): Array of embeddings.
         metadata (list): List of metadata entries as tuples.
     """
-    # Here your logic to load your model (e.g., Sentence Transformers, BERT, etc.)
-    # model = ...
-    
-    # Simulate embedding generation (replace with actual model encoding)
-    # For demonstration, we'll assume embeddings are 384-dimensional (as with all-MiniLM-L6-v2)
-    embeddings = np.random.rand(len(conversations), 384)  # Placeholder: replace with model.encode(conversations)
-
-    # Create metadata as a list of tuples (for HDF5 compound type)
+    # Encode in length-sorted batches spread over a pool, keeping the order of the conversations
+    # (plug a real model in with latent_memory.encoding.set_encoder, or pass encoder)
+    encode = partial(encode_parallel, encoder=encoder, workers=encode_workers, pool=encode_pool)
+
+    # With a cache, only the conversations it has not seen before are sent to the model
+    embeddings = encode(conversations) if cache is None else cache.encode(conversations, encode, encoder)
+
+    # Create metadata as a list of tuples (for the HDF5 compound type)
     metadata = [
-        (f"conv_{i}", conv, f"2025-04-{i+1} 10:00:00")
-        for i, conv in enumerate(conversations)
+        (f"conv_{i}", conv, placeholder_timestamp(i))
+        for i, conv in enumerate(conversations, start)
     ]
 
+    # Append the token count of each conversation's context line, so Step3 packs contexts without re-tokenizing
+    metadata = [entry + (line_tokens(entry[1], entry[2], token_counter),) for entry in metadata]
+
     return embeddings, metadata
 
-def save_data(embeddings, metadata, hdf5_file="latent_memory.h5"):
+@timed("step1.save_data")
+def save_data(embeddings, metadata, hdf5_file="latent_memory.h5", precision="float32", metadata_db=None):
     """
     Save embeddings and metadata to a single HDF5 file.
 
@@ -50,23 +91,66 @@ def save_data(embeddings, metadata, hdf5_file="latent_memory.h5"):
         embeddings (np.ndarray): Array of embeddings.
         metadata (list): List of metadata entries as tuples.
         hdf5_file (str): Path to save the HDF5 file.
+        precision (str): Storage precision of the embeddings: "float32", "float16" or "int8".
+        metadata_db (str): Optional SQLite file that also receives the metadata, keyed by FAISS id, for indexed lookups in Step 3.
+    """
+    # Save to HDF5 file as chunked, compressed datasets that later batches can extend
+    # (metadata strings are variable-length UTF-8, so summaries are never truncated)
+    with HDF5StoreWriter(hdf5_file, precision=precision, metadata_db=metadata_db) as writer:
+        writer.append(embeddings, metadata)
+
+    print(f"Saved embeddings and metadata to {hdf5_file}")
+
+@timed("step1.ingest_stream")
+def ingest_stream(source, batch_size=256, hdf5_file="latent_memory.h5", append=False, cache=None, precision="float32", metadata_db=None, token_counter=None, encoder=None, encode_workers=None, encode_pool="thread"):
     """
-    # Define the compound data type for metadata
-    metadata_dtype = np.dtype([
-        ("conversation_id", "S10"),  # String of max length 10 (e.g., "conv_1")
-        ("summary", "S200"),         # String of max length 200 for summaries
-        ("timestamp", "S20")         # String of max length 20 for timestamps
-    ])
+    Stream conversations into the store batch by batch instead of encoding the whole corpus in memory.
+    Each batch is written as soon as it is encoded, so a failure only loses the batch in progress.
+
+    Args:
+        source (iterable or str): Conversations, or path to a text file with one conversation per line.
+        batch_size (int): Number of conversations encoded and written per batch.
+        hdf5_file (str): Path to the HDF5 file.
+        append (bool): Add to an existing store instead of overwriting it.
+        cache (EmbeddingCache): Optional on-disk cache, so unchanged conversations are not re-encoded.
+        precision (str): Storage precision of a new store; int8 scale and offset are fitted on the first batch.
+        metadata_db (str): Optional SQLite file that also receives the metadata, keyed by FAISS id, for indexed lookups in Step 3.
+        token_counter (callable): Counter of the tokens stored with each entry (see convert_to_embeddings).
+        encoder: Encoder of the conversations (see convert_to_embeddings).
+        encode_workers (int): Batches encoded concurrently (see convert_to_embeddings).
+        encode_pool (str): "thread" or "process" (see convert_to_embeddings).
 
-    # Convert metadata to a NumPy array with the compound type
-    metadata_array = np.array(metadata, dtype=metadata_dtype)
+    Returns:
+        total (int): Number of conversations ingested.
+    """
+    with HDF5StoreWriter(hdf5_file, append=append, precision=precision, metadata_db=metadata_db) as writer:
+        convert = partial(
+            convert_to_embeddings, cache=cache, token_counter=token_counter, encoder=encoder,
+            encode_workers=encode_workers, encode_pool=encode_pool
+        )
+        total = ingest(source, convert, writer, batch_size)
 
-    # Save to HDF5 file
-    with h5py.File(hdf5_file, 'w') as f:
-        f.create_dataset('embeddings', data=embeddings)
-        f.create_dataset('metadata', data=metadata_array)
+    print(f"Streamed {total} conversations to {hdf5_file}")
+    return total
 
-    print(f"Saved embeddings and metadata to {hdf5_file}")
+def report_precision(embeddings, metadata, precisions=PRECISIONS):
+    """
+    Compare the HDF5 file size and reconstruction error of each storage precision.
+
+    Args:
+        embeddings (np.ndarray): Array of embeddings.
+        metadata (list): List of metadata entries.
+        precisions (tuple): Precisions to compare.
+
+    Returns:
+        report (list): One dict per precision with file_bytes, size_vs_float64, max_abs_error, mean_abs_error and min_cosine.
+    """
+    def save(precision, directory):
+        hdf5_file = os.path.join(directory, "latent_memory.h5")
+        save_data(embeddings, metadata, hdf5_file, precision=precision)
+        return [hdf5_file]
+
+    return precision_report(embeddings, save, precisions)
 
 if __name__ == "__main__":
     # Convert conversations to embeddings
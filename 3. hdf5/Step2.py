@@ -4,62 +4,105 @@ Script to store embeddings in a FAISS vector database for efficient semantic sea
 Loads embeddings and metadata from a single HDF5 file.
 """
 
-import numpy as np
-import faiss
-import h5py
+import os
+import sys
+from functools import partial
 
-def load_data(hdf5_file="latent_memory.h5"):
+# Make the shared latent_memory package importable when running this script directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from latent_memory.builder import build_index, consolidate_index, update_index
+from latent_memory.metrics import timed
+from latent_memory.precision import dequantize
+from latent_memory.storage.hdf5_store import open_for_reading, read_quantization
+
+@timed("step2.load_data")
+def load_data(hdf5_file="latent_memory.h5", start=0):
     """
     Load embeddings and metadata from a single HDF5 file.
 
     Args:
         hdf5_file (str): Path to the HDF5 file.
+        start (int): First row to load, so only rows added since the last index build are read.
 
     Returns:
         embeddings (np.ndarray): Array of embeddings.
         metadata (np.ndarray): Structured array of metadata.
     """
-    with h5py.File(hdf5_file, 'r') as f:
-        embeddings = np.array(f['embeddings'])
-        metadata = np.array(f['metadata'])
+    # Opened in SWMR mode, so this works while Step1 appends; rows whose metadata is not written yet are left out
+    with open_for_reading(hdf5_file) as f:
+        metadata = f['metadata'][start:]
+        # Undo the storage precision (float32 for FAISS)
+        embeddings = dequantize(f['embeddings'][start:start + len(metadata)], read_quantization(f['embeddings']), start)
 
     return embeddings, metadata
 
-def create_faiss_index(embeddings, index_file="faiss_index.bin"):
+@timed("step2.create_faiss_index")
+def create_faiss_index(embeddings, index_file="faiss_index.bin", index_spec="flat", metadata=None, dedup_threshold=None, shards=None):
     """
     Create a FAISS index from embeddings and save it.
 
     Args:
         embeddings (np.ndarray): Array of embeddings.
         index_file (str): Path to save the FAISS index.
+        index_spec (str or dict): Index structure: "flat" (exact), "ivf-flat", "ivf-pq", "hnsw" or "auto"
+            to pick one from the number of embeddings. A dict can also set parameters such as nlist or M.
+        metadata (np.ndarray): Structured array of metadata of the embeddings; when given, their timestamp and attribute columns are
+            saved next to the index (faiss_index.bin.columns.npz) for metadata-filtered search in Step3.
+        dedup_threshold (float): When given, embeddings whose cosine similarity to an already indexed one reaches it
+            (e.g. 0.95) are linked to that one instead of being added (see latent_memory/dedup.py).
+        shards (int): When given, partition the embeddings into this many contiguous shards, each saved as its own
+            index file (faiss_index.bin.shard0, ...) and searched in parallel by Step3 (see latent_memory/sharding.py).
 
     Returns:
-        index (faiss.Index): FAISS index for semantic search.
+        index (faiss.Index or ShardedIndex): FAISS index for semantic search.
     """
-    # Ensure embeddings are in the correct format (float32)
-    embeddings = embeddings.astype('float32')
+    return build_index(embeddings, index_file, index_spec, metadata, dedup_threshold, shards)
 
-    # Get the dimension of the embeddings
-    dimension = embeddings.shape[1]
+@timed("step2.update_faiss_index")
+def update_faiss_index(hdf5_file="latent_memory.h5", index_file="faiss_index.bin", index_spec="flat", dedup_threshold=None, shards=None):
+    """
+    Add the conversations appended to the store since the index was last saved, instead of rebuilding it.
+    Only the new rows are loaded; falls back to a full build when no index exists yet.
 
-    # Create a FAISS index (using Inner Product for cosine similarity)
-    index = faiss.IndexFlatIP(dimension)
+    Args:
+        hdf5_file (str): Path to the HDF5 file.
+        index_file (str): Path to the FAISS index.
+        index_spec (str or dict): Index structure used when no index exists yet (see create_faiss_index).
+        dedup_threshold (float): Merge near-duplicates of indexed conversations instead of adding them. Indexes built
+            with deduplication keep deduplicating with their own threshold when this is not given.
+        shards (int): Number of shards used when no index exists yet (see create_faiss_index).
 
-    # Add embeddings to the index
-    index.add(embeddings)
+    Returns:
+        index (faiss.Index or ShardedIndex): Updated FAISS index.
+    """
+    # Only the rows past those the index already covers are loaded
+    return update_index(partial(load_data, hdf5_file), index_file, index_spec, dedup_threshold, shards)
 
-    # Save the index
-    faiss.write_index(index, index_file)
-    print(f"Saved FAISS index to {index_file}")
+@timed("step2.consolidate_faiss_index")
+def consolidate_faiss_index(hdf5_file="latent_memory.h5", index_file="faiss_index.bin", max_age_days=90, members_per_centroid=20):
+    """
+    Replace the indexed conversations older than max_age_days by k-means centroid memories, so the live index stays
+    bounded while older topics remain retrievable (see latent_memory/consolidation.py). The store is not modified
+    and keeps the original conversations, which the merged record of each centroid links to.
+
+    Args:
+        hdf5_file (str): Path to the HDF5 file.
+        index_file (str): Path to the FAISS index.
+        max_age_days (float): Conversations older than this are consolidated.
+        members_per_centroid (int): Average number of conversations replaced by one centroid.
 
-    return index
+    Returns:
+        index (faiss.Index): Consolidated FAISS index.
+    """
+    return consolidate_index(partial(load_data, hdf5_file), index_file, max_age_days, members_per_centroid)
 
 if __name__ == "__main__":
     # Load embeddings and metadata from HDF5
     embeddings, metadata = load_data()
 
     # Create and save the FAISS index
-    index = create_faiss_index(embeddings)
+    index = create_faiss_index(embeddings, metadata=metadata)
 
     # Verify the index
     print(f"Number of vectors in FAISS index: {index.ntotal}")
\ No newline at end of file
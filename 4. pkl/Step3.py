@@ -4,29 +4,76 @@ Script to retrieve relevant conversations using semantic search and prepare them
 Loads embeddings and metadata from a single .pkl file.
 """
 
-import numpy as np
-import faiss
-import pickle
-
-def load_data(index_file="faiss_index.bin", pickle_file="latent_memory.pkl"):
+import asyncio
+import os
+import sys
+from functools import partial
+
+# Make the shared latent_memory package importable when running this script directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from latent_memory.consolidation import with_consolidated
+from latent_memory.metrics import timed
+from latent_memory.packing import pack_context
+from latent_memory.retrieval import retrieve_batch
+from latent_memory.server import RetrievalServer
+from latent_memory.sharding import open_index
+from latent_memory.storage.pickle_store import load_metadata
+from latent_memory.storage.sqlite_metadata import SQLiteMetadataReader
+from latent_memory.tenants import DEFAULT_MEMORY_BUDGET, TenantIndexes
+
+@timed("step3.load_data")
+def load_data(index_file="faiss_index.bin", pickle_file="latent_memory.pkl", mmap=False, metadata_db=None, shard_pool="thread"):
     """
     Load the FAISS index and metadata from files.
 
     Args:
         index_file (str): Path to FAISS index file.
         pickle_file (str): Path to .pkl file containing metadata.
+        mmap (bool): Memory-map the index instead of reading it, for fast cold starts shared across processes.
+        metadata_db (str): Read the metadata from this SQLite file (written by Step 1 with metadata_db) instead,
+            fetching hits by FAISS id through its primary key.
+        shard_pool (str): For an index sharded by Step2, search the shards in parallel threads ("thread") or in
+            worker processes that memory-map them ("process"); see latent_memory/sharding.py.
 
     Returns:
-        index (faiss.Index): FAISS index for semantic search.
-        metadata (list): List of metadata entries.
+        index (faiss.Index or ShardedIndex): FAISS index for semantic search.
+        metadata (list or SQLiteMetadataReader): List of metadata entries, or the SQLite view when metadata_db is set.
     """
-    index = faiss.read_index(index_file)
-    with open(pickle_file, 'rb') as f:
-        data = pickle.load(f)
-    metadata = data["metadata"]
+    index = open_index(index_file, mmap=mmap, shard_pool=shard_pool)
+    if metadata_db:
+        # Hits are fetched by FAISS id through the primary key of the SQLite store
+        metadata = SQLiteMetadataReader(metadata_db)
+    else:
+        # Only the metadata records are unpickled; the offset table lets the embeddings be skipped
+        metadata = load_metadata(pickle_file)
+
+    # Centroids of consolidated conversations resolve to their merged records (see latent_memory/consolidation.py)
+    metadata = with_consolidated(metadata, index_file)
     return index, metadata
 
-def retrieve_relevant_conversations(query, index, metadata, k=2):
+def load_tenant(directory, mmap=False, metadata_db=None):
+    """
+    Load the FAISS index and metadata of a tenant (see latent_memory/tenants.py).
+
+    Args:
+        directory (str): Tenant directory, holding the files Step1 and Step2 wrote there under their default names.
+        mmap (bool): Memory-map the index instead of reading it.
+        metadata_db (str): File name of a SQLite metadata store inside the directory, read instead.
+
+    Returns:
+        index (faiss.Index): FAISS index of the tenant.
+        metadata: Metadata view, as returned by load_data.
+    """
+    return load_data(
+        os.path.join(directory, "faiss_index.bin"),
+        os.path.join(directory, "latent_memory.pkl"),
+        mmap=mmap,
+        metadata_db=metadata_db and os.path.join(directory, metadata_db)
+    )
+
+@timed("step3.retrieve_relevant_conversations")
+def retrieve_relevant_conversations(query, index, metadata, k=2, nprobe=None, ef_search=None, filters=None, columns=None, cache=None, recency=None):
     """
     Retrieve the top-k most relevant conversations for a given query.
 
@@ -35,39 +82,99 @@ def retrieve_relevant_conversations(query, index, metadata, k=2):
         index (faiss.Index): FAISS index for semantic search.
         metadata (list): List of metadata entries.
         k (int): Number of conversations to retrieve.
+        nprobe (int): IVF clusters visited for this query, trading recall for latency (IVF indexes only).
+        ef_search (int): HNSW candidate list size for this query, trading recall for latency (HNSW indexes only).
+        filters (dict): Metadata predicates applied inside the FAISS search, e.g. {"max_age_days": 30} or
+            {"since": "2025-04-01", "type": "image generation"} (see latent_memory/filters.py).
+        columns (dict): Filter columns saved by Step2 next to the index, from load_columns(index_file); required with filters.
+        cache (QueryCache): Optional in-process cache of query embeddings and results, e.g. QueryCache("faiss_index.bin")
+            (latent_memory/query_cache.py); cached results are dropped whenever Step2 saves the index again.
+        recency (dict): Re-rank over-fetched candidates by a blend of similarity and recency read from the timestamp
+            column in columns, e.g. {"half_life_days": 30, "weight": 0.3} (see latent_memory/ranking.py).
 
     Returns:
         relevant_conversations (list): List of relevant conversation metadata.
     """
-    # Here your logic to load your model (e.g., Sentence Transformers, BERT, etc.)
-    # model = ...
+    # A single query is a batch of one, so both entry points share the same search path
+    return retrieve_relevant_conversations_batch([query], index, metadata, k, nprobe, ef_search, filters, columns, cache, recency)[0]
 
-    # Encode the query into an embedding (placeholder)
-    # For demonstration, assume the embedding dimension matches the FAISS index (e.g., 384)
-    query_embedding = np.random.rand(1, 384).astype('float32')  # Placeholder: replace with model.encode([query])
-
-    # Search the FAISS index for the top-k most similar embeddings
-    distances, indices = index.search(query_embedding, k)
+@timed("step3.retrieve_relevant_conversations_batch")
+def retrieve_relevant_conversations_batch(queries, index, metadata, k=2, nprobe=None, ef_search=None, filters=None, columns=None, cache=None, recency=None):
+    """
+    Retrieve the top-k most relevant conversations for each query in a list.
+    All queries are encoded in one pass and searched with a single FAISS call.
 
-    # Retrieve the corresponding conversations
-    relevant_conversations = [metadata[idx] for idx in indices[0]]
+    Args:
+        queries (list): List of query strings.
+        index (faiss.Index): FAISS index for semantic search.
+        metadata (list): List of metadata entries.
+        k (int): Number of conversations to retrieve per query.
+        nprobe (int): IVF clusters visited per query (IVF indexes only).
+        ef_search (int): HNSW candidate list size per query (HNSW indexes only).
+        filters (dict): Metadata predicates applied inside the FAISS search, e.g. {"max_age_days": 30} or
+            {"since": "2025-04-01", "type": "image generation"} (see latent_memory/filters.py).
+        columns (dict): Filter columns saved by Step2 next to the index, from load_columns(index_file); required with filters.
+        cache (QueryCache): Optional in-process cache of query embeddings and results, e.g. QueryCache("faiss_index.bin")
+            (latent_memory/query_cache.py); cached results are dropped whenever Step2 saves the index again.
+        recency (dict): Re-rank over-fetched candidates by a blend of similarity and recency read from the timestamp
+            column in columns, e.g. {"half_life_days": 30, "weight": 0.3} (see latent_memory/ranking.py).
 
-    return relevant_conversations
+    Returns:
+        hits (list): One list of relevant conversation metadata per query, in query order.
+    """
+    return retrieve_batch(queries, index, metadata, k, nprobe=nprobe, ef_search=ef_search, filters=filters, columns=columns, cache=cache, recency=recency)
 
-def format_for_inference(relevant_conversations):
+@timed("step3.format_for_inference")
+def format_for_inference(relevant_conversations, token_budget=None, token_counter=None):
     """
     Format retrieved conversations as context for LLM inference.
 
     Args:
-        relevant_conversations (list): List of relevant conversation metadata.
+        relevant_conversations (list): List of relevant conversation metadata, best first.
+        token_budget (int): Maximum number of context tokens. Conversations are kept in rank order while they fit,
+            using the token counts Step1 stored with the metadata (see latent_memory/packing.py).
+        token_counter (callable): Counter for text without a stored count; should match the one used by Step1.
 
     Returns:
         context (str): Formatted context string for LLM input.
     """
-    context = "Relevant past conversations:\n"
-    for conv in relevant_conversations:
-        context += f"- {conv['summary']} (Timestamp: {conv['timestamp']})\n"
-    return context
+    return pack_context(relevant_conversations, token_budget, token_counter)
+
+def serve(index_file="faiss_index.bin", pickle_file="latent_memory.pkl", host="127.0.0.1", port=8765, unix_socket=None,
+          mmap=True, metadata_db=None, max_batch=64, max_wait_ms=2.0, tenants=None, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    Run a resident retrieval server that keeps the index loaded and answers POST /retrieve requests
+    with format_for_inference context, micro-batching concurrent queries (see latent_memory/server.py).
+    The index is reloaded in the background whenever Step2 saves it again.
+    With tenants, every tenant directory under that root is served instead, loaded on first use (see load_tenant).
+
+    Args:
+        index_file (str): Path to FAISS index file.
+        pickle_file (str): Path to pickle file.
+        host (str): Interface to listen on.
+        port (int): TCP port to listen on.
+        unix_socket (str): Listen on this Unix socket path instead of TCP.
+        mmap (bool): Memory-map the index, so reloads and other server processes share its pages.
+        metadata_db (str): Read the metadata from this SQLite file instead.
+        max_batch (int): Maximum number of queries searched together.
+        max_wait_ms (float): Longest time in milliseconds a query waits for others to join its batch.
+        tenants (str): Root of the tenant directories to serve; requests then name their "tenant".
+            metadata_db is a file name inside each tenant directory.
+        memory_budget (int): Estimated bytes the loaded tenant indexes may hold before the least recently used are evicted.
+    """
+    server = RetrievalServer(
+        partial(load_data, index_file, pickle_file, mmap=mmap, metadata_db=metadata_db),
+        retrieve_relevant_conversations_batch,
+        format_for_inference,
+        index_file=index_file,
+        max_batch=max_batch,
+        max_wait=max_wait_ms / 1000,
+        tenants=TenantIndexes(partial(load_tenant, mmap=mmap, metadata_db=metadata_db), tenants, memory_budget) if tenants else None
+    )
+    try:
+        asyncio.run(server.serve(host, port, unix_socket))
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
     # Load the FAISS index and metadata
@@ -0,0 +1,6 @@
+# latent_memory
+"""
+Shared helpers for the four Latent Memory storage variants (CSV+JSON, NumPy+JSON, HDF5 and Pickle).
+The Step scripts in each variant folder import from this package so the retrieval and storage logic
+is implemented once instead of being duplicated per format.
+"""
@@ -0,0 +1,285 @@
+# benchmark.py
+"""
+Reproducible cross-format benchmark of the four storage variants.
+
+For each variant and corpus size a synthetic corpus is streamed through the variant's own Step scripts in a
+scratch directory, and every stage runs in a fresh Python process, so timings include real imports and cold
+file opens and peak RSS is measured per stage:
+    write   Step1 ingest_stream throughput (rows per second, placeholder encoder included)
+    size    bytes on disk of the store, and of the FAISS index after the build
+    build   Step2 load_data and create_faiss_index times
+    query   Step3 cold start (imports, load_data and the first query) and per-query latency p50/p99
+
+Results are written as JSON (one record per variant and size, plus the environment they were measured on),
+so runs can be compared across commits.
+
+    python -m latent_memory.benchmark --rows 1000 10000 100000 --output benchmark.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Root of the repository, which holds the variant folders
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Variant folders by short name
+VARIANTS = {
+    "csv": "1. csv and json",
+    "npy": "2. npy and json",
+    "hdf5": "3. hdf5",
+    "pkl": "4. pkl"
+}
+
+# Corpus sizes benchmarked by default; 1e6 and 1e7 rows can be requested with --rows
+DEFAULT_ROWS = (1_000, 10_000, 100_000)
+
+# Topics mixed into the synthetic conversations, so summaries vary in content and length
+TOPICS = (
+    "reinforcement learning for LLMs",
+    "an artistic image of algorithmic feedback loops",
+    "recent papers on tool-augmented reinforcement learning",
+    "the weather for a planned trip",
+    "using LLMs to improve a coding workflow"
+)
+
+def synthetic_conversations(rows):
+    """
+    Generate a deterministic synthetic corpus.
+
+    Args:
+        rows (int): Number of conversations.
+
+    Yields:
+        conversation (str): Conversation string.
+    """
+    for i in range(rows):
+        topic = TOPICS[i % len(TOPICS)]
+        yield f"Conversation {i}: a question about {topic}" + " with more detail" * (i % 7)
+
+def load_step(variant, step):
+    """
+    Import a Step script of a variant (the folder names are not valid module names).
+
+    Args:
+        variant (str): Short variant name, a key of VARIANTS.
+        step (int): Step number.
+
+    Returns:
+        module (module): The imported Step script.
+    """
+    path = os.path.join(REPOSITORY, VARIANTS[variant], f"Step{step}.py")
+    spec = importlib.util.spec_from_file_location(f"{variant}_step{step}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def peak_rss():
+    """
+    Peak resident set size of the current process.
+
+    Returns:
+        bytes (int): Peak RSS in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def directory_bytes(directory, exclude=()):
+    """
+    Total size of the files in a directory.
+
+    Args:
+        directory (str): Directory to measure.
+        exclude (tuple): File name prefixes to leave out.
+
+    Returns:
+        bytes (int): Sum of the file sizes.
+    """
+    return sum(
+        os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+        if not name.startswith(exclude) and os.path.isfile(os.path.join(directory, name))
+    )
+
+def run_write(variant, rows, batch_size):
+    """
+    Stage run in a child process: stream the synthetic corpus through Step1.
+
+    Returns:
+        result (dict): Seconds, rows per second and peak RSS.
+    """
+    step1 = load_step(variant, 1)
+    started = time.perf_counter()
+    step1.ingest_stream(synthetic_conversations(rows), batch_size=batch_size)
+    seconds = time.perf_counter() - started
+    return {"write_seconds": seconds, "write_rows_per_second": rows / seconds, "write_peak_rss": peak_rss()}
+
+def run_build(variant, index_spec):
+    """
+    Stage run in a child process: load the store and build the FAISS index with Step2.
+
+    Returns:
+        result (dict): Load and build seconds and peak RSS.
+    """
+    step2 = load_step(variant, 2)
+    started = time.perf_counter()
+    embeddings, metadata = step2.load_data()
+    loaded = time.perf_counter()
+    step2.create_faiss_index(embeddings, index_spec=index_spec, metadata=metadata)
+    built = time.perf_counter()
+    return {"load_seconds": loaded - started, "build_seconds": built - loaded, "build_peak_rss": peak_rss()}
+
+def run_query(variant, queries, k):
+    """
+    Stage run in a child process: start Step3 cold and time single queries.
+
+    Returns:
+        result (dict): Cold start seconds, latency percentiles in milliseconds and peak RSS.
+    """
+    started = time.perf_counter()
+    step3 = load_step(variant, 3)
+    index, metadata = step3.load_data()
+    prompts = [f"Tell me more about {TOPICS[i % len(TOPICS)]} ({i})" for i in range(queries + 1)]
+    step3.format_for_inference(step3.retrieve_relevant_conversations(prompts[0], index, metadata, k=k))
+    cold_start = time.perf_counter() - started
+
+    latencies = []
+    for prompt in prompts[1:]:
+        began = time.perf_counter()
+        step3.retrieve_relevant_conversations(prompt, index, metadata, k=k)
+        latencies.append(time.perf_counter() - began)
+    latencies = np.array(latencies) * 1000
+    return {
+        "cold_start_seconds": cold_start,
+        "query_p50_ms": float(np.percentile(latencies, 50)),
+        "query_p99_ms": float(np.percentile(latencies, 99)),
+        "query_mean_ms": float(latencies.mean()),
+        "query_peak_rss": peak_rss()
+    }
+
+def run_stage(stage, directory, arguments):
+    """
+    Run one stage in a fresh Python process inside the scratch directory.
+
+    Args:
+        stage (str): "write", "build" or "query".
+        directory (str): Scratch directory holding the variant's files.
+        arguments (list): Extra command-line arguments of the stage.
+
+    Returns:
+        result (dict): Measurements reported by the stage.
+    """
+    result_file = os.path.join(directory, f"{stage}.result.json")
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([REPOSITORY, os.environ.get("PYTHONPATH", "")]))
+    completed = subprocess.run(
+        [sys.executable, "-m", "latent_memory.benchmark", "--stage", stage, "--result", result_file, *arguments],
+        cwd=directory, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Benchmark stage {stage} failed:\n{completed.stderr}")
+    with open(result_file, 'r') as f:
+        return json.load(f)
+
+def benchmark(variant, rows, index_spec="flat", queries=200, k=5, batch_size=10_000, directory=None):
+    """
+    Benchmark one variant at one corpus size.
+
+    Args:
+        variant (str): Short variant name, a key of VARIANTS.
+        rows (int): Number of synthetic conversations.
+        index_spec (str): FAISS index structure built by Step2 (see latent_memory/indexing.py).
+        queries (int): Number of timed queries.
+        k (int): Conversations retrieved per query.
+        batch_size (int): Step1 ingest batch size.
+        directory (str): Parent of the scratch directory; defaults to the system temporary directory.
+
+    Returns:
+        record (dict): Variant, rows, index spec and every measurement.
+    """
+    scratch = tempfile.mkdtemp(prefix=f"benchmark-{variant}-", dir=directory)
+    try:
+        record = {"variant": variant, "rows": rows, "index_spec": index_spec}
+        common = ["--variant", variant]
+        record.update(run_stage("write", scratch, common + ["--rows", str(rows), "--batch-size", str(batch_size)]))
+        record["store_bytes"] = directory_bytes(scratch, exclude=("faiss_index.bin", "write.result"))
+        record.update(run_stage("build", scratch, common + ["--index-spec", index_spec]))
+        record["index_bytes"] = directory_bytes(scratch) - directory_bytes(scratch, exclude=("faiss_index.bin",))
+        record.update(run_stage("query", scratch, common + ["--queries", str(queries), "--k", str(k)]))
+        return record
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+def environment():
+    """
+    Describe the machine and library versions the benchmark ran on.
+
+    Returns:
+        environment (dict): Platform, CPU count and versions of Python, NumPy and FAISS.
+    """
+    import faiss
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "faiss": getattr(faiss, "__version__", "unknown")
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Latent Memory storage variants.")
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument("--rows", nargs="+", type=int, default=list(DEFAULT_ROWS))
+    parser.add_argument("--index-spec", default="flat")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--directory", default=None, help="Where scratch stores are created (needs room for the largest corpus).")
+    parser.add_argument("--output", default="benchmark.json")
+    # Internal: run a single stage in this process (used by run_stage)
+    parser.add_argument("--stage", choices=("write", "build", "query"), help=argparse.SUPPRESS)
+    parser.add_argument("--variant", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    arguments = parser.parse_args(argv)
+
+    if arguments.stage:
+        if arguments.stage == "write":
+            result = run_write(arguments.variant, arguments.rows[0], arguments.batch_size)
+        elif arguments.stage == "build":
+            result = run_build(arguments.variant, arguments.index_spec)
+        else:
+            result = run_query(arguments.variant, arguments.queries, arguments.k)
+        with open(arguments.result, 'w') as f:
+            json.dump(result, f)
+        return
+
+    records = []
+    for rows in arguments.rows:
+        for variant in arguments.variants:
+            record = benchmark(variant, rows, arguments.index_spec, arguments.queries, arguments.k,
+                               arguments.batch_size, arguments.directory)
+            records.append(record)
+            print(
+                f"{variant:>5} {rows:>10,} rows  write {record['write_rows_per_second']:>10,.0f} rows/s  "
+                f"store {record['store_bytes'] / 2**20:>9.1f} MiB  load {record['load_seconds']:.2f}s  "
+                f"build {record['build_seconds']:.2f}s  cold start {record['cold_start_seconds']:.2f}s  "
+                f"p50 {record['query_p50_ms']:.2f}ms  p99 {record['query_p99_ms']:.2f}ms  "
+                f"peak RSS {max(record['write_peak_rss'], record['build_peak_rss'], record['query_peak_rss']) / 2**20:.0f} MiB"
+            )
+            # Rewritten after every record, so an interrupted run keeps what it measured
+            with open(arguments.output, 'w') as f:
+                json.dump({"environment": environment(), "results": records}, f, indent=2)
+    print(f"Saved benchmark results to {arguments.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# builder.py
+"""
+Index builds shared by the Step2 scripts of every variant: a full build, an incremental update with the rows
+appended to the store since the last save, and consolidation of aged rows into centroid memories.
+
+The variants differ only in how their store is read, so each Step2 passes its own loader. The loader is called
+as load_data(start=...) and returns the embeddings and metadata of the store rows from start onwards; Step2
+binds the file paths (and, for consolidation, memory-mapping) with functools.partial.
+"""
+
+import os
+
+import faiss
+
+from latent_memory.consolidation import clear_consolidation, consolidate, save_consolidation
+from latent_memory.dedup import add_distinct, append_distinct, dedup_report, load_dedup, save_dedup
+from latent_memory.filters import update_columns
+from latent_memory.indexing import add_rows, append_rows, create_index, finish_save, indexed_rows, save_index, train_index
+from latent_memory.sharding import append_shards, clear_shards, create_shards, load_manifest
+
+def build_index(embeddings, index_file="faiss_index.bin", index_spec="flat", metadata=None, dedup_threshold=None, shards=None):
+    """
+    Create a FAISS index from embeddings and save it with its sidecars.
+
+    Args:
+        embeddings (np.ndarray): Array of embeddings.
+        index_file (str): Path to save the FAISS index.
+        index_spec (str or dict): Index structure: "flat" (exact), "ivf-flat", "ivf-pq", "hnsw" or "auto"
+            to pick one from the number of embeddings. A dict can also set parameters such as nlist or M.
+        metadata (list or np.ndarray): Metadata entries of the embeddings; when given, their timestamp and attribute
+            columns are saved next to the index (faiss_index.bin.columns.npz) for metadata-filtered search in Step3.
+        dedup_threshold (float): When given, embeddings whose cosine similarity to an already indexed one reaches it
+            (e.g. 0.95) are linked to that one instead of being added (see latent_memory/dedup.py).
+        shards (int): When given, partition the embeddings into this many contiguous shards, each saved as its own
+            index file (faiss_index.bin.shard0, ...) and searched in parallel by Step3 (see latent_memory/sharding.py).
+
+    Returns:
+        index (faiss.Index or ShardedIndex): FAISS index for semantic search.
+    """
+    if shards is not None:
+        if dedup_threshold is not None:
+            raise ValueError("Near-duplicate merging is not supported for sharded indexes")
+        # Each shard is built and saved on its own, then listed in the manifest Step3 opens
+        index = create_shards(embeddings, index_file, shards, index_spec)
+        print(f"Saved FAISS index {index_file} as {len(index.shards)} shards")
+        save_dedup(index_file, None)
+        clear_consolidation(index_file)
+        if metadata is not None:
+            update_columns(index_file, metadata)
+        finish_save(index_file)
+        return index
+
+    # Get the dimension of the embeddings
+    dimension = embeddings.shape[1]
+
+    # Create a FAISS index (using Inner Product for cosine similarity)
+    # Each vector is stored under its metadata row as id, so new rows can be appended later
+    index = create_index(dimension, index_spec, ntotal=len(embeddings))
+
+    # Approximate indexes learn their clusters from a sample of the embeddings
+    train_index(index, embeddings)
+
+    # Add embeddings to the index (converted to float32 chunk by chunk), merging near-duplicates if requested
+    dedup = None
+    if dedup_threshold is None:
+        add_rows(index, embeddings, 0)
+    else:
+        dedup = add_distinct(index, embeddings, 0, dedup_threshold)
+
+    # Save the index, recording how many store rows it covers, and remove the shards of an earlier sharded build
+    save_index(index, index_file, rows=len(embeddings), finish=False)
+    clear_shards(index_file)
+    print(f"Saved FAISS index to {index_file}")
+
+    # Save the near-duplicate links (or remove those of an earlier deduplicated build);
+    # a full build indexes every conversation again, so earlier consolidations no longer apply
+    save_dedup(index_file, dedup)
+    clear_consolidation(index_file)
+    if dedup is not None:
+        report = dedup_report(dedup)
+        print(f"Merged {report['duplicates']} near-duplicates into indexed conversations (dedup ratio {report['dedup_ratio']:.1%})")
+
+    # Precompute the columns that metadata filters are evaluated on
+    if metadata is not None:
+        update_columns(index_file, metadata)
+
+    # Readers reload once the index and all of its sidecars are written
+    finish_save(index_file)
+
+    return index
+
+def update_index(load_data, index_file="faiss_index.bin", index_spec="flat", dedup_threshold=None, shards=None):
+    """
+    Add the conversations appended to the store since the index was last saved, instead of rebuilding it.
+    Only the new rows are loaded; falls back to a full build when no index exists yet.
+
+    Args:
+        load_data (callable): Loader of the variant's store, called as load_data(start=...).
+        index_file (str): Path to the FAISS index.
+        index_spec (str or dict): Index structure used when no index exists yet (see build_index).
+        dedup_threshold (float): Merge near-duplicates of indexed conversations instead of adding them. Indexes built
+            with deduplication keep deduplicating with their own threshold when this is not given.
+        shards (int): Number of shards used when no index exists yet (see build_index).
+
+    Returns:
+        index (faiss.Index or ShardedIndex): Updated FAISS index.
+    """
+    manifest = load_manifest(index_file)
+    if manifest is not None:
+        if dedup_threshold is not None:
+            raise ValueError("Near-duplicate merging is not supported for sharded indexes")
+        # Sharded index: the rows past the last bound are appended to the last shard
+        start = manifest["bounds"][-1]
+        embeddings, metadata = load_data(start=start)
+        index, added = append_shards(index_file, embeddings, metadata)
+        print(f"Added {added} vectors to the last shard of FAISS index {index_file}")
+        update_columns(index_file, metadata, start)
+        finish_save(index_file)
+        return index
+
+    if not os.path.exists(index_file):
+        embeddings, metadata = load_data(start=0)
+        return build_index(embeddings, index_file, index_spec, metadata, dedup_threshold, shards)
+
+    index = faiss.read_index(index_file)
+
+    # The index already covers the first rows of the store (including near-duplicates and consolidated rows it no longer holds)
+    start = indexed_rows(index_file, index)
+    dedup = load_dedup(index_file)
+    embeddings, metadata = load_data(start=start)
+    if dedup is None and dedup_threshold is None:
+        added = append_rows(index, embeddings, metadata, start)
+    else:
+        added, dedup = append_distinct(index, embeddings, metadata, start, dedup_threshold, dedup)
+
+    save_index(index, index_file, rows=start + len(embeddings), finish=False)
+    print(f"Added {added} vectors to FAISS index {index_file}")
+    if dedup is not None:
+        save_dedup(index_file, dedup)
+        print(f"Merged {len(embeddings) - added} near-duplicates (dedup ratio {dedup_report(dedup)['dedup_ratio']:.1%} overall)")
+
+    # Extend the filter columns with the new rows, then let readers reload
+    update_columns(index_file, metadata, start)
+    finish_save(index_file)
+
+    return index
+
+def consolidate_index(load_data, index_file="faiss_index.bin", max_age_days=90, members_per_centroid=20):
+    """
+    Replace the indexed conversations older than max_age_days by k-means centroid memories, so the live index stays
+    bounded while older topics remain retrievable (see latent_memory/consolidation.py). The store is not modified
+    and keeps the original conversations, which the merged record of each centroid links to.
+
+    Args:
+        load_data (callable): Loader of the variant's store, called as load_data(start=0).
+        index_file (str): Path to the FAISS index.
+        max_age_days (float): Conversations older than this are consolidated.
+        members_per_centroid (int): Average number of conversations replaced by one centroid.
+
+    Returns:
+        index (faiss.Index): Consolidated FAISS index.
+    """
+    if load_manifest(index_file) is not None:
+        raise ValueError("Consolidation is not supported for sharded indexes")
+    index = faiss.read_index(index_file)
+
+    # Cluster the aged rows of the whole store; loaders that memory-map their embeddings only read those rows
+    embeddings, metadata = load_data(start=0)
+    index, state, report = consolidate(index, index_file, embeddings, metadata, max_age_days, members_per_centroid)
+    if not report["centroids"]:
+        print(f"No conversations older than {max_age_days} days to consolidate")
+        return index
+
+    # The centroid records are written with the state, after the index they describe
+    save_index(index, index_file, rows=len(state["centroid_of"]), finish=False)
+    save_consolidation(index_file, state)
+    finish_save(index_file)
+    print(f"Consolidated {report['consolidated']} conversations into {report['centroids']} centroid memories ({report['ntotal']} vectors in {index_file})")
+
+    return index
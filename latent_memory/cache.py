@@ -0,0 +1,188 @@
+# cache.py
+"""
+Content-addressed, on-disk embedding cache used by convert_to_embeddings.
+Embeddings are keyed by a hash of the text, the model id and the dimension, so re-running Step1
+only sends new or changed conversations to the model.
+"""
+
+import hashlib
+import sqlite3
+
+import numpy as np
+
+from latent_memory.encoding import get_encoder
+
+# Maximum number of SQLite parameters used in a single lookup
+LOOKUP_CHUNK = 500
+
+def cache_key(text, model_id, dimension):
+    """
+    Compute the cache key of a text for a given model.
+
+    Args:
+        text (str): Text that was encoded.
+        model_id (str): Identifier of the embedding model.
+        dimension (int): Dimension of the embeddings.
+
+    Returns:
+        key (str): Hex SHA-256 digest.
+    """
+    return hashlib.sha256(f"{model_id}\0{dimension}\0{text}".encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """
+    SQLite-backed embedding cache with a size cap, least-recently-used eviction and hit/miss counters.
+    """
+
+    def __init__(self, cache_file="embedding_cache.sqlite", model_id=None, dimension=None, max_entries=1_000_000):
+        """
+        Open (or create) the cache file.
+
+        Args:
+            cache_file (str): Path to the SQLite cache file.
+            model_id (str): Identifier of the embedding model, part of every key; defaults to the model_id of the
+                encoder set with latent_memory.encoding.set_encoder.
+            dimension (int): Dimension of the embeddings, part of every key; defaults to that encoder's dimension.
+            max_entries (int): Maximum number of embeddings kept before the least recently used are evicted.
+        """
+        encoder = get_encoder()
+        self.model_id = encoder.model_id if model_id is None else model_id
+        self.dimension = encoder.dimension if dimension is None else dimension
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.connection = sqlite3.connect(cache_file)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.connection.commit()
+        # Logical clock used to order entries by recency, and the number of entries, kept up to date by put_many
+        self.clock, self.entries = self.connection.execute(
+            "SELECT COALESCE(MAX(last_used), 0), COUNT(*) FROM embeddings"
+        ).fetchone()
+
+    def __len__(self):
+        return self.entries
+
+    def get_many(self, keys):
+        """
+        Look up embeddings by key and mark the ones found as recently used.
+
+        Args:
+            keys (list): List of cache keys.
+
+        Returns:
+            found (dict): Mapping of key to float32 embedding for the keys present in the cache.
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        for start in range(0, len(unique_keys), LOOKUP_CHUNK):
+            chunk = unique_keys[start:start + LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            for key, vector in rows:
+                found[key] = np.frombuffer(vector, dtype='float32')
+        if found:
+            self.clock += 1
+            self.connection.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?", [(self.clock, key) for key in found]
+            )
+            self.connection.commit()
+        return found
+
+    def put_many(self, keys, embeddings):
+        """
+        Store embeddings and evict the least recently used entries beyond max_entries.
+        Keys already cached keep their embedding (keys are content hashes) and are only marked as recently used.
+
+        Args:
+            keys (list): List of cache keys.
+            embeddings (np.ndarray): Array of shape (len(keys), dimension).
+        """
+        self.clock += 1
+        embeddings = np.asarray(embeddings, dtype='float32')
+        inserted = self.connection.executemany(
+            "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, embedding.tobytes(), self.clock) for key, embedding in zip(keys, embeddings)]
+        ).rowcount
+        if inserted < len(keys):
+            self.connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(self.clock, key) for key in keys])
+        # The entry count is tracked here instead of counting the table on every call
+        self.entries += inserted
+        excess = self.entries - self.max_entries
+        if excess > 0:
+            self.connection.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+            )
+            self.entries -= excess
+            self.evictions += excess
+        self.connection.commit()
+
+    def encode(self, texts, encode, encoder=None):
+        """
+        Encode texts, sending only the cache misses to the model in a single batch.
+
+        Args:
+            texts (list): List of texts to encode.
+            encode (callable): Model function mapping a list of texts to an array of embeddings.
+            encoder: Encoder behind encode; defaults to the one set with set_encoder. Its model_id and dimension
+                must be the cache's, so embeddings of another model are never returned.
+
+        Returns:
+            embeddings (np.ndarray): Float32 array of shape (len(texts), dimension), in input order.
+        """
+        encoder = encoder or get_encoder()
+        if (encoder.model_id, encoder.dimension) != (self.model_id, self.dimension):
+            raise ValueError(
+                f"Cache is keyed for {self.model_id!r} ({self.dimension} dimensions), "
+                f"but the encoder is {encoder.model_id!r} ({encoder.dimension} dimensions)"
+            )
+        keys = [cache_key(text, self.model_id, self.dimension) for text in texts]
+        found = self.get_many(keys)
+
+        # Encode each missing text once, even if it appears several times in the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self.hits += len(keys) - sum(1 for key in keys if key in missing)
+        self.misses += sum(1 for key in keys if key in missing)
+
+        if missing:
+            new_embeddings = np.asarray(encode(list(missing.values())), dtype='float32')
+            self.put_many(list(missing), new_embeddings)
+            found.update(zip(missing, new_embeddings))
+
+        embeddings = np.empty((len(texts), self.dimension), dtype='float32')
+        for row, key in enumerate(keys):
+            embeddings[row] = found[key]
+        return embeddings
+
+    def stats(self):
+        """
+        Report cache counters.
+
+        Returns:
+            stats (dict): Hits, misses, hit rate, evictions and current number of entries.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self)
+        }
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
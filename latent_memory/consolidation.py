@@ -0,0 +1,327 @@
+# consolidation.py
+"""
+Memory consolidation: conversations older than a cutoff are clustered with k-means, and each cluster is replaced
+in the live FAISS index by its centroid, so the index stays bounded while older topics remain retrievable.
+
+Nothing is deleted from the variant's store, which acts as cold storage. Each centroid gets a merged metadata
+record, saved next to the index (faiss_index.bin.consolidated.jsonl), that links to the store rows and
+conversation ids it replaced. Centroids are indexed under ids from CONSOLIDATED_BASE upwards, and Step3 resolves
+them through ConsolidatedMetadata. Which store rows were consolidated, and the centroid vectors themselves,
+are kept in faiss_index.bin.consolidated.npz.
+
+Filtered searches never return centroids: the filter columns (latent_memory/filters.py) cover store rows only,
+so the selector built from them excludes every id from CONSOLIDATED_BASE upwards. Consolidated memories are only
+reached by searches without filters, and recency re-ranking gives them a recency of 0 for the same reason.
+"""
+
+import math
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from latent_memory.dedup import load_dedup
+from latent_memory.filters import column_values, parse_timestamp
+from latent_memory.indexing import ADD_CHUNK, indexed_rows
+from latent_memory.storage.json_metadata import JSONLMetadataReader, JSONLMetadataWriter, sync_index
+
+# FAISS id of the first centroid; store rows stay below it
+CONSOLIDATED_BASE = 1 << 40
+
+# Conversations represented by one centroid, on average
+MEMBERS_PER_CENTROID = 20
+
+# k-means iterations
+KMEANS_ITERATIONS = 20
+
+def records_file(index_file):
+    """
+    Path of the merged metadata records of the centroids of an index.
+
+    Args:
+        index_file (str): Path to the FAISS index.
+
+    Returns:
+        path (str): Path of the JSON Lines file.
+    """
+    return index_file + ".consolidated.jsonl"
+
+def state_file(index_file):
+    """
+    Path of the consolidation state of an index.
+
+    Args:
+        index_file (str): Path to the FAISS index.
+
+    Returns:
+        path (str): Path of the .npz file.
+    """
+    return index_file + ".consolidated.npz"
+
+def load_consolidation(index_file="faiss_index.bin"):
+    """
+    Load the consolidation state of an index.
+
+    Args:
+        index_file (str): Path to the FAISS index.
+
+    Returns:
+        state (dict): "centroid_of" (int64 per store row, the FAISS id of the centroid that replaced it, or -1)
+            and "centroids" (float32 array, one vector per centroid), or None if the index was never consolidated.
+    """
+    path = state_file(index_file)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return {"centroid_of": data["centroid_of"], "centroids": data["centroids"]}
+
+def save_consolidation(index_file, state):
+    """
+    Save the consolidation state of an index: append the records of its new centroids, then replace the state
+    file atomically. Call it once the consolidated index is saved.
+
+    Records past the previously saved state, left by a run interrupted before saving it, are dropped first,
+    so centroid i always resolves to record i.
+
+    Args:
+        index_file (str): Path to the FAISS index.
+        state (dict): State as returned by consolidate, or by load_consolidation.
+    """
+    records = state.get("records", [])
+    saved = len(state["centroids"]) - len(records)
+    path = records_file(index_file)
+    if os.path.exists(path):
+        ends = sync_index(path)
+        if len(ends) > saved:
+            # The row and id indexes of the records file are rebuilt by the writer below or the next reader
+            os.truncate(path, int(ends[saved - 1]) if saved else 0)
+    if records:
+        with JSONLMetadataWriter(path, append=True) as writer:
+            writer.append(records)
+
+    path = state_file(index_file)
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".npz")
+    with os.fdopen(handle, 'wb') as f:
+        np.savez(f, centroid_of=state["centroid_of"], centroids=state["centroids"])
+    os.replace(temporary, path)
+
+def clear_consolidation(index_file):
+    """
+    Remove the consolidation files of an index, e.g. when it is rebuilt from the whole store.
+
+    Args:
+        index_file (str): Path to the FAISS index.
+    """
+    for path in (records_file(index_file), records_file(index_file) + ".offsets", records_file(index_file) + ".ids", state_file(index_file)):
+        if os.path.exists(path):
+            os.remove(path)
+
+def read_rows(embeddings, rows):
+    """
+    Read selected rows of a (possibly memory-mapped) embedding array as float32, chunk by chunk.
+
+    Args:
+        embeddings (np.ndarray): Array of shape (n, dimension).
+        rows (np.ndarray): Sorted row numbers.
+
+    Returns:
+        vectors (np.ndarray): Float32 array of shape (len(rows), dimension).
+    """
+    return np.concatenate(
+        [np.asarray(embeddings[rows[i:i + ADD_CHUNK]], dtype='float32') for i in range(0, len(rows), ADD_CHUNK)]
+    ) if len(rows) else np.zeros((0, embeddings.shape[1]), dtype='float32')
+
+def merged_record(number, members, distances, metadata):
+    """
+    Build the metadata record of a centroid from the entries it replaces.
+
+    Args:
+        number (int): Position of the centroid among all centroids of the index.
+        members (np.ndarray): Store rows in the cluster.
+        distances (np.ndarray): Distance of each member to the centroid.
+        metadata (dict): Member fields ("conversation_id", "summary", "timestamp" lists and parsed "seconds"), by store row.
+
+    Returns:
+        record (dict): Record with the summary of the most central member, the timestamp range of the cluster
+            and the store rows and conversation ids of every member.
+    """
+    central = int(members[np.argmin(distances)])
+    seconds = [metadata["seconds"][int(row)] for row in members]
+    newest = int(members[np.nanargmax(seconds)]) if not np.all(np.isnan(seconds)) else central
+    oldest = int(members[np.nanargmin(seconds)]) if not np.all(np.isnan(seconds)) else central
+    others = len(members) - 1
+    return {
+        "conversation_id": f"consolidated_{number}",
+        "summary": f"{metadata['summary'][central]} (and {others} related conversations)" if others else metadata["summary"][central],
+        "timestamp": metadata["timestamp"][newest],
+        "first_timestamp": metadata["timestamp"][oldest],
+        "type": "consolidated",
+        "members": [int(row) for row in members],
+        "member_ids": [metadata["conversation_id"][int(row)] for row in members]
+    }
+
+def consolidate(index, index_file, embeddings, metadata, max_age_days=90, members_per_centroid=MEMBERS_PER_CENTROID,
+                now=None, seed=0):
+    """
+    Replace the indexed conversations older than a cutoff by k-means centroids.
+
+    Args:
+        index (faiss.Index): Live index, as saved at index_file.
+        index_file (str): Path to the FAISS index (its sidecars are read, and the records of new centroids written).
+        embeddings (np.ndarray): Embeddings of the whole store, possibly memory-mapped.
+        metadata (list or np.ndarray): Metadata entries of the whole store.
+        max_age_days (float): Conversations older than this are consolidated.
+        members_per_centroid (int): Average number of conversations per centroid; sets the number of clusters.
+        now (float): Reference time in epoch seconds; defaults to the current time.
+        seed (int): Seed of k-means, so runs are reproducible.
+
+    Returns:
+        index (faiss.Index): Updated index (a new object when the index type cannot remove vectors).
+        state (dict): New consolidation state, with the merged "records" of the new centroids, to save with
+            save_consolidation after the index.
+        report (dict): consolidated (conversations replaced), centroids (centroids added) and ntotal (live vectors).
+    """
+    # Indexes without an id map renumber their vectors when some are removed, so centroid ids could not be kept
+    if not isinstance(index, (faiss.IndexIDMap, faiss.IndexIVF)):
+        raise ValueError(f"Cannot consolidate {type(index).__name__}: rebuild the index with ids (Step2 create_faiss_index) first")
+    rows = indexed_rows(index_file, index)
+    state = load_consolidation(index_file)
+    centroid_of = np.full(rows, -1, dtype='int64')
+    centroids = np.zeros((0, embeddings.shape[1]), dtype='float32')
+    if state is not None:
+        centroid_of[:len(state["centroid_of"])] = state["centroid_of"][:rows]
+        centroids = state["centroids"]
+
+    # Live store rows: indexed, not merged into a near-duplicate and not consolidated yet
+    live = centroid_of < 0
+    dedup = load_dedup(index_file)
+    if dedup is not None:
+        live[:len(dedup["canonical"])] &= dedup["canonical"][:rows] < 0
+
+    fields = {name: column_values(metadata[:rows], name) for name in ("conversation_id", "summary", "timestamp")}
+    fields["seconds"] = np.array([parse_timestamp(value) for value in fields["timestamp"]], dtype='float64')
+    cutoff = (time.time() if now is None else now) - max_age_days * 86400
+    aged = np.flatnonzero(live & (fields["seconds"] < cutoff))
+    report = {"consolidated": 0, "centroids": 0, "ntotal": index.ntotal}
+    if len(aged) < 2:
+        return index, {"centroid_of": centroid_of, "centroids": centroids, "records": []}, report
+
+    # Batched k-means: FAISS trains on at most 256 sampled points per centroid, then every aged row is assigned
+    vectors = read_rows(embeddings, aged)
+    clusters = max(1, math.ceil(len(aged) / members_per_centroid))
+    kmeans = faiss.Kmeans(vectors.shape[1], clusters, niter=KMEANS_ITERATIONS, seed=seed, verbose=False)
+    kmeans.train(vectors)
+    distances, assignment = kmeans.index.search(vectors, 1)
+    distances, assignment = distances[:, 0], assignment[:, 0]
+
+    # Clusters left empty by k-means are dropped
+    used = np.unique(assignment)
+    first = len(centroids)
+    ids = CONSOLIDATED_BASE + first + np.arange(len(used), dtype='int64')
+    new_centroids = kmeans.centroids[used].astype('float32')
+    records = []
+    for number, cluster in enumerate(used):
+        members = assignment == cluster
+        records.append(merged_record(first + number, aged[members], distances[members], fields))
+        centroid_of[aged[members]] = ids[number]
+
+    # Swap the aged vectors for the centroids
+    try:
+        index.remove_ids(faiss.IDSelectorBatch(aged.astype('int64')))
+        index.add_with_ids(new_centroids, ids)
+    except RuntimeError:
+        # Graph indexes (HNSW) cannot drop vectors: rebuild the same structure from the vectors that stay
+        index = faiss.clone_index(index)
+        index.reset()
+        keep = np.flatnonzero(live & (centroid_of < 0))
+        for offset in range(0, len(keep), ADD_CHUNK):
+            chunk = keep[offset:offset + ADD_CHUNK]
+            index.add_with_ids(read_rows(embeddings, chunk), chunk.astype('int64'))
+        all_centroids = np.concatenate([centroids, new_centroids])
+        if len(all_centroids):
+            index.add_with_ids(all_centroids, CONSOLIDATED_BASE + np.arange(len(all_centroids), dtype='int64'))
+
+    report = {"consolidated": len(aged), "centroids": len(used), "ntotal": index.ntotal}
+    return index, {"centroid_of": centroid_of, "centroids": np.concatenate([centroids, new_centroids]), "records": records}, report
+
+class ConsolidatedMetadata:
+    """
+    Metadata view for Step3 that resolves centroid ids to their merged records and every other id to the store.
+    """
+
+    def __init__(self, metadata, index_file="faiss_index.bin"):
+        """
+        Wrap the metadata of a variant.
+
+        Args:
+            metadata (list, np.ndarray or reader): Metadata returned by the variant's load_data.
+            index_file (str): Path to the FAISS index whose centroid records are read.
+        """
+        self.metadata = metadata
+        self.records = JSONLMetadataReader(records_file(index_file))
+
+    def __len__(self):
+        return len(self.metadata)
+
+    def __getitem__(self, row):
+        if row >= CONSOLIDATED_BASE:
+            return self.records[row - CONSOLIDATED_BASE]
+        return self.metadata[row]
+
+    def fetch_rows(self, rows):
+        """
+        Read several rows, store rows and centroid records alike.
+
+        Args:
+            rows (np.ndarray): Sorted, unique FAISS ids.
+
+        Returns:
+            entries (list): One metadata entry per id, in the same order.
+        """
+        rows = np.asarray(rows)
+        stored = rows[rows < CONSOLIDATED_BASE]
+        if hasattr(self.metadata, 'fetch_rows'):
+            entries = list(self.metadata.fetch_rows(stored)) if len(stored) else []
+        else:
+            entries = [self.metadata[int(row)] for row in stored]
+        return entries + [self.records[int(row) - CONSOLIDATED_BASE] for row in rows[rows >= CONSOLIDATED_BASE]]
+
+    def originals(self, record):
+        """
+        Read the store entries a centroid record replaced, from cold storage.
+
+        Args:
+            record (dict): Merged record of a centroid.
+
+        Returns:
+            entries (list): Metadata entries of its members, in store order.
+        """
+        return self.fetch_rows(np.array(record["members"], dtype='int64'))
+
+    def close(self):
+        self.records.close()
+        if hasattr(self.metadata, 'close'):
+            self.metadata.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def with_consolidated(metadata, index_file="faiss_index.bin"):
+    """
+    Make the centroid records of a consolidated index resolvable next to the store metadata.
+
+    Args:
+        metadata (list, np.ndarray or reader): Metadata returned by the variant's load_data.
+        index_file (str): Path to the FAISS index.
+
+    Returns:
+        metadata: ConsolidatedMetadata when the index has centroids, else the metadata unchanged.
+    """
+    if not os.path.exists(records_file(index_file)):
+        return metadata
+    return ConsolidatedMetadata(metadata, index_file)
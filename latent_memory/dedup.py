@@ -0,0 +1,209 @@
+# dedup.py
+"""
+Near-duplicate suppression for the FAISS index built by Step2.
+
+Every conversation stays in the variant's store, but a vector whose cosine similarity to an indexed vector (or to
+an earlier vector of the same batch) reaches the threshold is not added to the index. It is linked to that vector
+instead, so index size and search cost grow with distinct content. The links are saved next to the index
+(faiss_index.bin.dedup.npz): for every store row, the FAISS id it was merged into (-1 for rows that were indexed),
+along with the norm of each row and the threshold used.
+
+Rows are checked in chunks: each chunk is searched against the index, compared with itself in one matrix
+product, and its distinct rows are added before the next chunk, so duplicates spread across chunks are caught too.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from latent_memory.indexing import search_parameters
+
+# Cosine similarity at or above which a vector counts as a near-duplicate
+DEFAULT_THRESHOLD = 0.95
+
+# Rows checked together (the within-chunk similarity matrix is DEDUP_CHUNK x DEDUP_CHUNK)
+DEDUP_CHUNK = 4096
+
+# Indexed vectors considered per incoming vector
+CANDIDATES = 4
+
+# IVF clusters and HNSW candidates visited by the duplicate search; a near-duplicate usually falls in the cluster
+# of its original, but the FAISS defaults (1 cluster, 16 candidates) still miss those near cluster boundaries
+DEDUP_NPROBE = 8
+DEDUP_EF_SEARCH = 64
+
+def dedup_file(index_file):
+    """
+    Path of the duplicate links saved next to a FAISS index.
+
+    Args:
+        index_file (str): Path to the FAISS index.
+
+    Returns:
+        path (str): Path of the .npz file.
+    """
+    return index_file + ".dedup.npz"
+
+def load_dedup(index_file="faiss_index.bin"):
+    """
+    Load the duplicate links saved next to a FAISS index.
+
+    Args:
+        index_file (str): Path to the FAISS index.
+
+    Returns:
+        dedup (dict): "canonical" (int64 per store row, -1 when indexed, else the FAISS id it was merged into),
+            "norms" (float32 per store row) and "threshold", or None when the index was built without deduplication.
+    """
+    path = dedup_file(index_file)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return {"canonical": data["canonical"], "norms": data["norms"], "threshold": float(data["threshold"])}
+
+def save_dedup(index_file, dedup):
+    """
+    Save the duplicate links next to a FAISS index, atomically.
+
+    Args:
+        index_file (str): Path to the FAISS index.
+        dedup (dict): Links as returned by add_distinct, or None for an index built without deduplication,
+            which removes the links of an earlier build.
+    """
+    path = dedup_file(index_file)
+    if dedup is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".npz")
+    with os.fdopen(handle, 'wb') as f:
+        np.savez(f, canonical=dedup["canonical"], norms=dedup["norms"], threshold=np.float64(dedup["threshold"]))
+    os.replace(temporary, path)
+
+def add_distinct(index, embeddings, start, threshold=DEFAULT_THRESHOLD, dedup=None, chunk_size=DEDUP_CHUNK,
+                 nprobe=DEDUP_NPROBE, ef_search=DEDUP_EF_SEARCH):
+    """
+    Add embeddings to an index under the ids start, start + 1, ..., skipping near-duplicates.
+
+    Args:
+        index (faiss.Index): Trained index with explicit ids (see latent_memory/indexing.py).
+        embeddings (np.ndarray): Array of shape (n, dimension), possibly memory-mapped.
+        start (int): Store row of the first embedding.
+        threshold (float): Cosine similarity at or above which a row is merged instead of added.
+        dedup (dict): Links of the rows before start, as returned by load_dedup, to extend.
+        chunk_size (int): Rows checked together.
+        nprobe (int): IVF clusters visited when searching the index for duplicates.
+        ef_search (int): HNSW candidate list size when searching the index for duplicates.
+
+    Returns:
+        dedup (dict): Links of every store row up to start + n.
+    """
+    canonical = [np.full(0, -1, dtype='int64')] if dedup is None else [dedup["canonical"]]
+    norms = np.zeros(0, dtype='float32') if dedup is None else dedup["norms"]
+    if dedup is None and index.ntotal:
+        # Rows indexed before deduplication was enabled: kept, with unknown norms, so nothing is merged into them
+        canonical.append(np.full(start, -1, dtype='int64'))
+        norms = np.full(start, np.nan, dtype='float32')
+
+    # Norms of every row, filled chunk by chunk; candidates are only looked up among the rows filled so far
+    known_norms = np.empty(len(norms) + len(embeddings), dtype='float32')
+    known_norms[:len(norms)] = norms
+    known = len(norms)
+    params = search_parameters(index, nprobe, ef_search)
+
+    for offset in range(0, len(embeddings), chunk_size):
+        chunk = np.ascontiguousarray(embeddings[offset:offset + chunk_size], dtype='float32')
+        ids = np.arange(start + offset, start + offset + len(chunk), dtype='int64')
+        chunk_norms = np.linalg.norm(chunk, axis=1).astype('float32')
+        unit = chunk / np.maximum(chunk_norms, 1e-12)[:, None]
+        links = np.full(len(chunk), -1, dtype='int64')
+
+        # Against the index: inner products with unit queries, divided by the norm of each candidate, are cosines
+        if index.ntotal:
+            scores, found = index.search(unit, min(CANDIDATES, index.ntotal), params=params)
+            # Centroids of consolidated memories (ids past the store rows) are not merge targets
+            valid = (found >= 0) & (found < known)
+            cosines = np.where(valid, scores / known_norms[np.where(valid, found, 0)], -np.inf)
+            cosines = np.nan_to_num(cosines, nan=-np.inf)
+            best = cosines.argmax(axis=1)
+            matched = cosines[np.arange(len(chunk)), best] >= threshold
+            links[matched] = found[np.arange(len(chunk)), best][matched]
+
+        # Within the chunk: one similarity matrix, and a row is merged into the first earlier distinct row it matches
+        similar = np.tril(unit @ unit.T >= threshold, k=-1)
+        for row in np.flatnonzero(similar.any(axis=1) & (links < 0)):
+            earlier = np.flatnonzero(similar[row, :row] & (links[:row] < 0))
+            if len(earlier):
+                links[row] = ids[earlier[0]]
+
+        distinct = links < 0
+        if distinct.any():
+            index.add_with_ids(chunk[distinct], ids[distinct])
+        canonical.append(links)
+        known_norms[known:known + len(chunk)] = chunk_norms
+        known += len(chunk)
+
+    return {"canonical": np.concatenate(canonical), "norms": known_norms, "threshold": threshold}
+
+def append_distinct(index, embeddings, metadata, start, threshold=None, dedup=None, nprobe=DEDUP_NPROBE,
+                    ef_search=DEDUP_EF_SEARCH):
+    """
+    Add the rows appended to the store since the index was last saved, skipping near-duplicates.
+
+    Args:
+        index (faiss.Index): Existing index.
+        embeddings (np.ndarray): Embeddings of the new rows only.
+        metadata (list or np.ndarray): Metadata entries of the new rows only.
+        start (int): Store row of the first new embedding (index.ntotal plus the rows merged away).
+        threshold (float): Similarity threshold; defaults to the one the index was built with.
+        dedup (dict): Links saved with the index, or None if it was built without deduplication.
+        nprobe (int): IVF clusters visited when searching the index for duplicates.
+        ef_search (int): HNSW candidate list size when searching the index for duplicates.
+
+    Returns:
+        added (int): Number of vectors added.
+        dedup (dict): Links of every store row up to the last new one.
+    """
+    if len(embeddings) != len(metadata):
+        raise ValueError(
+            f"Store is inconsistent: {len(embeddings)} new embeddings but {len(metadata)} new metadata entries"
+        )
+    if threshold is None:
+        threshold = DEFAULT_THRESHOLD if dedup is None else dedup["threshold"]
+    before = index.ntotal
+    dedup = add_distinct(index, embeddings, start, threshold, dedup, nprobe=nprobe, ef_search=ef_search)
+    return index.ntotal - before, dedup
+
+def dedup_report(dedup):
+    """
+    Summarize how many rows were merged.
+
+    Args:
+        dedup (dict): Links as returned by add_distinct or load_dedup.
+
+    Returns:
+        report (dict): rows (store rows covered), indexed (rows in the index), duplicates (rows merged)
+            and dedup_ratio (duplicates / rows).
+    """
+    rows = len(dedup["canonical"])
+    duplicates = int((dedup["canonical"] >= 0).sum())
+    return {
+        "rows": rows,
+        "indexed": rows - duplicates,
+        "duplicates": duplicates,
+        "dedup_ratio": duplicates / rows if rows else 0.0
+    }
+
+def linked_rows(dedup, row):
+    """
+    Store rows merged into an indexed row, e.g. to show every occurrence of a retrieved memory.
+
+    Args:
+        dedup (dict): Links as returned by load_dedup.
+        row (int): FAISS id of an indexed row.
+
+    Returns:
+        rows (np.ndarray): Store rows merged into it, in ascending order.
+    """
+    return np.flatnonzero(dedup["canonical"] == row)
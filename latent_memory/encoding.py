@@ -0,0 +1,207 @@
+# encoding.py
+"""
+Embedding helpers shared by every variant.
+Keeps the encoder in a single place so conversations and queries are encoded the same way.
+
+An encoder is any object with an encode(texts) method returning a float32 array of shape (len(texts), dimension),
+a dimension attribute and a model_id attribute (part of the EmbeddingCache keys). Step1 and Step3 use the encoder
+set with set_encoder, the random placeholder until a real model is plugged in:
+
+    from latent_memory.encoding import SentenceTransformerEncoder, set_encoder
+    set_encoder(SentenceTransformerEncoder("all-MiniLM-L6-v2"))
+
+encode_parallel runs an encoder over many texts: they are sorted by length, so each batch holds texts of similar
+length and models pad less, batched, spread over a thread or process pool, and returned in their original order.
+"""
+
+import hashlib
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+# Embedding dimension of all-MiniLM-L6-v2, used by the placeholder encoder
+EMBEDDING_DIMENSION = 384
+
+# Texts encoded per batch by encode_parallel
+ENCODE_BATCH = 64
+
+# Ways of running encode_parallel batches concurrently
+ENCODE_POOLS = ("thread", "process")
+
+# Words, as split by HashingEncoder
+WORD = re.compile(r"\w+")
+
+class PlaceholderEncoder:
+    """
+    Random embeddings standing in for a real model (replace with SentenceTransformerEncoder or your own encoder).
+    """
+
+    model_id = "placeholder"
+
+    def __init__(self, dimension=EMBEDDING_DIMENSION):
+        self.dimension = dimension
+
+    def encode(self, texts):
+        return np.random.rand(len(texts), self.dimension).astype('float32')
+
+class HashingEncoder:
+    """
+    Deterministic local encoder for tests: words and character trigrams of the words are hashed into signed
+    buckets (the hashing trick) and the vector is L2-normalized, so texts sharing words get a high inner product.
+    Needs no model and gives the same vectors in every process and on every machine.
+    """
+
+    def __init__(self, dimension=EMBEDDING_DIMENSION, ngram=3):
+        """
+        Args:
+            dimension (int): Dimension of the embeddings.
+            ngram (int): Length of the character n-grams hashed besides the words (0 for words only).
+        """
+        self.dimension = dimension
+        self.ngram = ngram
+        self.model_id = f"hashing-{ngram}"
+
+    def features(self, text):
+        """
+        Hashed features of a text.
+
+        Args:
+            text (str): Text to encode.
+
+        Returns:
+            buckets (np.ndarray): Bucket of every feature.
+            signs (np.ndarray): Sign (+1 or -1) of every feature.
+        """
+        features = []
+        for word in WORD.findall(text.lower()):
+            features.append(word)
+            padded = f"<{word}>"
+            features.extend(padded[i:i + self.ngram] for i in range(len(padded) - self.ngram + 1) if self.ngram)
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little') for feature in features],
+            dtype='uint64'
+        )
+        return (hashes % np.uint64(self.dimension)).astype('int64'), np.where(hashes >> np.uint64(63), 1.0, -1.0)
+
+    def encode(self, texts):
+        embeddings = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            buckets, signs = self.features(text)
+            np.add.at(embeddings[row], buckets, signs)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+class SentenceTransformerEncoder:
+    """
+    Encoder backed by a Sentence Transformers model (requires pip install sentence-transformers).
+    """
+
+    def __init__(self, model_name="all-MiniLM-L6-v2", device=None, normalize=True):
+        """
+        Load the model.
+
+        Args:
+            model_name (str): Model name or path.
+            device (str): Device to run on, e.g. "cuda"; chosen by the library when None.
+            normalize (bool): L2-normalize the embeddings, so inner-product search ranks by cosine similarity.
+        """
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device=device)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.model_id = model_name
+        self.normalize = normalize
+
+    def encode(self, texts):
+        return np.asarray(
+            self.model.encode(list(texts), batch_size=len(texts) or 1, convert_to_numpy=True, normalize_embeddings=self.normalize),
+            dtype='float32'
+        )
+
+# Encoder used by encode_texts and Step1 when none is passed
+_encoder = PlaceholderEncoder()
+
+def set_encoder(encoder):
+    """
+    Set the encoder used for conversations and queries when none is passed explicitly.
+
+    Args:
+        encoder: Object with encode(texts), dimension and model_id (see the module docstring).
+    """
+    global _encoder
+    _encoder = encoder
+
+def get_encoder():
+    return _encoder
+
+def encode_texts(texts, dimension=EMBEDDING_DIMENSION, encoder=None):
+    """
+    Encode a list of texts into embeddings in a single pass.
+
+    Args:
+        texts (list): List of strings to encode.
+        dimension (int): Dimension the embeddings must have, e.g. the dimension of the FAISS index.
+        encoder: Encoder to use; defaults to the one set with set_encoder.
+
+    Returns:
+        embeddings (np.ndarray): Float32 array of shape (len(texts), dimension).
+    """
+    encoder = encoder or _encoder
+    if isinstance(encoder, PlaceholderEncoder) and encoder.dimension != dimension:
+        encoder = PlaceholderEncoder(dimension)
+    elif encoder.dimension != dimension:
+        raise ValueError(f"Encoder {encoder.model_id!r} produces {encoder.dimension}-dimensional embeddings, expected {dimension}")
+    return np.asarray(encoder.encode(texts), dtype='float32')
+
+# Encoder of a worker process of encode_parallel
+_worker_encoder = None
+
+def _start_worker(encoder):
+    global _worker_encoder
+    _worker_encoder = encoder
+
+def _encode_worker_batch(texts):
+    return _worker_encoder.encode(texts)
+
+def encode_parallel(texts, encoder=None, batch_size=ENCODE_BATCH, workers=None, pool="thread"):
+    """
+    Encode many texts in length-sorted batches spread over a pool, keeping their order.
+
+    Args:
+        texts (list): List of strings to encode.
+        encoder: Encoder to use; defaults to the one set with set_encoder.
+        batch_size (int): Texts per encode call.
+        workers (int): Batches encoded concurrently; 1 encodes them one after the other in this thread.
+            Defaults to the pool's own default.
+        pool (str): "thread" for encoders that release the GIL (PyTorch, ONNX Runtime, remote APIs);
+            "process" for pure-Python encoders such as HashingEncoder. Worker processes are spawned and get a
+            pickled copy of the encoder, so it must be picklable and cheap to send.
+
+    Returns:
+        embeddings (np.ndarray): Float32 array of shape (len(texts), encoder.dimension), in the order of texts.
+    """
+    if pool not in ENCODE_POOLS:
+        raise ValueError(f"Unknown encode pool {pool!r}, expected one of {ENCODE_POOLS}")
+    encoder = encoder or _encoder
+    texts = list(texts)
+    embeddings = np.empty((len(texts), encoder.dimension), dtype='float32')
+
+    # Sort by length so each batch holds texts of similar length, and remember where each one came from
+    order = np.argsort([len(text) for text in texts], kind='stable')
+    batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    inputs = [[texts[j] for j in batch] for batch in batches]
+
+    if len(batches) <= 1 or workers == 1:
+        for batch, batch_texts in zip(batches, inputs):
+            embeddings[batch] = encoder.encode(batch_texts)
+        return embeddings
+    if pool == "thread":
+        executor = ThreadPoolExecutor(workers, thread_name_prefix="encode")
+    else:
+        executor = ProcessPoolExecutor(workers, mp_context=get_context("spawn"), initializer=_start_worker, initargs=(encoder,))
+    with executor:
+        # Results are scattered back to the original positions of their texts
+        for batch, encoded in zip(batches, executor.map(encoder.encode if pool == "thread" else _encode_worker_batch, inputs)):
+            embeddings[batch] = encoded
+    return embeddings
@@ -0,0 +1,220 @@
+# filters.py
+"""
+Metadata-filtered search: predicates on the timestamp and attribute columns of the metadata are turned
+into a FAISS id selector, so the search itself skips the vectors that do not match instead of
+over-fetching and filtering the hits afterwards.
+
+The columns are precomputed by Step2 next to the index (faiss_index.bin.columns.npz): timestamps as
+epoch seconds, and attributes such as type or tenant as integer codes into a small vocabulary. A filter
+is then evaluated with a few vectorized NumPy comparisons over those arrays.
+"""
+
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import faiss
+import numpy as np
+
+# Attribute columns precomputed for filtering, besides the timestamp
+ATTRIBUTE_COLUMNS = ("type", "tenant")
+
+# Timestamp layouts tried in order, after ISO 8601
+TIMESTAMP_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+
+def columns_file(index_file):
+    """
+    Path of the filter columns saved next to a FAISS index.
+
+    Args:
+        index_file (str): Path to the FAISS index.
+
+    Returns:
+        path (str): Path of the .npz file.
+    """
+    return index_file + ".columns.npz"
+
+def parse_timestamp(value):
+    """
+    Convert a timestamp to epoch seconds.
+
+    Args:
+        value (str, datetime, int or float): Timestamp as stored in the metadata, a datetime, or epoch seconds.
+
+    Returns:
+        seconds (float): Epoch seconds, or NaN when the value is missing or cannot be parsed.
+    """
+    if value is None:
+        return float("nan")
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        pass
+    for layout in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, layout).timestamp()
+        except ValueError:
+            continue
+    return float("nan")
+
+def column_values(metadata, name):
+    """
+    Read one field of every metadata entry.
+
+    Args:
+        metadata (list or np.ndarray): Metadata entries as dicts, or a structured array (HDF5 variant).
+        name (str): Field to read.
+
+    Returns:
+        values (list): One value per entry (None when the entry has no such field), strings decoded.
+    """
+    if isinstance(metadata, np.ndarray) and metadata.dtype.names is not None:
+        if name not in metadata.dtype.names:
+            return [None] * len(metadata)
+        values = metadata[name].tolist()
+    else:
+        values = [entry.get(name) for entry in metadata]
+    return [value.decode('utf-8') if isinstance(value, bytes) else value for value in values]
+
+def build_columns(metadata, columns=None):
+    """
+    Precompute the filter columns of a batch of metadata entries, optionally appending to existing columns.
+
+    Args:
+        metadata (list or np.ndarray): Metadata entries, in FAISS id order.
+        columns (dict): Columns of the rows before this batch, as returned by load_columns, to extend.
+
+    Returns:
+        columns (dict): "timestamp" (float64 epoch seconds) plus, for each attribute, "<name>_codes" (int32, -1 when
+            missing) and "<name>_vocabulary" (array of the distinct values).
+    """
+    timestamps = np.array([parse_timestamp(value) for value in column_values(metadata, "timestamp")], dtype='float64')
+    result = {"timestamp": timestamps if columns is None else np.concatenate([columns["timestamp"], timestamps])}
+    for name in ATTRIBUTE_COLUMNS:
+        vocabulary = [] if columns is None else columns[f"{name}_vocabulary"].tolist()
+        lookup = {value: code for code, value in enumerate(vocabulary)}
+        codes = []
+        for value in column_values(metadata, name):
+            if value is None:
+                codes.append(-1)
+                continue
+            value = str(value)
+            if value not in lookup:
+                lookup[value] = len(vocabulary)
+                vocabulary.append(value)
+            codes.append(lookup[value])
+        codes = np.array(codes, dtype='int32')
+        result[f"{name}_codes"] = codes if columns is None else np.concatenate([columns[f"{name}_codes"], codes])
+        result[f"{name}_vocabulary"] = np.array(vocabulary, dtype=str)
+    return result
+
+def save_columns(columns, index_file):
+    """
+    Save the filter columns next to a FAISS index, atomically.
+
+    Args:
+        columns (dict): Columns returned by build_columns.
+        index_file (str): Path to the FAISS index.
+    """
+    path = columns_file(index_file)
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".npz")
+    with os.fdopen(handle, 'wb') as f:
+        np.savez(f, **columns)
+    os.replace(temporary, path)
+
+def load_columns(index_file="faiss_index.bin"):
+    """
+    Load the filter columns saved next to a FAISS index.
+
+    Args:
+        index_file (str): Path to the FAISS index.
+
+    Returns:
+        columns (dict): Columns as returned by build_columns, or None when Step2 has not saved any.
+    """
+    path = columns_file(index_file)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+def update_columns(index_file, metadata, start=0):
+    """
+    Save the filter columns of rows added to a FAISS index, extending the columns of the rows before them.
+
+    Columns that do not end exactly at start (e.g. saved for an older index) cannot be extended and are
+    removed, so filtered searches fail loudly instead of selecting the wrong rows; a full build restores them.
+
+    Args:
+        index_file (str): Path to the FAISS index.
+        metadata (list or np.ndarray): Metadata entries of the added rows.
+        start (int): FAISS id of the first added row (0 for a full build).
+
+    Returns:
+        columns (dict): The saved columns, or None when they had to be removed.
+    """
+    columns = load_columns(index_file) if start else None
+    if start and (columns is None or len(columns["timestamp"]) != start):
+        if columns is not None:
+            os.remove(columns_file(index_file))
+        return None
+    columns = build_columns(metadata, columns)
+    save_columns(columns, index_file)
+    return columns
+
+def filter_mask(columns, filters):
+    """
+    Evaluate metadata predicates over the precomputed columns.
+
+    Supported keys: "since" and "until" (timestamp bounds, inclusive, as strings, datetimes or epoch seconds),
+    "max_age_days" (only entries from the last N days), and any attribute column such as "type" or "tenant"
+    (a value or a list of accepted values). All predicates must hold.
+
+    Args:
+        columns (dict): Columns returned by load_columns.
+        filters (dict): Predicates to apply.
+
+    Returns:
+        mask (np.ndarray): Boolean array with one entry per FAISS id, True where the entry matches.
+    """
+    timestamps = columns["timestamp"]
+    mask = np.ones(len(timestamps), dtype=bool)
+    for key, value in filters.items():
+        if key == "since":
+            mask &= timestamps >= parse_timestamp(value)
+        elif key == "until":
+            mask &= timestamps <= parse_timestamp(value)
+        elif key == "max_age_days":
+            mask &= timestamps >= time.time() - value * 86400
+        elif key in ATTRIBUTE_COLUMNS:
+            accepted = [value] if isinstance(value, str) or not hasattr(value, '__iter__') else list(value)
+            vocabulary = {name: code for code, name in enumerate(columns[f"{key}_vocabulary"].tolist())}
+            codes = [vocabulary[str(name)] for name in accepted if str(name) in vocabulary]
+            mask &= np.isin(columns[f"{key}_codes"], codes)
+        else:
+            raise ValueError(f"Unknown filter {key!r}, expected since, until, max_age_days or one of {ATTRIBUTE_COLUMNS}")
+    return mask
+
+def id_selector(mask):
+    """
+    Build a FAISS id selector from a boolean mask over FAISS ids.
+
+    Args:
+        mask (np.ndarray): Boolean array, True for the ids the search may return.
+
+    Returns:
+        selector (faiss.IDSelectorBitmap): Selector to pass in the search parameters.
+    """
+    bitmap = np.packbits(mask, bitorder='little')
+    # FAISS takes the size of the bitmap in bytes; ids past its end are never selected
+    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+    # FAISS only keeps a pointer to the bitmap, so the selector holds the array alive (the faiss convention)
+    selector.referenced_objects = [bitmap]
+    return selector
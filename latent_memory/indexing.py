@@ -0,0 +1,368 @@
+# indexing.py
+"""
+FAISS index helpers shared by the Step2 and Step3 scripts of every variant.
+Vectors are stored under their metadata row as id, so Step3 can keep mapping search results
+to metadata[idx] while new conversations are appended to an existing index. Besides the exact flat
+index, IVF-Flat, IVF-PQ and HNSW structures can be built, or picked automatically from the corpus size.
+"""
+
+import os
+
+import faiss
+import numpy as np
+
+# Number of rows converted to float32 and added to an index at a time
+ADD_CHUNK = 65_536
+
+# Index structures accepted by create_index, besides "auto"
+INDEX_TYPES = ("flat", "ivf-flat", "ivf-pq", "hnsw")
+
+# Below this many vectors an exact search is fast enough
+AUTO_FLAT_MAX = 50_000
+
+# Below this many vectors IVF can keep full vectors; above it they are compressed with PQ
+AUTO_IVF_FLAT_MAX = 1_000_000
+
+def ivf_nlist(ntotal, factor):
+    """
+    Pick the number of IVF clusters for a corpus size.
+
+    Args:
+        ntotal (int): Number of vectors to index.
+        factor (int): Clusters per square root of ntotal (FAISS recommends 4 to 16).
+
+    Returns:
+        nlist (int): Number of clusters, with at least 39 training points per cluster.
+    """
+    nlist = int(factor * np.sqrt(max(ntotal, 1)))
+    return int(max(1, min(nlist, ntotal // 39)))
+
+def pq_subquantizers(dimension):
+    """
+    Pick the number of PQ sub-quantizers: about 8 dimensions each, dividing the dimension exactly.
+
+    Args:
+        dimension (int): Dimension of the embeddings.
+
+    Returns:
+        m (int): Number of sub-quantizers.
+    """
+    m = max(1, dimension // 8)
+    while dimension % m:
+        m -= 1
+    return m
+
+def auto_index_spec(ntotal, dimension):
+    """
+    Choose an index structure and its parameters from the corpus size and dimension.
+
+    Args:
+        ntotal (int): Number of vectors to index.
+        dimension (int): Dimension of the embeddings.
+
+    Returns:
+        spec (dict): Index spec with a "type" key and its parameters.
+    """
+    if ntotal < AUTO_FLAT_MAX:
+        return {"type": "flat"}
+    if ntotal < AUTO_IVF_FLAT_MAX:
+        return {"type": "ivf-flat", "nlist": ivf_nlist(ntotal, 4)}
+    return {"type": "ivf-pq", "nlist": ivf_nlist(ntotal, 16), "m": pq_subquantizers(dimension), "nbits": 8}
+
+def resolve_index_spec(spec, ntotal, dimension):
+    """
+    Normalize an index spec and fill in the parameters it leaves out.
+
+    Args:
+        spec (str or dict): "flat", "ivf-flat", "ivf-pq", "hnsw" or "auto", or a dict with a "type" key and parameters
+            (nlist for IVF, m and nbits for PQ, M and ef_construction for HNSW).
+        ntotal (int): Number of vectors the index is built for.
+        dimension (int): Dimension of the embeddings.
+
+    Returns:
+        spec (dict): Index spec with every parameter set.
+    """
+    spec = {"type": spec} if isinstance(spec, str) else dict(spec)
+    kind = spec.pop("type", "flat").lower().replace("_", "-")
+    if kind == "auto":
+        resolved = auto_index_spec(ntotal, dimension)
+        resolved.update(spec)
+        return resolved
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {kind!r}, expected one of {INDEX_TYPES + ('auto',)}")
+
+    resolved = {"type": kind}
+    if kind.startswith("ivf"):
+        resolved["nlist"] = ivf_nlist(ntotal, 4 if kind == "ivf-flat" else 16)
+    if kind == "ivf-pq":
+        resolved["m"] = pq_subquantizers(dimension)
+        resolved["nbits"] = 8
+    if kind == "hnsw":
+        resolved["M"] = 32
+        resolved["ef_construction"] = 40
+    resolved.update(spec)
+    return resolved
+
+def create_index(dimension, spec="flat", ntotal=0):
+    """
+    Create an empty inner-product index whose vectors carry explicit ids.
+
+    Args:
+        dimension (int): Dimension of the embeddings.
+        spec (str or dict): Index spec, see resolve_index_spec.
+        ntotal (int): Number of vectors the index is built for, used by "auto" and the default parameters.
+
+    Returns:
+        index (faiss.Index): Empty index. IVF indexes still need train_index before vectors are added.
+    """
+    spec = resolve_index_spec(spec, ntotal, dimension)
+    kind = spec["type"]
+
+    # Flat and HNSW indexes are wrapped in an id map; IVF indexes store ids natively
+    if kind == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+    if kind == "hnsw":
+        index = faiss.index_factory(dimension, f"IDMap2,HNSW{spec['M']}", faiss.METRIC_INNER_PRODUCT)
+        faiss.downcast_index(index.index).hnsw.efConstruction = spec["ef_construction"]
+        return index
+    if kind == "ivf-flat":
+        return faiss.index_factory(dimension, f"IVF{spec['nlist']},Flat", faiss.METRIC_INNER_PRODUCT)
+    return faiss.index_factory(
+        dimension, f"IVF{spec['nlist']},PQ{spec['m']}x{spec['nbits']}", faiss.METRIC_INNER_PRODUCT
+    )
+
+def train_index(index, embeddings, sample_size=None, seed=0):
+    """
+    Train an index on a random sample of the embeddings, if its structure needs training.
+
+    Args:
+        index (faiss.Index): Index returned by create_index.
+        embeddings (np.ndarray): Array of shape (n, dimension) to sample from.
+        sample_size (int): Number of training vectors; defaults to 64 per IVF cluster (at least 10,000).
+        seed (int): Seed of the sampling, so rebuilds are reproducible.
+    """
+    if index.is_trained:
+        return
+    if sample_size is None:
+        sample_size = max(64 * faiss.extract_index_ivf(index).nlist, 10_000)
+    if len(embeddings) > sample_size:
+        rows = np.sort(np.random.default_rng(seed).choice(len(embeddings), sample_size, replace=False))
+        embeddings = embeddings[rows]
+    index.train(np.ascontiguousarray(embeddings, dtype='float32'))
+
+def search_parameters(index, nprobe=None, ef_search=None, selector=None):
+    """
+    Build per-query search parameters for approximate indexes.
+
+    Args:
+        index (faiss.Index): Index that will be searched.
+        nprobe (int): Number of IVF clusters visited per query (higher is more accurate and slower).
+        ef_search (int): Size of the HNSW candidate list per query (higher is more accurate and slower).
+        selector (faiss.IDSelector): Restricts the search to the selected ids (see latent_memory/filters.py).
+
+    Returns:
+        params (faiss.SearchParameters): Parameters for index.search, or None when nothing applies.
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    extra = {} if selector is None else {"sel": selector}
+    # A selector alone must not reset nprobe or efSearch to the FAISS defaults, so the index's own values are kept
+    if isinstance(inner, faiss.IndexIVF) and (nprobe is not None or extra):
+        return faiss.SearchParametersIVF(nprobe=inner.nprobe if nprobe is None else nprobe, **extra)
+    if isinstance(inner, faiss.IndexHNSW) and (ef_search is not None or extra):
+        return faiss.SearchParametersHNSW(efSearch=inner.hnsw.efSearch if ef_search is None else ef_search, **extra)
+    return faiss.SearchParameters(**extra) if extra else None
+
+def add_rows(index, embeddings, start):
+    """
+    Add embeddings to an index under the ids start, start + 1, ...
+
+    Args:
+        index (faiss.Index): Index to extend.
+        embeddings (np.ndarray): Array of shape (n, dimension).
+        start (int): Metadata row of the first embedding.
+    """
+    has_ids = isinstance(index, (faiss.IndexIDMap, faiss.IndexIVF))
+    if not has_ids and start != index.ntotal:
+        raise ValueError(f"Cannot add rows starting at {start} to an index without ids holding {index.ntotal} vectors")
+
+    # Convert and add in chunks, so a memory-mapped array is never copied whole
+    for offset in range(0, len(embeddings), ADD_CHUNK):
+        chunk = np.ascontiguousarray(embeddings[offset:offset + ADD_CHUNK], dtype='float32')
+        if has_ids:
+            first = start + offset
+            index.add_with_ids(chunk, np.arange(first, first + len(chunk), dtype='int64'))
+        else:
+            # Indexes without an id map number vectors by position, which already matches the metadata row
+            index.add(chunk)
+
+def append_rows(index, embeddings, metadata, start=None):
+    """
+    Add the rows appended to the store since the index was last saved.
+
+    Args:
+        index (faiss.Index): Existing index covering the first start rows of the store.
+        embeddings (np.ndarray): Embeddings of the new rows only.
+        metadata (list or np.ndarray): Metadata entries of the new rows only.
+        start (int): Store row of the first new embedding, from indexed_rows. Defaults to index.ntotal, which is
+            only right while no row was merged or consolidated away.
+
+    Returns:
+        added (int): Number of vectors added.
+    """
+    if len(embeddings) != len(metadata):
+        raise ValueError(
+            f"Store is inconsistent: {len(embeddings)} new embeddings but {len(metadata)} new metadata entries"
+        )
+    if len(embeddings):
+        add_rows(index, embeddings, index.ntotal if start is None else start)
+    return len(embeddings)
+
+def load_index(index_file, mmap=False):
+    """
+    Read a FAISS index from disk.
+
+    With mmap=True the index data is memory-mapped read-only where the index type allows it, so
+    start-up does not read the whole file and worker processes share the OS page cache.
+    A memory-mapped index cannot be modified; use a regular load to append to it.
+
+    Args:
+        index_file (str): Path of the index file.
+        mmap (bool): Memory-map the index instead of reading it into memory.
+
+    Returns:
+        index (faiss.Index): Loaded index.
+    """
+    if not mmap:
+        return faiss.read_index(index_file)
+    flags = faiss.IO_FLAG_MMAP | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(index_file, flags)
+    except RuntimeError:
+        # Index types FAISS cannot map are read normally
+        return faiss.read_index(index_file)
+
+def generation_file(index_file):
+    """
+    Path of the generation counter of an index file.
+
+    Args:
+        index_file (str): Path of the index file.
+
+    Returns:
+        path (str): Path of the counter file.
+    """
+    return index_file + ".generation"
+
+def index_generation(index_file):
+    """
+    Read the generation counter of an index file, bumped every time save_index replaces the index.
+
+    Args:
+        index_file (str): Path of the index file.
+
+    Returns:
+        generation (int): Current generation, 0 for an index saved before counters existed or not saved yet.
+    """
+    try:
+        with open(generation_file(index_file), 'r') as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def rows_file(index_file):
+    """
+    Path of the file recording how many store rows an index covers.
+
+    Args:
+        index_file (str): Path of the index file.
+
+    Returns:
+        path (str): Path of the row count file.
+    """
+    return index_file + ".rows"
+
+def indexed_rows(index_file, index):
+    """
+    Number of store rows an index covers, i.e. the first store row it has not seen yet. This differs from
+    index.ntotal once rows are merged into others (latent_memory/dedup.py) or consolidated into centroids
+    (latent_memory/consolidation.py).
+
+    Args:
+        index_file (str): Path of the index file.
+        index (faiss.Index): The loaded index.
+
+    Returns:
+        rows (int): Recorded row count, or index.ntotal for an index saved without one.
+    """
+    try:
+        with open(rows_file(index_file), 'r') as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return index.ntotal
+
+def save_rows(index_file, rows):
+    """
+    Record how many store rows an index covers (see indexed_rows), atomically.
+
+    Args:
+        index_file (str): Path of the index file.
+        rows (int): Number of store rows.
+    """
+    temporary_file = index_file + ".tmp"
+    with open(temporary_file, 'w') as f:
+        f.write(str(rows))
+    os.replace(temporary_file, rows_file(index_file))
+
+def bump_generation(index_file):
+    """
+    Increment the generation counter of an index file, atomically, once the files it describes are written.
+
+    Args:
+        index_file (str): Path of the index file.
+
+    Returns:
+        generation (int): New generation.
+    """
+    temporary_file = index_file + ".tmp"
+    generation = index_generation(index_file) + 1
+    with open(temporary_file, 'w') as f:
+        f.write(str(generation))
+    os.replace(temporary_file, generation_file(index_file))
+    return generation
+
+def finish_save(index_file):
+    """
+    Publish a save to readers: bump the generation counter once the index and every sidecar written next to it
+    (filter columns, duplicate links, consolidation state, shard manifest) are in place, so a reload triggered
+    by the new generation never pairs the new index with old sidecars.
+
+    Args:
+        index_file (str): Path of the index file.
+
+    Returns:
+        generation (int): New generation.
+    """
+    return bump_generation(index_file)
+
+def save_index(index, index_file, rows=None, finish=True):
+    """
+    Write an index to disk atomically, so readers never see a partially written file,
+    and bump its generation counter so caches of search results know the index changed.
+
+    Args:
+        index (faiss.Index): Index to save.
+        index_file (str): Path of the index file.
+        rows (int): Number of store rows the index covers (see indexed_rows); recorded when given.
+        finish (bool): Bump the generation now. Pass False when sidecars are written after the index,
+            and call finish_save once they are.
+    """
+    temporary_file = index_file + ".tmp"
+    faiss.write_index(index, temporary_file)
+    os.replace(temporary_file, index_file)
+
+    if rows is not None:
+        save_rows(index_file, rows)
+
+    # The counter is replaced atomically too, after the index it describes
+    if finish:
+        bump_generation(index_file)
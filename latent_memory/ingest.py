@@ -0,0 +1,69 @@
+# ingest.py
+"""
+Streaming, chunked ingestion shared by the Step1 script of every variant.
+Conversations are read lazily, encoded in fixed-size batches and each batch is appended to the
+storage backend as soon as it is ready, so peak memory is bounded by the batch size.
+"""
+
+def read_conversations(source):
+    """
+    Yield conversations one at a time from an iterable or a text file.
+
+    Args:
+        source (iterable or str): Iterable of conversation strings, or path to a text file
+            with one conversation per line (blank lines are skipped).
+
+    Yields:
+        conversation (str): Conversation string.
+    """
+    if isinstance(source, str):
+        with open(source, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if line.strip():
+                    yield line
+    else:
+        yield from source
+
+def batched(conversations, batch_size):
+    """
+    Group an iterable of conversations into lists of at most batch_size items.
+
+    Args:
+        conversations (iterable): Iterable of conversation strings.
+        batch_size (int): Maximum number of conversations per batch.
+
+    Yields:
+        batch (list): List of conversation strings.
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be at least 1, got {batch_size}")
+    batch = []
+    for conversation in conversations:
+        batch.append(conversation)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def ingest(source, convert, writer, batch_size=256):
+    """
+    Encode conversations batch by batch and append each batch to a storage writer.
+
+    Args:
+        source (iterable or str): Conversations, or path to a text file with one conversation per line.
+        convert (callable): The variant's convert_to_embeddings(conversations, start) function.
+        writer (object): Storage writer exposing `rows` (rows already stored) and append(embeddings, metadata).
+        batch_size (int): Number of conversations encoded and written per batch.
+
+    Returns:
+        total (int): Number of conversations ingested by this call.
+    """
+    total = 0
+    for batch in batched(read_conversations(source), batch_size):
+        # Continue the conversation ids after the rows already in the store
+        embeddings, metadata = convert(batch, start=writer.rows)
+        writer.append(embeddings, metadata)
+        total += len(batch)
+    return total
@@ -0,0 +1,336 @@
+# metrics.py
+"""
+Per-stage timers and counters for the Step scripts and the shared retrieval path.
+
+Instrumentation is off until enable() registers at least one sink. While it is off, timer() returns a shared
+no-op context manager and timed functions call straight through after a single check, so the instrumented code
+pays next to nothing. Sinks receive every observation:
+    LogSink             one log line per timing or count, through the logging module
+    HistogramSink       in-memory histograms and counters, for summaries within the process
+    PrometheusFileSink  a Prometheus text-format file for the node_exporter textfile collector, rewritten periodically
+
+    from latent_memory.metrics import HistogramSink, enable
+    histograms = enable(HistogramSink())[0]
+    ...
+    print(histograms.summary())
+
+Metric names are dotted, e.g. "step3.load_data" or "retrieval.search"; timings are in seconds.
+"""
+
+import functools
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds of the histogram buckets, in seconds (the last bucket is unbounded)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Registered sinks; instrumentation is disabled while this is empty
+_sinks = []
+
+def enable(*sinks):
+    """
+    Start sending timings and counts to the given sinks, in addition to any already registered.
+
+    Args:
+        *sinks: LogSink, HistogramSink, PrometheusFileSink or any object with observe, increment and flush methods.
+
+    Returns:
+        sinks (list): The registered sinks.
+    """
+    _sinks.extend(sinks)
+    return list(_sinks)
+
+def disable():
+    """
+    Flush and unregister every sink, turning instrumentation off.
+    """
+    for sink in _sinks:
+        sink.flush()
+    _sinks.clear()
+
+def enabled():
+    return bool(_sinks)
+
+def observe(name, seconds):
+    """
+    Record a timing.
+
+    Args:
+        name (str): Metric name.
+        seconds (float): Duration in seconds.
+    """
+    for sink in _sinks:
+        sink.observe(name, seconds)
+
+def count(name, value=1):
+    """
+    Increment a counter.
+
+    Args:
+        name (str): Metric name.
+        value (int): Amount to add.
+    """
+    for sink in _sinks:
+        sink.increment(name, value)
+
+class Timer:
+    """
+    Context manager that records the time spent in its block.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        observe(self.name, time.perf_counter() - self.started)
+
+class NullTimer:
+    """
+    Context manager that does nothing, returned by timer() while instrumentation is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+NULL_TIMER = NullTimer()
+
+def timer(name):
+    """
+    Time a block of code: `with timer("retrieval.search"): ...`.
+
+    Args:
+        name (str): Metric name.
+
+    Returns:
+        timer (Timer or NullTimer): Context manager; a shared no-op while instrumentation is disabled.
+    """
+    return Timer(name) if _sinks else NULL_TIMER
+
+def timed(name):
+    """
+    Decorator that times every call of a function.
+
+    Args:
+        name (str): Metric name.
+
+    Returns:
+        decorator (callable): Decorator wrapping the function.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _sinks:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+class Histogram:
+    """
+    Fixed-bucket histogram of durations, with count and sum.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Create an empty histogram.
+
+        Args:
+            buckets (tuple): Increasing bucket upper bounds in seconds.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        """
+        Estimate a quantile from the buckets (the upper bound of the bucket holding it).
+
+        Args:
+            q (float): Quantile between 0 and 1.
+
+        Returns:
+            seconds (float): Estimated quantile, infinity if it falls in the unbounded bucket, or NaN when empty.
+        """
+        if not self.count:
+            return float("nan")
+        target = q * self.count
+        seen = 0
+        for bound, bucket in zip(self.buckets + (float("inf"),), self.counts):
+            seen += bucket
+            if seen >= target:
+                return bound
+        return float("inf")
+
+class LogSink:
+    """
+    Sink writing one log line per timing or count.
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        """
+        Args:
+            logger (logging.Logger): Logger to write to; defaults to the "latent_memory.metrics" logger.
+            level (int): Logging level of the lines.
+        """
+        self.logger = logger or logging.getLogger("latent_memory.metrics")
+        self.level = level
+
+    def observe(self, name, seconds):
+        self.logger.log(self.level, "%s took %.6f s", name, seconds)
+
+    def increment(self, name, value):
+        self.logger.log(self.level, "%s += %s", name, value)
+
+    def flush(self):
+        pass
+
+class HistogramSink:
+    """
+    Sink aggregating timings into in-memory histograms and counts into totals. Thread-safe.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            buckets (tuple): Increasing bucket upper bounds in seconds.
+        """
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.buckets)
+            histogram.add(seconds)
+
+    def increment(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def flush(self):
+        pass
+
+    def summary(self):
+        """
+        Summarize what was recorded.
+
+        Returns:
+            summary (dict): "timers" (per name: count, total and mean seconds, p50 and p99 estimates) and "counters".
+        """
+        with self.lock:
+            timers = {
+                name: {
+                    "count": histogram.count,
+                    "total_seconds": histogram.sum,
+                    "mean_seconds": histogram.sum / histogram.count,
+                    "p50_seconds": histogram.quantile(0.5),
+                    "p99_seconds": histogram.quantile(0.99)
+                }
+                for name, histogram in self.histograms.items()
+            }
+            return {"timers": timers, "counters": dict(self.counters)}
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+def prometheus_name(name):
+    """
+    Turn a dotted metric name into a Prometheus metric name.
+
+    Args:
+        name (str): Metric name, e.g. "retrieval.search".
+
+    Returns:
+        name (str): Prometheus name, e.g. "latent_memory_retrieval_search".
+    """
+    return "latent_memory_" + "".join(c if c.isalnum() else "_" for c in name)
+
+class PrometheusFileSink(HistogramSink):
+    """
+    Sink aggregating like HistogramSink and exporting the totals as a Prometheus text-format file,
+    for the node_exporter textfile collector. The file is rewritten atomically.
+    """
+
+    def __init__(self, path="latent_memory.prom", interval=10.0, buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            path (str): File to write.
+            interval (float): Minimum number of seconds between rewrites during recording; flush() always writes.
+            buckets (tuple): Increasing bucket upper bounds in seconds.
+        """
+        super().__init__(buckets)
+        self.path = path
+        self.interval = interval
+        self.written = time.monotonic()
+
+    def observe(self, name, seconds):
+        super().observe(name, seconds)
+        self._maybe_write()
+
+    def increment(self, name, value):
+        super().increment(name, value)
+        self._maybe_write()
+
+    def _maybe_write(self):
+        if time.monotonic() - self.written >= self.interval:
+            self.flush()
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            text (str): Timers as <name>_seconds histograms and counters as <name>_total.
+        """
+        lines = []
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                metric = prometheus_name(name) + "_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, bucket in zip(histogram.buckets, histogram.counts):
+                    cumulative += bucket
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.sum}")
+                lines.append(f"{metric}_count {histogram.count}")
+            for name, value in sorted(self.counters.items()):
+                metric = prometheus_name(name) + "_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        text = self.render()
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix=".prom.tmp")
+        with os.fdopen(handle, 'w') as f:
+            f.write(text)
+        os.replace(temporary, self.path)
+        self.written = time.monotonic()
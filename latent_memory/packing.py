@@ -0,0 +1,95 @@
+# packing.py
+"""
+Token-budget packing of retrieved conversations into the context passed to the LLM.
+
+Step1 stores the token count of each conversation's context line with its metadata, so packing never re-tokenizes:
+the hits are taken in rank order, every line that still fits the budget is kept, and the context is built with a
+single join. Token counters are pluggable; the count stored at ingest should come from the same counter (and so
+the same tokenizer) as the budget it is checked against.
+"""
+
+# First line of every context
+CONTEXT_HEADER = "Relevant past conversations:\n"
+
+def approximate_tokens(text):
+    """
+    Default token counter: about four characters per token, a common estimate for English with BPE tokenizers.
+
+    Args:
+        text (str): Text to count.
+
+    Returns:
+        tokens (int): Estimated number of tokens.
+    """
+    return max(1, (len(text) + 3) // 4)
+
+def tiktoken_counter(encoding_name="cl100k_base"):
+    """
+    Exact token counter for OpenAI-style tokenizers (requires pip install tiktoken).
+
+    Args:
+        encoding_name (str): tiktoken encoding name.
+
+    Returns:
+        token_counter (callable): token_counter(text) returning the number of tokens.
+    """
+    import tiktoken
+    encoding = tiktoken.get_encoding(encoding_name)
+    return lambda text: len(encoding.encode(text))
+
+def context_line(summary, timestamp):
+    """
+    Line of the context describing one conversation.
+
+    Args:
+        summary (str): Conversation summary.
+        timestamp (str): Conversation timestamp.
+
+    Returns:
+        line (str): Context line, newline included.
+    """
+    return f"- {summary} (Timestamp: {timestamp})\n"
+
+def line_tokens(summary, timestamp, token_counter=None):
+    """
+    Token count of the context line of a conversation, computed once at ingest.
+
+    Args:
+        summary (str): Conversation summary.
+        timestamp (str): Conversation timestamp.
+        token_counter (callable): token_counter(text) returning a token count; defaults to approximate_tokens.
+
+    Returns:
+        tokens (int): Number of tokens of the line.
+    """
+    return (token_counter or approximate_tokens)(context_line(summary, timestamp))
+
+def pack_context(conversations, token_budget=None, token_counter=None, header=CONTEXT_HEADER):
+    """
+    Build the context from conversations in rank order, keeping every line that still fits the token budget.
+
+    Args:
+        conversations (list): Conversation metadata dicts, best first. Their "tokens" entry (stored by Step1)
+            is used when present; other entries are counted here.
+        token_budget (int): Maximum number of context tokens, header included; None keeps every conversation.
+        token_counter (callable): Counter of the header and of entries stored without a count;
+            defaults to approximate_tokens.
+
+    Returns:
+        context (str): Formatted context string for LLM input.
+    """
+    lines = [context_line(conv['summary'], conv['timestamp']) for conv in conversations]
+    if token_budget is not None:
+        counter = token_counter or approximate_tokens
+        remaining = token_budget - counter(header)
+        kept = []
+        for conv, line in zip(conversations, lines):
+            tokens = conv.get('tokens')
+            if tokens is None:
+                tokens = counter(line)
+            # A line too long for what is left is skipped, and shorter lower-ranked lines can still fill the space
+            if tokens <= remaining:
+                kept.append(line)
+                remaining -= tokens
+        lines = kept
+    return header + "".join(lines)
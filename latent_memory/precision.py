@@ -0,0 +1,254 @@
+# precision.py
+"""
+Reduced-precision embedding storage shared by every variant.
+Embeddings can be stored as float32, float16 or int8 (per-dimension scale and offset), and are
+always loaded back as float32, the type FAISS works with.
+
+An int8 store is split into blocks of rows, each with its own scale and offset. A batch appended later reuses
+the fit of the last block when it lies within that block's range and the fit was made on enough rows; otherwise
+it starts a new block fitted on itself, so streamed batches are never clipped to the range of the first one.
+"""
+
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# Storage precisions accepted by quantize
+PRECISIONS = ("float32", "float16", "int8")
+
+# Rows an int8 fit must be made on before later batches may reuse it
+MIN_FIT_ROWS = 64
+
+# Scale of int8 dimensions that are constant in a block: the constant is restored exactly, and any other
+# value falls outside the block's range, so it starts a new block instead of being rounded to a coarse step
+CONSTANT_SCALE = 1e-12
+
+def int8_blocks(quantization):
+    """
+    Per-block tables of an int8 encoding, also for encodings written before stores were split into blocks.
+
+    Args:
+        quantization (dict): int8 encoding returned by quantize or load_quantization.
+
+    Returns:
+        scale (np.ndarray): Float32 array of shape (blocks, dimension).
+        offset (np.ndarray): Float32 array of shape (blocks, dimension).
+        rows (np.ndarray): Int64 array with the first store row of each block.
+        samples (np.ndarray): Int64 array with the number of rows each block was fitted on (0 when unknown).
+    """
+    scale = np.atleast_2d(np.asarray(quantization["scale"], dtype='float32'))
+    offset = np.atleast_2d(np.asarray(quantization["offset"], dtype='float32'))
+    rows = np.asarray(quantization.get("rows", [0]), dtype='int64')
+    samples = np.asarray(quantization.get("samples", [0] * len(rows)), dtype='int64')
+    return scale, offset, rows, samples
+
+def fit_int8(embeddings):
+    """
+    Fit the int8 scale and offset of a block: each dimension is mapped linearly from [min, max] to [-128, 127].
+
+    Args:
+        embeddings (np.ndarray): Array of shape (n, dimension), n > 0.
+
+    Returns:
+        scale (np.ndarray): Float32 array of shape (dimension,).
+        offset (np.ndarray): Float32 array of shape (dimension,).
+    """
+    offset = embeddings.min(axis=0).astype('float32')
+    scale = ((embeddings.max(axis=0) - offset) / 255).astype('float32')
+    return np.maximum(scale, np.float32(CONSTANT_SCALE)), offset
+
+def quantize(embeddings, precision="float32", quantization=None, start=0):
+    """
+    Convert embeddings to the storage precision.
+
+    For int8, each dimension is mapped linearly from [min, max] to [-128, 127]. Passing the quantization
+    of an existing store reuses the scale and offset of its last block when the batch lies within that block's
+    range and the block was fitted on at least MIN_FIT_ROWS rows; otherwise the batch starts a new block at
+    row start, fitted on its own values. Nothing is ever clipped.
+
+    Args:
+        embeddings (np.ndarray): Array of shape (n, dimension).
+        precision (str): One of "float32", "float16" or "int8".
+        quantization (dict): Optional quantization of the store the batch is appended to.
+        start (int): Store row of the first embedding, where a new block begins.
+
+    Returns:
+        stored (np.ndarray): Array to write to disk.
+        quantization (dict): Description of the encoding, needed by dequantize. It is the object passed in
+            when its last block was reused, so callers only save it again when it changed.
+    """
+    if quantization is not None:
+        precision = quantization["precision"]
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}, expected one of {PRECISIONS}")
+    embeddings = np.asarray(embeddings)
+    if precision != "int8":
+        return embeddings.astype(precision), quantization or {"precision": precision}
+    if len(embeddings) == 0:
+        return np.zeros(embeddings.shape, dtype='int8'), quantization
+
+    reuse = False
+    if quantization is not None:
+        scale, offset, rows, samples = int8_blocks(quantization)
+        # Half a step of tolerance on each side: those values still round to -128 or 127
+        low, high = offset[-1] - scale[-1] / 2, offset[-1] + 255.5 * scale[-1]
+        reuse = samples[-1] >= MIN_FIT_ROWS and bool(np.all(embeddings >= low) and np.all(embeddings <= high))
+    if reuse:
+        block_scale, block_offset = scale[-1], offset[-1]
+    else:
+        block_scale, block_offset = fit_int8(embeddings)
+        if quantization is None:
+            quantization = {"precision": "int8", "scale": block_scale[None], "offset": block_offset[None],
+                            "rows": np.array([start], dtype='int64'), "samples": np.array([len(embeddings)], dtype='int64')}
+        else:
+            quantization = {
+                "precision": "int8",
+                "scale": np.concatenate([scale, block_scale[None]]),
+                "offset": np.concatenate([offset, block_offset[None]]),
+                "rows": np.append(rows, start),
+                "samples": np.append(samples, len(embeddings))
+            }
+    levels = np.rint((embeddings - block_offset) / block_scale) - 128
+    return np.clip(levels, -128, 127).astype('int8'), quantization
+
+def dequantize(stored, quantization=None, start=0):
+    """
+    Convert stored embeddings back to float32.
+
+    Args:
+        stored (np.ndarray): Array read from disk.
+        quantization (dict): Encoding returned by quantize, or None for plain float storage.
+        start (int): Store row of the first stored row, which selects the int8 block of every row.
+
+    Returns:
+        embeddings (np.ndarray): Float32 array of the same shape.
+    """
+    if quantization is None or quantization["precision"] != "int8":
+        return np.asarray(stored, dtype='float32')
+    scale, offset, rows, _ = int8_blocks(quantization)
+    embeddings = np.empty(np.shape(stored), dtype='float32')
+    # Each block converts the rows of stored that fall in its row range
+    bounds = np.clip(np.append(rows, np.iinfo('int64').max) - start, 0, len(embeddings))
+    bounds[0] = 0
+    for block in range(len(rows)):
+        first, last = bounds[block], bounds[block + 1]
+        if first < last:
+            embeddings[first:last] = (np.asarray(stored[first:last], dtype='float32') + 128) * scale[block] + offset[block]
+    return embeddings
+
+def quantization_file(embeddings_file):
+    """
+    Path of the sidecar holding the int8 scale and offset of an embeddings file.
+
+    Args:
+        embeddings_file (str): Path to the embeddings file.
+
+    Returns:
+        path (str): Path of the sidecar JSON file.
+    """
+    return embeddings_file + ".quant.json"
+
+def save_quantization(embeddings_file, quantization):
+    """
+    Write the sidecar of an int8 embeddings file, or remove a stale one for float storage.
+
+    Args:
+        embeddings_file (str): Path to the embeddings file.
+        quantization (dict): Encoding returned by quantize.
+    """
+    path = quantization_file(embeddings_file)
+    if quantization["precision"] != "int8":
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    scale, offset, rows, samples = int8_blocks(quantization)
+    # Written to a temporary file and renamed, since a new block rewrites the sidecar of a live store
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".quant.tmp")
+    with os.fdopen(handle, 'w') as f:
+        json.dump({
+            "precision": "int8",
+            "scale": scale.tolist(),
+            "offset": offset.tolist(),
+            "rows": rows.tolist(),
+            "samples": samples.tolist()
+        }, f)
+    os.replace(temporary, path)
+
+def load_quantization(embeddings_file):
+    """
+    Read the sidecar of an embeddings file.
+
+    Args:
+        embeddings_file (str): Path to the embeddings file.
+
+    Returns:
+        quantization (dict): Encoding of an int8 file, or None for float storage.
+    """
+    path = quantization_file(embeddings_file)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        data = json.load(f)
+    quantization = {
+        "precision": data["precision"],
+        "scale": np.array(data["scale"], dtype='float32'),
+        "offset": np.array(data["offset"], dtype='float32')
+    }
+    # Sidecars written before stores were split into blocks hold one block, whose sample size is unknown
+    for key in ("rows", "samples"):
+        if key in data:
+            quantization[key] = np.array(data[key], dtype='int64')
+    return quantization
+
+def reconstruction_error(embeddings, precision):
+    """
+    Measure how much a storage precision changes the embeddings.
+
+    Args:
+        embeddings (np.ndarray): Array of shape (n, dimension).
+        precision (str): One of "float32", "float16" or "int8".
+
+    Returns:
+        error (dict): Maximum and mean absolute error, and the lowest cosine similarity between
+            an embedding and its reconstruction.
+    """
+    original = np.asarray(embeddings, dtype='float64')
+    restored = dequantize(*quantize(embeddings, precision)).astype('float64')
+    difference = np.abs(original - restored)
+    norms = np.linalg.norm(original, axis=1) * np.linalg.norm(restored, axis=1)
+    cosine = np.einsum('ij,ij->i', original, restored) / np.where(norms == 0, 1, norms)
+    return {
+        "max_abs_error": float(difference.max()) if difference.size else 0.0,
+        "mean_abs_error": float(difference.mean()) if difference.size else 0.0,
+        "min_cosine": float(cosine.min()) if cosine.size else 1.0
+    }
+
+def precision_report(embeddings, save, precisions=PRECISIONS):
+    """
+    Report the on-disk size and reconstruction error of each storage precision.
+
+    Args:
+        embeddings (np.ndarray): Array of shape (n, dimension).
+        save (callable): save(precision, directory) writing the store into directory and returning the paths written.
+        precisions (tuple): Precisions to compare.
+
+    Returns:
+        report (list): One dict per precision with its file size in bytes, that size relative to the
+            raw float64 embeddings, and the reconstruction error.
+    """
+    float64_bytes = np.asarray(embeddings).size * 8
+    report = []
+    for precision in precisions:
+        with tempfile.TemporaryDirectory() as directory:
+            paths = save(precision, directory)
+            file_bytes = sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+        entry = {
+            "precision": precision,
+            "file_bytes": file_bytes,
+            "size_vs_float64": file_bytes / float64_bytes if float64_bytes else 0.0
+        }
+        entry.update(reconstruction_error(embeddings, precision))
+        report.append(entry)
+    return report
@@ -0,0 +1,251 @@
+# query_cache.py
+"""
+In-process, two-level cache for the Step3 retrieval path.
+
+Level one maps normalized query text to its embedding, so repeated prompts are not re-encoded.
+Level two maps (embedding hash, k, filters, search parameters) to the hits, so repeated searches skip FAISS
+and the metadata store. Results are dropped whenever the generation counter that Step2 bumps on every
+index save changes, so a rebuilt or updated index is never answered from stale results.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from latent_memory.indexing import generation_file, index_generation
+
+def normalize_query(text):
+    """
+    Normalize a query so trivially different spellings share a cache entry.
+    Unicode is NFKC-normalized and whitespace collapsed; case is kept, since embedding models can be case-sensitive.
+
+    Args:
+        text (str): Query string.
+
+    Returns:
+        key (str): Normalized query.
+    """
+    return " ".join(unicodedata.normalize('NFKC', text).split())
+
+def result_key(embedding, k, filters=None, nprobe=None, ef_search=None, recency=None):
+    """
+    Key of a search result: the query embedding and everything else that changes the hits.
+
+    Args:
+        embedding (np.ndarray): Float32 query embedding.
+        k (int): Number of hits requested.
+        filters (dict): Metadata filters of the search.
+        nprobe (int): IVF clusters visited.
+        ef_search (int): HNSW candidate list size.
+        recency (dict): Recency re-ranking settings.
+
+    Returns:
+        key (str): Hex SHA-256 digest.
+    """
+    digest = hashlib.sha256(np.ascontiguousarray(embedding, dtype='float32').tobytes())
+    digest.update(json.dumps([k, filters, nprobe, ef_search, recency], sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used entry, with hit and miss counters.
+    """
+
+    def __init__(self, max_entries):
+        """
+        Create an empty cache.
+
+        Args:
+            max_entries (int): Maximum number of entries kept.
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Look up an entry and mark it as recently used.
+
+        Args:
+            key (hashable): Cache key.
+
+        Returns:
+            value: Cached value, or None on a miss.
+        """
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        """
+        Store an entry, evicting the least recently used one when the cache is full.
+
+        Args:
+            key (hashable): Cache key.
+            value: Value to store.
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        """
+        Report cache counters.
+
+        Returns:
+            stats (dict): Hits, misses, hit rate, evictions and current number of entries.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self)
+        }
+
+class QueryCache:
+    """
+    Query embedding cache and search result cache shared by the retrieval calls of one process. Thread-safe.
+    """
+
+    def __init__(self, index_file=None, max_queries=10_000, max_results=10_000):
+        """
+        Create empty caches.
+
+        Args:
+            index_file (str): Path of the FAISS index whose generation counter invalidates the result cache.
+                Without it, call set_generation when the index changes.
+            max_queries (int): Maximum number of query embeddings kept.
+            max_results (int): Maximum number of result sets kept.
+        """
+        self.index_file = index_file
+        self.embeddings = LRUCache(max_queries)
+        self.results = LRUCache(max_results)
+        self.generation = index_generation(index_file) if index_file else 0
+        self.generation_stamp = self._generation_stamp()
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def _generation_stamp(self):
+        """
+        Cheap fingerprint of the generation file, so it is only read again when it changed.
+
+        Returns:
+            stamp (tuple): Modification time and size, or None without a counter file.
+        """
+        if not self.index_file:
+            return None
+        try:
+            stat = os.stat(generation_file(self.index_file))
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def set_generation(self, generation):
+        """
+        Drop every cached result if the index generation changed.
+
+        Args:
+            generation (int): Current generation of the index.
+        """
+        with self.lock:
+            if generation != self.generation:
+                self.results.clear()
+                self.generation = generation
+                self.invalidations += 1
+
+    def refresh(self):
+        """
+        Check the generation counter saved next to the index and invalidate the results if Step2 saved a new index.
+        """
+        stamp = self._generation_stamp()
+        if stamp != self.generation_stamp:
+            self.generation_stamp = stamp
+            self.set_generation(index_generation(self.index_file))
+
+    def encode(self, queries, encode):
+        """
+        Return the embeddings of a list of queries, encoding only the ones not cached, in a single batch.
+
+        Args:
+            queries (list): List of query strings.
+            encode (callable): encode(texts) returning an array of shape (len(texts), dimension).
+
+        Returns:
+            embeddings (np.ndarray): Float32 array of shape (len(queries), dimension), in query order.
+        """
+        keys = [normalize_query(query) for query in queries]
+        with self.lock:
+            found = {key: self.embeddings.get(key) for key in dict.fromkeys(keys)}
+        missing = [key for key, embedding in found.items() if embedding is None]
+        if missing:
+            encoded = np.asarray(encode(missing), dtype='float32')
+            with self.lock:
+                for key, embedding in zip(missing, encoded):
+                    self.embeddings.put(key, embedding)
+                    found[key] = embedding
+        return np.stack([found[key] for key in keys])
+
+    def get_results(self, keys):
+        """
+        Look up cached search results.
+
+        Args:
+            keys (list): Result keys from result_key.
+
+        Returns:
+            hits (list): Cached hit list per key, or None for the keys not cached.
+        """
+        self.refresh()
+        with self.lock:
+            return [self.results.get(key) for key in keys]
+
+    def put_results(self, keys, hits, generation):
+        """
+        Store search results computed against a given index generation.
+
+        Args:
+            keys (list): Result keys from result_key.
+            hits (list): Hit list of each key.
+            generation (int): Generation the results were computed with; results of an older one are not stored.
+        """
+        with self.lock:
+            if generation != self.generation:
+                return
+            for key, entries in zip(keys, hits):
+                self.results.put(key, entries)
+
+    def stats(self):
+        """
+        Report the counters of both levels.
+
+        Returns:
+            stats (dict): "embeddings" and "results" counters (hits, misses, hit_rate, evictions, entries),
+                the current index generation and the number of invalidations.
+        """
+        with self.lock:
+            return {
+                "embeddings": self.embeddings.stats(),
+                "results": self.results.stats(),
+                "generation": self.generation,
+                "invalidations": self.invalidations
+            }
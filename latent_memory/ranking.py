@@ -0,0 +1,86 @@
+# ranking.py
+"""
+Recency-weighted re-ranking of search results.
+
+The search over-fetches candidates, their timestamps are read from the epoch-seconds column that Step2 precomputes
+next to the index (see latent_memory/filters.py), and similarity and recency are blended for the whole candidate
+matrix in one vectorized pass before it is cut down to k. No metadata row is read or parsed to rank.
+"""
+
+import time
+
+import numpy as np
+
+# Defaults of the recency settings accepted by resolve_recency
+DEFAULT_RECENCY = {
+    "half_life_days": 30.0,
+    "weight": 0.3,
+    "decay": "exponential",
+    "overfetch": 4
+}
+
+# Decay functions of the age in days; all of them give 1 at age 0 and 0.5 at the half-life
+DECAYS = {
+    "exponential": lambda age, half_life: np.exp2(-age / half_life),
+    "linear": lambda age, half_life: np.clip(1 - age / (2 * half_life), 0, 1),
+    "hyperbolic": lambda age, half_life: 1 / (1 + age / half_life)
+}
+
+def resolve_recency(recency):
+    """
+    Fill in the defaults of recency settings.
+
+    Args:
+        recency (dict): Any of "half_life_days", "weight" (share of the score given to recency, 0 to 1),
+            "decay" (a name from DECAYS, or a callable decay(age_days, half_life_days) returning weights in [0, 1]),
+            "overfetch" (candidates searched per result) and "now" (reference time in epoch seconds).
+
+    Returns:
+        recency (dict): Complete settings.
+    """
+    resolved = dict(DEFAULT_RECENCY)
+    resolved.update(recency)
+    if not callable(resolved["decay"]) and resolved["decay"] not in DECAYS:
+        raise ValueError(f"Unknown decay {resolved['decay']!r}, expected one of {tuple(DECAYS)} or a callable")
+    if not 0 <= resolved["weight"] <= 1:
+        raise ValueError(f"Recency weight must be between 0 and 1, got {resolved['weight']}")
+    return resolved
+
+def recency_rerank(distances, indices, timestamps, k, recency):
+    """
+    Re-rank search results by a blend of similarity and recency.
+
+    The score of a candidate is (1 - weight) * similarity + weight * decay(age). Candidates without a timestamp
+    (or with an id past the column, such as consolidated centroids) get a recency of 0.
+
+    Args:
+        distances (np.ndarray): Array of shape (n_queries, candidates) of inner-product scores from index.search.
+        indices (np.ndarray): Array of shape (n_queries, candidates) of FAISS ids (-1 for padding).
+        timestamps (np.ndarray): Epoch seconds of every store row (the "timestamp" filter column).
+        k (int): Number of results kept per query.
+        recency (dict): Settings, see resolve_recency.
+
+    Returns:
+        distances (np.ndarray): Blended scores of shape (n_queries, k), best first.
+        indices (np.ndarray): FAISS ids of shape (n_queries, k), -1 where fewer than k candidates were found.
+    """
+    recency = resolve_recency(recency)
+    now = recency.get("now") or time.time()
+    decay = recency["decay"] if callable(recency["decay"]) else DECAYS[recency["decay"]]
+
+    # Gather the timestamps of every candidate at once; padding and unknown ids become NaN
+    known = (indices >= 0) & (indices < len(timestamps))
+    seconds = np.where(known, timestamps[np.where(known, indices, 0)], np.nan)
+    ages = np.maximum((now - seconds) / 86400, 0)
+    weights = np.nan_to_num(decay(ages, recency["half_life_days"]), nan=0.0)
+
+    scores = (1 - recency["weight"]) * distances + recency["weight"] * weights
+    scores = np.where(indices >= 0, scores, -np.inf)
+
+    # Partial sort per row: keep the k best, then order them
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < scores.shape[1] else np.tile(np.arange(k), (len(scores), 1))
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    return top_scores, np.where(np.isfinite(top_scores), np.take_along_axis(indices, top, axis=1), -1)
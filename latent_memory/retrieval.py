@@ -0,0 +1,166 @@
+# retrieval.py
+"""
+Batched semantic retrieval shared by the Step3 script of every variant.
+Encodes all queries in one pass and runs a single FAISS search over the stacked query matrix.
+"""
+
+import numpy as np
+
+from latent_memory.encoding import encode_texts
+from latent_memory.filters import filter_mask, id_selector
+from latent_memory.indexing import search_parameters
+from latent_memory.metrics import count, timer
+from latent_memory.query_cache import result_key
+from latent_memory.ranking import DEFAULT_RECENCY, recency_rerank
+
+def search_batch(index, query_embeddings, k=2, nprobe=None, ef_search=None, selector=None):
+    """
+    Search the FAISS index with a matrix of query embeddings.
+
+    Args:
+        index (faiss.Index or ShardedIndex): FAISS index for semantic search.
+        query_embeddings (np.ndarray): Array of shape (n_queries, dimension).
+        k (int): Number of neighbours to retrieve per query.
+        nprobe (int): IVF clusters visited per query, trading recall for latency (IVF indexes only).
+        ef_search (int): HNSW candidate list size per query, trading recall for latency (HNSW indexes only).
+        selector (faiss.IDSelector): Restricts the search to the selected ids.
+
+    Returns:
+        distances (np.ndarray): Array of shape (n_queries, k) with similarity scores.
+        indices (np.ndarray): Array of shape (n_queries, k) with metadata rows (-1 where FAISS found no hit).
+    """
+    # FAISS expects a contiguous float32 matrix
+    query_embeddings = np.ascontiguousarray(query_embeddings, dtype='float32')
+    if hasattr(index, 'search_shards'):
+        # Sharded indexes search their shards in parallel and merge the results (see latent_memory/sharding.py)
+        with timer("retrieval.search"):
+            return index.search_shards(query_embeddings, k, nprobe, ef_search, selector)
+    params = search_parameters(index, nprobe, ef_search, selector)
+    with timer("retrieval.search"):
+        return index.search(query_embeddings, k, params=params)
+
+def collect_hits(indices, metadata, row_to_dict=None):
+    """
+    Map FAISS result rows back to metadata entries, one hit list per query.
+
+    FAISS pads the result with -1 when k is larger than the number of indexed vectors.
+    Those slots are dropped instead of being read as metadata[-1] (the last row).
+
+    Metadata stores exposing fetch_rows(rows) (e.g. the HDF5 reader) are read once for all the hits of
+    the batch, in sorted row order, instead of row by row.
+
+    Args:
+        indices (np.ndarray): Array of shape (n_queries, k) returned by index.search.
+        metadata (list or np.ndarray): Metadata entries, indexed by FAISS row.
+        row_to_dict (callable): Optional conversion applied to each metadata row (e.g. decoding HDF5 byte strings).
+
+    Returns:
+        hits (list): One list of relevant conversation metadata per query.
+    """
+    with timer("retrieval.metadata"):
+        if hasattr(metadata, 'fetch_rows'):
+            rows = np.unique(indices[indices >= 0])
+            metadata = dict(zip(rows.tolist(), metadata.fetch_rows(rows)))
+
+        hits = []
+        for row in indices:
+            entries = [metadata[int(idx)] for idx in row if idx >= 0]
+            if row_to_dict is not None:
+                entries = [row_to_dict(entry) for entry in entries]
+            hits.append(entries)
+    return hits
+
+def retrieve_batch(queries, index, metadata, k=2, row_to_dict=None, nprobe=None, ef_search=None, filters=None, columns=None, cache=None, recency=None):
+    """
+    Retrieve the top-k most relevant conversations for each query in a list.
+
+    Args:
+        queries (list): List of query strings.
+        index (faiss.Index): FAISS index for semantic search.
+        metadata (list or np.ndarray): Metadata entries, indexed by FAISS row.
+        k (int): Number of conversations to retrieve per query.
+        row_to_dict (callable): Optional conversion applied to each metadata row.
+        nprobe (int): IVF clusters visited per query (IVF indexes only).
+        ef_search (int): HNSW candidate list size per query (HNSW indexes only).
+        filters (dict): Metadata predicates every hit must satisfy, e.g. {"max_age_days": 30, "type": "image generation"}
+            (see latent_memory/filters.py). They are applied inside the FAISS search, so k hits are still returned
+            when at least k conversations match.
+        columns (dict): Filter columns saved by Step2 next to the index (load_columns), required with filters or recency.
+        cache (QueryCache): Optional query cache (latent_memory/query_cache.py). Cached queries are not re-encoded,
+            and queries whose results are cached for the current index generation skip the search entirely.
+        recency (dict): Re-rank by a blend of similarity and recency, e.g. {"half_life_days": 30, "weight": 0.3}
+            (see latent_memory/ranking.py). More candidates are fetched and re-ranked with the timestamp column.
+
+    Returns:
+        hits (list): One list of relevant conversation metadata per query, in query order.
+    """
+    if len(queries) == 0:
+        return []
+
+    # Encode every query in one pass, matching the dimension of the FAISS index
+    count("retrieval.queries", len(queries))
+    if cache is None:
+        with timer("retrieval.encode"):
+            query_embeddings = encode_texts(queries, index.d)
+    else:
+        with timer("retrieval.encode"):
+            query_embeddings = cache.encode(queries, lambda texts: encode_texts(texts, index.d))
+
+        # Serve the queries whose results are cached and only search for the others
+        keys = [result_key(embedding, k, filters, nprobe, ef_search, recency) for embedding in query_embeddings]
+        hits = cache.get_results(keys)
+        generation = cache.generation
+        # Repeated queries in the batch are searched once
+        missing = {}
+        for i, entries in enumerate(hits):
+            if entries is None:
+                missing.setdefault(keys[i], i)
+        count("retrieval.cached_results", len(queries) - sum(entries is None for entries in hits))
+        if missing:
+            found = retrieve_embeddings(query_embeddings[list(missing.values())], index, metadata, k, row_to_dict, nprobe, ef_search, filters, columns, recency)
+            found = dict(zip(missing, found))
+            cache.put_results(list(found), list(found.values()), generation)
+            hits = [found[key] if entries is None else entries for key, entries in zip(keys, hits)]
+        return hits
+
+    return retrieve_embeddings(query_embeddings, index, metadata, k, row_to_dict, nprobe, ef_search, filters, columns, recency)
+
+def retrieve_embeddings(query_embeddings, index, metadata, k=2, row_to_dict=None, nprobe=None, ef_search=None, filters=None, columns=None, recency=None):
+    """
+    Retrieve the top-k most relevant conversations for each row of a matrix of query embeddings.
+
+    Args:
+        query_embeddings (np.ndarray): Array of shape (n_queries, dimension).
+        index (faiss.Index): FAISS index for semantic search.
+        metadata (list or np.ndarray): Metadata entries, indexed by FAISS row.
+        k (int): Number of conversations to retrieve per query.
+        row_to_dict (callable): Optional conversion applied to each metadata row.
+        nprobe (int): IVF clusters visited per query (IVF indexes only).
+        ef_search (int): HNSW candidate list size per query (HNSW indexes only).
+        filters (dict): Metadata predicates every hit must satisfy (see retrieve_batch).
+        columns (dict): Filter columns saved by Step2 next to the index, required with filters or recency.
+        recency (dict): Recency re-ranking settings (see retrieve_batch).
+
+    Returns:
+        hits (list): One list of relevant conversation metadata per query, in query order.
+    """
+    # Turn the metadata predicates into an id selector with a few vectorized comparisons over the precomputed columns
+    selector = None
+    if filters:
+        if columns is None:
+            raise ValueError("Filtered retrieval needs the filter columns saved by Step2 (see latent_memory.filters.load_columns)")
+        with timer("retrieval.filter"):
+            selector = id_selector(filter_mask(columns, filters))
+
+    # Run a single search over the stacked query matrix, over-fetching candidates when they are re-ranked
+    if recency is None:
+        distances, indices = search_batch(index, query_embeddings, k, nprobe, ef_search, selector)
+    else:
+        if columns is None:
+            raise ValueError("Recency re-ranking needs the timestamp column saved by Step2 (see latent_memory.filters.load_columns)")
+        candidates = k * recency.get("overfetch", DEFAULT_RECENCY["overfetch"])
+        distances, indices = search_batch(index, query_embeddings, candidates, nprobe, ef_search, selector)
+        with timer("retrieval.rerank"):
+            distances, indices = recency_rerank(distances, indices, columns["timestamp"], k, recency)
+
+    return collect_hits(indices, metadata, row_to_dict)
@@ -0,0 +1,387 @@
+# server.py
+"""
+Resident retrieval service for the Step3 scripts.
+
+The FAISS index and metadata are loaded once and kept in memory. Queries arriving over HTTP (TCP or a Unix
+socket) are gathered into micro-batches, bounded by a batch size and a maximum wait, and each batch is answered
+with one index.search in a worker thread, so the event loop keeps accepting requests while FAISS runs. When Step2
+saves a new index (its generation counter changes) the index and metadata are reloaded in a second worker thread,
+while queries keep being answered from the previous index, and swapped in between batches, without dropping requests.
+
+With tenants (latent_memory/tenants.py) the server answers for every tenant directory under a root instead of one
+index: requests name their "tenant", each tenant is loaded on its first query into a memory-bounded LRU, and
+queries are only batched with queries of the same tenant.
+
+Only the standard library is used for the protocol: requests are HTTP/1.1 with JSON bodies.
+    POST /retrieve   {"query": "...", "k": 2, "filters": {...}, "recency": {...}, "token_budget": 1000, "tenant": "..."}
+                     ->  {"context": "...", "conversations": [...]}
+    GET  /stats      counters of the server and its query cache
+    GET  /health     {"status": "ok", "generation": n}
+"""
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from latent_memory.filters import load_columns
+from latent_memory.indexing import index_generation
+from latent_memory.query_cache import QueryCache
+from latent_memory.tenants import tenant_directory
+
+# Largest request body accepted, in bytes
+MAX_BODY_BYTES = 1 << 20
+
+# Reason phrases of the status codes the server sends
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+class RetrievalServer:
+    """
+    asyncio retrieval service with request micro-batching and graceful index reload.
+    """
+
+    def __init__(self, load, retrieve, format_context, index_file="faiss_index.bin", max_batch=64, max_wait=0.002,
+                 reload_interval=1.0, cache=True, tenants=None):
+        """
+        Configure the server; nothing is loaded until serve() starts.
+
+        Args:
+            load (callable): load() returning (index, metadata), e.g. a partial of the variant's Step3 load_data;
+                unused with tenants.
+            retrieve (callable): retrieve(queries, index, metadata, k, filters=..., columns=..., cache=..., recency=...) returning
+                one hit list per query, e.g. the variant's retrieve_relevant_conversations_batch.
+            format_context (callable): format_context(hits, token_budget=...) returning the context string,
+                e.g. format_for_inference.
+            index_file (str): Path of the FAISS index, watched for new generations.
+            max_batch (int): Maximum number of queries searched together.
+            max_wait (float): Longest time in seconds the first query of a batch waits for others to join it.
+            reload_interval (float): Seconds between checks of the index generation.
+            cache (bool): Keep a QueryCache of query embeddings and results, cleared on every reload.
+            tenants (TenantIndexes): Serve the tenants of this cache instead of index_file; every request must
+                name its tenant, and each tenant keeps its own query cache.
+        """
+        self.load = load
+        self.retrieve = retrieve
+        self.format_context = format_context
+        self.index_file = index_file
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.reload_interval = reload_interval
+        self.cache = QueryCache() if cache and tenants is None else None
+        self.tenants = tenants
+        # A single search worker: batches run one at a time (FAISS parallelizes each search itself), so readers
+        # that are not thread-safe (HDF5, SQLite) are never used concurrently. Reloads run on their own worker,
+        # so a slow load never holds up the batches searched meanwhile
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval")
+        self.loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reload")
+        self.index = None
+        self.metadata = None
+        self.columns = None
+        self.generation = None
+        self.queue = None
+        self.counters = {"requests": 0, "batches": 0, "queries": 0, "reloads": 0, "errors": 0}
+
+    def _load(self):
+        """
+        Load the index, metadata and filter columns (runs in the reload thread).
+
+        Returns:
+            state (tuple): generation, index, metadata and columns.
+        """
+        generation = index_generation(self.index_file)
+        index, metadata = self.load()
+        return generation, index, metadata, load_columns(self.index_file)
+
+    async def reload(self):
+        """
+        Load the current index in the reload thread and swap it in. Batches keep being searched on the previous
+        index meanwhile; those already running finish on it, and its metadata (and shard workers, for a sharded
+        index) are closed after them.
+        """
+        loop = asyncio.get_running_loop()
+        generation, index, metadata, columns = await loop.run_in_executor(self.loader, self._load)
+        # One assignment on the event loop, so a batch sees either the whole previous state or the whole new one
+        previous = (self.metadata, self.index)
+        self.generation, self.index, self.metadata, self.columns = generation, index, metadata, columns
+        if self.cache is not None:
+            self.cache.set_generation(generation)
+        self.counters["reloads"] += 1
+        for resource in previous:
+            if resource is not None and hasattr(resource, 'close'):
+                # Queued on the single worker, so it runs after every batch that could still use it
+                loop.run_in_executor(self.executor, resource.close)
+
+    async def watch(self):
+        """
+        Reload whenever Step2 saves a new generation of the index.
+        """
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            if self.tenants is not None:
+                # Tenants check their own generation whenever they are queried
+                continue
+            if index_generation(self.index_file) != self.generation:
+                try:
+                    await self.reload()
+                except Exception as error:
+                    # Keep serving the previous index; the next check retries
+                    print(f"Reload of {self.index_file} failed: {error}")
+
+    async def submit(self, query, k=2, filters=None, recency=None, tenant=None):
+        """
+        Queue a query for the next micro-batch and wait for its hits.
+
+        Args:
+            query (str): Query string.
+            k (int): Number of conversations to retrieve.
+            filters (dict): Optional metadata filters (see latent_memory/filters.py).
+            recency (dict): Optional recency re-ranking settings (see latent_memory/ranking.py).
+            tenant (str): Tenant searched, when serving tenants.
+
+        Returns:
+            hits (list): Relevant conversation metadata.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query, k, filters, recency, tenant, future))
+        return await future
+
+    async def batcher(self):
+        """
+        Gather queued queries into micro-batches and search each batch in the worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Queries with the same tenant, k, filters and recency settings share one search
+            groups = {}
+            for item in batch:
+                groups.setdefault((item[4], item[1], json.dumps(item[2:4], sort_keys=True, default=str)), []).append(item)
+            state = (self.generation, self.index, self.metadata, self.columns)
+            for (tenant, k, _), items in groups.items():
+                try:
+                    hits = await loop.run_in_executor(self.executor, self._search, state, [item[0] for item in items], k, items[0][2], items[0][3], tenant)
+                except Exception as error:
+                    for item in items:
+                        if not item[5].done():
+                            item[5].set_exception(error)
+                    continue
+                for item, entries in zip(items, hits):
+                    if not item[5].done():
+                        item[5].set_result(entries)
+            self.counters["batches"] += 1
+            self.counters["queries"] += len(batch)
+
+    def _search(self, state, queries, k, filters, recency, tenant=None):
+        """
+        Run one batched retrieval against a snapshot of the loaded state (runs in the worker thread).
+
+        Args:
+            state (tuple): Generation, index, metadata and columns captured when the batch was formed.
+            queries (list): Query strings.
+            k (int): Number of conversations per query.
+            filters (dict): Metadata filters, or None.
+            recency (dict): Recency re-ranking settings, or None.
+            tenant (str): Tenant searched, when serving tenants; its state is loaded here, in the worker thread.
+
+        Returns:
+            hits (list): One hit list per query.
+        """
+        if self.tenants is not None:
+            entry = self.tenants.get(tenant)
+            return self.retrieve(queries, entry["index"], entry["metadata"], k, filters=filters, columns=entry["columns"], cache=entry["cache"], recency=recency)
+        generation, index, metadata, columns = state
+        # A batch formed just before a reload bypasses the cache, so its results are not stored under the new generation
+        cache = self.cache if generation == self.generation else None
+        return self.retrieve(queries, index, metadata, k, filters=filters, columns=columns, cache=cache, recency=recency)
+
+    def _close(self):
+        """
+        Close the loaded tenants, metadata and index (runs in the search worker, after the last batch that uses them).
+        """
+        if self.tenants is not None:
+            self.tenants.close()
+        for resource in (self.metadata, self.index):
+            if resource is not None and hasattr(resource, 'close'):
+                resource.close()
+
+    def stats(self):
+        """
+        Report the server counters.
+
+        Returns:
+            stats (dict): Requests, batches, queries, reloads and errors, the mean batch size, the loaded
+                index generation and the query cache statistics, or the tenant cache statistics.
+        """
+        stats = dict(self.counters)
+        stats["mean_batch_size"] = self.counters["queries"] / self.counters["batches"] if self.counters["batches"] else 0.0
+        stats["generation"] = self.generation
+        stats["ntotal"] = self.index.ntotal if self.index is not None else 0
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        if self.tenants is not None:
+            stats["tenants"] = self.tenants.stats()
+        return stats
+
+    async def handle(self, reader, writer):
+        """
+        Serve the HTTP requests of one connection (keep-alive until the client closes it).
+
+        Args:
+            reader (asyncio.StreamReader): Connection input.
+            writer (asyncio.StreamWriter): Connection output.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin1').split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin1').partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {"error": "request body too large"}, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self.route(method, path, body)
+                close = headers.get("connection", "").lower() == "close"
+                await self.respond(writer, status, payload, close)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        """
+        Dispatch one request.
+
+        Args:
+            method (str): HTTP method.
+            path (str): Request path.
+            body (bytes): Request body.
+
+        Returns:
+            status (int): HTTP status code.
+            payload (dict): JSON response body.
+        """
+        self.counters["requests"] += 1
+        path = path.split("?", 1)[0]
+        if path == "/health":
+            return 200, {"status": "ok", "generation": self.generation}
+        if path == "/stats":
+            return 200, self.stats()
+        if path != "/retrieve":
+            return 404, {"error": f"unknown path {path}"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        try:
+            request = json.loads(body or b"{}")
+            query = request["query"]
+            if not isinstance(query, str):
+                raise TypeError("query must be a string")
+            k = int(request.get("k", 2))
+            if k < 1:
+                raise ValueError(f"k must be at least 1, got {k}")
+            filters = request.get("filters")
+            recency = request.get("recency")
+            for name, value in (("filters", filters), ("recency", recency)):
+                if value is not None and not isinstance(value, dict):
+                    raise TypeError(f"{name} must be a JSON object")
+            token_budget = request.get("token_budget")
+            if token_budget is not None:
+                token_budget = int(token_budget)
+            tenant = request.get("tenant")
+            if self.tenants is not None:
+                tenant_directory(tenant)
+        except (ValueError, KeyError, TypeError) as error:
+            self.counters["errors"] += 1
+            return 400, {"error": f"expected a JSON body with a query (and a valid tenant when serving tenants): {error}"}
+        started = time.perf_counter()
+        try:
+            hits = await self.submit(query, k, filters, recency, tenant)
+            context = self.format_context(hits, token_budget=token_budget)
+        except FileNotFoundError as error:
+            self.counters["errors"] += 1
+            return 404, {"error": str(error)}
+        except (ValueError, TypeError) as error:
+            # Unknown filters, bad filter values or recency settings are only detected by the search
+            self.counters["errors"] += 1
+            return 400, {"error": str(error)}
+        except Exception as error:
+            self.counters["errors"] += 1
+            return 500, {"error": str(error)}
+        return 200, {
+            "context": context,
+            "conversations": hits,
+            "latency_ms": (time.perf_counter() - started) * 1000
+        }
+
+    async def respond(self, writer, status, payload, close=False):
+        """
+        Write a JSON response.
+
+        Args:
+            writer (asyncio.StreamWriter): Connection output.
+            status (int): HTTP status code.
+            payload (dict): JSON response body.
+            close (bool): Whether the connection is closed after this response.
+        """
+        body = json.dumps(payload, default=str).encode('utf-8')
+        head = (
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin1') + body)
+        await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8765, unix_socket=None):
+        """
+        Load the index and serve requests until cancelled.
+
+        Args:
+            host (str): Interface to listen on (ignored with unix_socket).
+            port (int): TCP port to listen on (ignored with unix_socket).
+            unix_socket (str): Path of a Unix socket to listen on instead of TCP.
+        """
+        self.queue = asyncio.Queue()
+        if self.tenants is None:
+            await self.reload()
+            serving = f"{self.index_file} (generation {self.generation})"
+        else:
+            serving = f"the tenants under {self.tenants.root}"
+        if unix_socket:
+            server = await asyncio.start_unix_server(self.handle, path=unix_socket)
+            print(f"Serving {serving} on {unix_socket}")
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            print(f"Serving {serving} on http://{host}:{port}")
+        tasks = [asyncio.create_task(self.batcher()), asyncio.create_task(self.watch())]
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Queued behind the last batch, so no search still uses the readers
+            self.loader.shutdown(wait=True)
+            closed = self.executor.submit(self._close)
+            self.executor.shutdown(wait=True)
+            closed.result()
@@ -0,0 +1,381 @@
+# sharding.py
+"""
+Sharded FAISS indexes: Step2 can partition the store into N contiguous row ranges, each indexed in its own file
+(faiss_index.bin.shard0, faiss_index.bin.shard1, ...), listed with their row bounds in faiss_index.bin.shards.
+
+Vectors keep their store row as FAISS id in every shard, so shard results are already global metadata rows.
+Step3 opens the shards as one ShardedIndex, which searches them in parallel, in a thread pool (FAISS releases the
+GIL while it searches) or in worker processes that memory-map the shard files, and merges the per-shard top-k
+with one vectorized argpartition over the stacked candidates. A corpus too large for one process can be split into
+shards that each fit, and searched on every core.
+"""
+
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from latent_memory.indexing import (
+    add_rows, create_index, load_index, save_index, save_rows, search_parameters, train_index
+)
+
+# Ways of searching the shards in parallel
+SHARD_POOLS = ("thread", "process")
+
+def shards_file(index_file):
+    """
+    Path of the manifest listing the shards of an index.
+
+    Args:
+        index_file (str): Path of the (logical) FAISS index.
+
+    Returns:
+        path (str): Path of the JSON manifest.
+    """
+    return index_file + ".shards"
+
+def shard_file(index_file, number):
+    """
+    Path of one shard of an index.
+
+    Args:
+        index_file (str): Path of the (logical) FAISS index.
+        number (int): Shard number.
+
+    Returns:
+        path (str): Path of the shard's index file.
+    """
+    return f"{index_file}.shard{number}"
+
+def shard_bounds(rows, shards):
+    """
+    Split the store rows into contiguous, nearly equal ranges.
+
+    Args:
+        rows (int): Number of store rows.
+        shards (int): Number of shards.
+
+    Returns:
+        bounds (list): shards + 1 increasing row numbers; shard i holds rows bounds[i] to bounds[i + 1].
+    """
+    return [int(bound) for bound in np.linspace(0, rows, shards + 1).round()]
+
+def load_manifest(index_file="faiss_index.bin"):
+    """
+    Read the shard manifest of an index.
+
+    Args:
+        index_file (str): Path of the (logical) FAISS index.
+
+    Returns:
+        manifest (dict): "shards" (shard file names, relative to the index directory) and "bounds",
+            or None when the index is not sharded.
+    """
+    path = shards_file(index_file)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(index_file, manifest):
+    """
+    Write the shard manifest of an index, atomically.
+
+    Args:
+        index_file (str): Path of the (logical) FAISS index.
+        manifest (dict): Manifest as returned by load_manifest.
+    """
+    path = shards_file(index_file)
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".shards.tmp")
+    with os.fdopen(handle, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(temporary, path)
+
+def shard_paths(index_file, manifest):
+    """
+    Paths of the shard files listed in a manifest.
+
+    Args:
+        index_file (str): Path of the (logical) FAISS index.
+        manifest (dict): Manifest as returned by load_manifest.
+
+    Returns:
+        paths (list): Path of every shard, in shard order.
+    """
+    directory = os.path.dirname(index_file)
+    return [os.path.join(directory, name) for name in manifest["shards"]]
+
+def index_files(index_file="faiss_index.bin"):
+    """
+    Files holding the vectors of an index: its shards when it is sharded, else the index file itself.
+
+    Args:
+        index_file (str): Path of the (logical) FAISS index.
+
+    Returns:
+        paths (list): Paths of the index files.
+    """
+    manifest = load_manifest(index_file)
+    return [index_file] if manifest is None else shard_paths(index_file, manifest)
+
+def clear_shards(index_file):
+    """
+    Remove the shards and manifest of an index, e.g. when it is rebuilt as a single index.
+
+    Args:
+        index_file (str): Path of the (logical) FAISS index.
+    """
+    manifest = load_manifest(index_file)
+    if manifest is None:
+        return
+    for path in shard_paths(index_file, manifest):
+        for sidecar in (path, path + ".rows", path + ".generation"):
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+    os.remove(shards_file(index_file))
+
+def create_shards(embeddings, index_file, shards, index_spec="flat", pool="thread"):
+    """
+    Partition embeddings into contiguous shards, build and save one index per shard, then the manifest.
+    Call finish_save(index_file) once the other sidecars are written, so readers reload the new shards.
+
+    Args:
+        embeddings (np.ndarray): Array of shape (n, dimension), possibly memory-mapped.
+        index_file (str): Path of the (logical) FAISS index; the shards are saved next to it.
+        shards (int): Number of shards; lowered to the number of rows, so no shard is empty.
+        index_spec (str or dict): Index structure of every shard (see latent_memory/indexing.py); "auto" and
+            the default parameters are resolved from the shard size.
+        pool (str): Pool of the returned ShardedIndex, "thread" or "process".
+
+    Returns:
+        index (ShardedIndex): The built shards, searchable as one index.
+    """
+    if shards < 1:
+        raise ValueError(f"Number of shards must be at least 1, got {shards}")
+    # Empty shards could not be trained, so there are never more shards than rows
+    shards = min(shards, max(len(embeddings), 1))
+    bounds = shard_bounds(len(embeddings), shards)
+    names = [os.path.basename(shard_file(index_file, number)) for number in range(shards)]
+    indexes = []
+    for number, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        part = embeddings[start:end]
+        index = create_index(embeddings.shape[1], index_spec, ntotal=len(part))
+        train_index(index, part)
+        add_rows(index, part, start)
+        save_index(index, shard_file(index_file, number), rows=end)
+        indexes.append(index)
+
+    # Readers find the new shards through the manifest, so it is replaced after them, and a stale single index removed
+    save_manifest(index_file, {"shards": names, "bounds": bounds})
+    if os.path.exists(index_file):
+        os.remove(index_file)
+    save_rows(index_file, bounds[-1])
+    return ShardedIndex(indexes, shard_paths(index_file, load_manifest(index_file)), pool)
+
+def append_shards(index_file, embeddings, metadata, pool="thread"):
+    """
+    Add the rows appended to the store since the sharded index was last saved, to its last shard.
+    Call finish_save(index_file) once the other sidecars are written, so readers reload the new shards.
+
+    Args:
+        index_file (str): Path of the (logical) FAISS index.
+        embeddings (np.ndarray): Embeddings of the new rows only.
+        metadata (list or np.ndarray): Metadata entries of the new rows only.
+        pool (str): Pool of the returned ShardedIndex, "thread" or "process".
+
+    Returns:
+        index (ShardedIndex): Updated shards, searchable as one index.
+        added (int): Number of vectors added.
+    """
+    if len(embeddings) != len(metadata):
+        raise ValueError(
+            f"Store is inconsistent: {len(embeddings)} new embeddings but {len(metadata)} new metadata entries"
+        )
+    manifest = load_manifest(index_file)
+    paths = shard_paths(index_file, manifest)
+    last = load_index(paths[-1])
+    start = manifest["bounds"][-1]
+    if len(embeddings):
+        add_rows(last, embeddings, start)
+        save_index(last, paths[-1], rows=start + len(embeddings))
+        manifest["bounds"][-1] = start + len(embeddings)
+        save_manifest(index_file, manifest)
+        save_rows(index_file, manifest["bounds"][-1])
+    indexes = [load_index(path) for path in paths[:-1]] + [last]
+    return ShardedIndex(indexes, paths, pool), len(embeddings)
+
+def open_index(index_file="faiss_index.bin", mmap=False, shard_pool="thread", workers=None):
+    """
+    Load an index for searching, sharded or not.
+
+    Args:
+        index_file (str): Path of the FAISS index.
+        mmap (bool): Memory-map the index (or every shard) instead of reading it.
+        shard_pool (str): For a sharded index, "thread" or "process" (see ShardedIndex). With "process" the
+            shards are always memory-mapped here, since the workers search their own mappings and this process
+            only searches them for filtered queries.
+        workers (int): Parallel shard searches; defaults to one per shard, up to the number of CPUs.
+
+    Returns:
+        index (faiss.Index or ShardedIndex): Loaded index.
+    """
+    manifest = load_manifest(index_file)
+    if manifest is None:
+        return load_index(index_file, mmap=mmap)
+    paths = shard_paths(index_file, manifest)
+    mmap = mmap or shard_pool == "process"
+    return ShardedIndex([load_index(path, mmap=mmap) for path in paths], paths, shard_pool, workers)
+
+def search_shard(shard, queries, k, nprobe=None, ef_search=None, selector=None):
+    """
+    Search one shard.
+
+    Args:
+        shard (faiss.Index): Shard index.
+        queries (np.ndarray): Contiguous float32 array of shape (n_queries, dimension).
+        k (int): Number of neighbours per query.
+        nprobe (int): IVF clusters visited per query (IVF shards only).
+        ef_search (int): HNSW candidate list size per query (HNSW shards only).
+        selector (faiss.IDSelector): Restricts the search to the selected ids.
+
+    Returns:
+        distances (np.ndarray): Array of shape (n_queries, k) with similarity scores.
+        indices (np.ndarray): Array of shape (n_queries, k) with global store rows (-1 where nothing was found).
+    """
+    return shard.search(queries, k, params=search_parameters(shard, nprobe, ef_search, selector))
+
+def merge_results(distances, indices, k):
+    """
+    Merge the per-shard top-k into the global top-k.
+
+    Args:
+        distances (list): Per-shard arrays of shape (n_queries, k) of inner-product scores.
+        indices (list): Per-shard arrays of shape (n_queries, k) of global store rows (-1 for padding).
+        k (int): Number of results kept per query.
+
+    Returns:
+        distances (np.ndarray): Merged scores of shape (n_queries, k), best first.
+        indices (np.ndarray): Merged store rows of shape (n_queries, k), -1 where fewer than k were found.
+    """
+    indices = np.concatenate(indices, axis=1)
+    scores = np.where(indices >= 0, np.concatenate(distances, axis=1), -np.inf)
+
+    # Partial sort per row over every shard's candidates: keep the k best, then order them
+    if k < scores.shape[1]:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    return np.take_along_axis(scores, top, axis=1).astype('float32'), np.take_along_axis(indices, top, axis=1)
+
+# Shards opened by a worker process, in shard order
+_worker_shards = []
+
+def _open_worker_shards(paths):
+    _worker_shards[:] = [load_index(path, mmap=True) for path in paths]
+
+def _search_worker_shard(number, queries, k, nprobe, ef_search):
+    return search_shard(_worker_shards[number], queries, k, nprobe, ef_search)
+
+class ShardedIndex:
+    """
+    The shards of an index searched as one: exposes d, ntotal and search like a FAISS index, so the retrieval
+    path uses it unchanged, and fans every search out to the shards in parallel.
+    """
+
+    def __init__(self, shards, paths=None, pool="thread", workers=None):
+        """
+        Wrap loaded shards.
+
+        Args:
+            shards (list): Shard indexes, whose ids are global store rows.
+            paths (list): Shard files, required with the process pool.
+            pool (str): "thread" searches the shards in threads of this process; "process" searches them in worker
+                processes that memory-map the shard files, for shards whose index types hold the GIL or
+                corpora that should not live in this process. Filtered searches always run in threads,
+                since FAISS id selectors cannot be sent to other processes.
+            workers (int): Parallel shard searches; defaults to one per shard, up to the number of CPUs.
+        """
+        if pool not in SHARD_POOLS:
+            raise ValueError(f"Unknown shard pool {pool!r}, expected one of {SHARD_POOLS}")
+        if pool == "process" and paths is None:
+            raise ValueError("The process pool needs the paths of the shard files")
+        self.shards = shards
+        self.paths = paths
+        self.pool = pool
+        self.workers = workers or min(len(shards), os.cpu_count() or 1)
+        self.d = shards[0].d
+        self.threads = None
+        self.processes = None
+
+    @property
+    def ntotal(self):
+        return sum(shard.ntotal for shard in self.shards)
+
+    def search_shards(self, queries, k, nprobe=None, ef_search=None, selector=None):
+        """
+        Search every shard in parallel and merge the results.
+
+        Args:
+            queries (np.ndarray): Array of shape (n_queries, dimension).
+            k (int): Number of neighbours per query.
+            nprobe (int): IVF clusters visited per query (IVF shards only).
+            ef_search (int): HNSW candidate list size per query (HNSW shards only).
+            selector (faiss.IDSelector): Restricts the search to the selected ids (global store rows).
+
+        Returns:
+            distances (np.ndarray): Array of shape (n_queries, k) with similarity scores, best first.
+            indices (np.ndarray): Array of shape (n_queries, k) with store rows (-1 where nothing was found).
+        """
+        queries = np.ascontiguousarray(queries, dtype='float32')
+        if len(self.shards) == 1:
+            return search_shard(self.shards[0], queries, k, nprobe, ef_search, selector)
+        if self.pool == "process" and selector is None:
+            if self.processes is None:
+                # Spawned rather than forked, so the workers do not inherit the OpenMP state of this process
+                self.processes = ProcessPoolExecutor(
+                    self.workers, mp_context=get_context("spawn"), initializer=_open_worker_shards, initargs=(self.paths,)
+                )
+            futures = [
+                self.processes.submit(_search_worker_shard, number, queries, k, nprobe, ef_search)
+                for number in range(len(self.shards))
+            ]
+        else:
+            if self.threads is None:
+                self.threads = ThreadPoolExecutor(self.workers, thread_name_prefix="shard")
+            futures = [
+                self.threads.submit(search_shard, shard, queries, k, nprobe, ef_search, selector)
+                for shard in self.shards
+            ]
+        results = [future.result() for future in futures]
+        return merge_results([result[0] for result in results], [result[1] for result in results], k)
+
+    def search(self, queries, k, params=None):
+        """
+        FAISS-style search without per-query parameters (use search_shards for nprobe, ef_search or a selector).
+
+        Args:
+            queries (np.ndarray): Array of shape (n_queries, dimension).
+            k (int): Number of neighbours per query.
+            params: Must be None.
+
+        Returns:
+            distances (np.ndarray): Array of shape (n_queries, k), best first.
+            indices (np.ndarray): Array of shape (n_queries, k) of store rows.
+        """
+        if params is not None:
+            raise ValueError("Pass nprobe, ef_search and selector to ShardedIndex.search_shards instead of params")
+        return self.search_shards(queries, k)
+
+    def close(self):
+        """
+        Stop the worker threads and processes.
+        """
+        for executor in (self.threads, self.processes):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self.threads = self.processes = None
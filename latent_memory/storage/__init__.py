@@ -0,0 +1,5 @@
+# storage
+"""
+Storage backends shared by the variants: one module per on-disk format.
+Each module only imports the libraries its own format needs (pandas, h5py, ...).
+"""
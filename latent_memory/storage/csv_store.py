@@ -0,0 +1,238 @@
+# csv_store.py
+"""
+Incremental writer for the CSV+JSON variant: embedding rows are appended to the CSV file
+and metadata entries to the JSON Lines file, one batch at a time.
+
+The CSV file stays the human-readable copy of the embeddings. Loading it goes through a binary
+sidecar (embeddings.csv.npy) written on first load and validated against the CSV's size, mtime
+and SHA-256, so the text floats are only parsed once.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from latent_memory.precision import load_quantization, quantize, save_quantization
+from latent_memory.storage.json_metadata import JSONLMetadataWriter
+from latent_memory.storage.npy_store import NpyAppendWriter
+from latent_memory.storage.sqlite_metadata import SQLiteMetadataWriter
+
+# Rows parsed at a time when reading a CSV file, so files larger than memory can be converted
+CSV_CHUNK_ROWS = 10_000
+
+def count_csv_rows(embeddings_file):
+    """
+    Count the embedding rows of a CSV file without parsing it.
+
+    Args:
+        embeddings_file (str): Path to the embeddings CSV file.
+
+    Returns:
+        rows (int): Number of data rows (the header line is not counted).
+    """
+    lines = 0
+    last = b"\n"
+    with open(embeddings_file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    # A last line without a trailing newline is still a row
+    if last != b"\n":
+        lines += 1
+    return max(lines - 1, 0)
+
+def sidecar_file(embeddings_file):
+    """
+    Path of the binary copy of an embeddings CSV file.
+
+    Args:
+        embeddings_file (str): Path to the embeddings CSV file.
+
+    Returns:
+        path (str): Path of the .npy sidecar.
+    """
+    return embeddings_file + ".npy"
+
+def file_digest(path, size=None):
+    """
+    SHA-256 of a file, or of its first size bytes.
+
+    Args:
+        path (str): Path to the file.
+        size (int): Number of bytes to hash, or None for the whole file.
+
+    Returns:
+        digest (str): Hex digest.
+    """
+    digest = hashlib.sha256()
+    remaining = os.path.getsize(path) if size is None else size
+    with open(path, 'rb') as f:
+        while remaining > 0:
+            block = f.read(min(1 << 20, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+def read_csv_chunks(source, dtype="float32", chunk_rows=CSV_CHUNK_ROWS, header='infer'):
+    """
+    Parse an embeddings CSV file a chunk of rows at a time.
+
+    Args:
+        source (str or file): Path to the CSV file, or a binary file positioned where parsing starts.
+        dtype (str): Stored precision of the file ("float32", "float16" or "int8").
+        chunk_rows (int): Number of rows parsed per chunk.
+        header ('infer' or None): None when source is positioned after the header line.
+
+    Yields:
+        chunk (np.ndarray): Array of shape (chunk_rows, dimension) at the stored precision (the last one may be shorter).
+    """
+    # The CSV parser has no float16 type, so half-precision files are parsed as float32
+    parse_dtype = "int8" if dtype == "int8" else "float32"
+    for chunk in pd.read_csv(source, dtype=parse_dtype, chunksize=chunk_rows, header=header):
+        yield chunk.to_numpy().astype(dtype, copy=False)
+
+def sync_sidecar(embeddings_file, chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Bring the binary sidecar of an embeddings CSV file up to date with the CSV.
+
+    The sidecar is trusted when the CSV's size and mtime match those recorded with it. Otherwise the
+    recorded SHA-256 is checked against the same number of leading bytes of the CSV: if they match, the
+    CSV was only appended to (or touched) and just the new rows are parsed; if not, the sidecar is rebuilt.
+
+    Args:
+        embeddings_file (str): Path to the embeddings CSV file.
+        chunk_rows (int): Number of rows parsed per chunk.
+
+    Returns:
+        path (str): Path of the .npy sidecar, or None if the CSV holds no rows.
+    """
+    path = sidecar_file(embeddings_file)
+    record_path = path + ".json"
+    record = None
+    if os.path.exists(path) and os.path.exists(record_path):
+        with open(record_path, 'r') as f:
+            record = json.load(f)
+    quantization = load_quantization(embeddings_file) or {"precision": "float32"}
+    stat = os.stat(embeddings_file)
+    if record is not None and record["precision"] == quantization["precision"]:
+        if record["size"] == stat.st_size and record["mtime_ns"] == stat.st_mtime_ns:
+            return path
+        if record["size"] > stat.st_size or file_digest(embeddings_file, record["size"]) != record["sha256"]:
+            record = None
+    else:
+        record = None
+
+    # Drop the record first, so a sidecar left half-written by an interrupted update is rebuilt next time
+    if os.path.exists(record_path):
+        os.remove(record_path)
+    writer = NpyAppendWriter(path, append=record is not None)
+    try:
+        if record is None:
+            for chunk in read_csv_chunks(embeddings_file, quantization["precision"], chunk_rows):
+                writer.append(chunk)
+        elif record["size"] < stat.st_size:
+            # Only the lines after the recorded size are new rows
+            with open(embeddings_file, 'rb') as f:
+                f.seek(record["size"])
+                for chunk in read_csv_chunks(f, quantization["precision"], chunk_rows, header=None):
+                    writer.append(chunk)
+    finally:
+        writer.close()
+    if writer.file is None:
+        return None
+
+    with open(record_path, 'w') as f:
+        json.dump({
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": file_digest(embeddings_file, stat.st_size),
+            "rows": writer.rows,
+            "precision": quantization["precision"]
+        }, f)
+    return path
+
+def load_csv_embeddings(embeddings_file, start=0, mmap=False, chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Load the stored embeddings of a CSV file through its binary sidecar, without parsing the CSV again
+    once the sidecar is up to date.
+
+    Args:
+        embeddings_file (str): Path to the embeddings CSV file.
+        start (int): First row to return.
+        mmap (bool): Return a read-only memory-mapped view instead of reading the rows into memory.
+        chunk_rows (int): Number of rows parsed per chunk when the sidecar needs updating.
+
+    Returns:
+        stored (np.ndarray): Array of the rows from start, at the stored precision.
+    """
+    path = sync_sidecar(embeddings_file, chunk_rows)
+    if path is None:
+        return np.empty((0, 0), dtype='float32')
+    stored = np.load(path, mmap_mode='r')[start:]
+    return stored if mmap else np.array(stored)
+
+class CSVStoreWriter:
+    """
+    Append batches of embeddings and metadata to embeddings.csv and metadata.jsonl.
+    """
+
+    def __init__(self, embeddings_file="embeddings.csv", metadata_file="metadata.jsonl", append=False, precision="float32", metadata_db=None):
+        """
+        Open the store for writing.
+
+        Args:
+            embeddings_file (str): Path to the embeddings CSV file.
+            metadata_file (str): Path to the metadata JSON Lines file.
+            append (bool): Continue an existing store instead of overwriting it.
+            precision (str): Storage precision of a new store ("float32", "float16" or "int8").
+                An existing store keeps its own precision.
+            metadata_db (str): Optional SQLite file that also receives the metadata, keyed by FAISS id
+                (see latent_memory/storage/sqlite_metadata.py).
+        """
+        self.embeddings_file = embeddings_file
+        self.precision = precision
+        append = append and os.path.exists(embeddings_file)
+        self.rows = count_csv_rows(embeddings_file) if append else 0
+        # Stores without a sidecar hold plain floats
+        self.quantization = (load_quantization(embeddings_file) or {"precision": "float32"}) if append else None
+        self.write_header = not append
+        if not append and os.path.exists(embeddings_file):
+            os.remove(embeddings_file)
+        self.metadata_writer = JSONLMetadataWriter(metadata_file, append=append)
+        self.metadata_db = SQLiteMetadataWriter(metadata_db, append=append) if metadata_db else None
+
+    def append(self, embeddings, metadata):
+        """
+        Append one batch to the store.
+
+        Args:
+            embeddings (np.ndarray): Array of embeddings for the batch.
+            metadata (list): List of metadata entries for the batch.
+        """
+        stored, quantization = quantize(embeddings, self.precision, self.quantization, start=self.rows)
+        if quantization is not self.quantization:
+            # The first batch of a new store fixes its precision, and an int8 batch may start a new block
+            save_quantization(self.embeddings_file, quantization)
+            self.quantization = quantization
+        pd.DataFrame(stored).to_csv(self.embeddings_file, mode='a', header=self.write_header, index=False)
+        self.write_header = False
+        self.metadata_writer.append(metadata)
+        if self.metadata_db is not None:
+            self.metadata_db.append(metadata, start=self.rows)
+        self.rows += len(embeddings)
+
+    def close(self):
+        self.metadata_writer.close()
+        if self.metadata_db is not None:
+            self.metadata_db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
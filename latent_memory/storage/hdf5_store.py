@@ -0,0 +1,311 @@
+# hdf5_store.py
+"""
+HDF5 layout for the HDF5 variant: the `embeddings` and `metadata` datasets in latent_memory.h5 are
+chunked, compressed and resizable along the row axis, and metadata strings are variable-length UTF-8,
+so batches can be appended and slices of rows read without touching the rest of the file.
+
+New files are written in HDF5's single-writer/multiple-reader (SWMR) mode, so Step2, Step3 and a running server
+can read the file while Step1 appends to it from another process. Readers keep one SWMR handle open, without
+file locking so a writer can still open the file, and refresh the metadata dataset when asked for rows past the
+length they last saw. HDF5 does not let one process open a file for writing while it holds it open for reading,
+so a writer in the same process must come after the reader is closed (it reopens on its next read). Files created
+before SWMR was used are appended to without it, and readers in other processes must wait until the writer
+closes them.
+"""
+
+import os
+
+import h5py
+import numpy as np
+
+from latent_memory.precision import int8_blocks, quantize
+from latent_memory.storage.sqlite_metadata import SQLiteMetadataWriter
+
+# Variable-length UTF-8 strings: no truncation, and short values do not pay for the longest one
+STRING_DTYPE = h5py.string_dtype('utf-8')
+
+# Compound data type of the metadata rows
+METADATA_DTYPE = np.dtype([
+    ("conversation_id", STRING_DTYPE),
+    ("summary", STRING_DTYPE),
+    ("timestamp", STRING_DTYPE),
+    ("tokens", 'int32')
+])
+
+# Target size of an embeddings chunk: small enough that reading a few rows stays cheap
+EMBEDDINGS_CHUNK_BYTES = 64 * 1024
+
+# Rows per metadata chunk
+METADATA_CHUNK_ROWS = 1024
+
+# Compression filter of both datasets; lzf is fast enough for per-row reads
+COMPRESSION = "lzf"
+
+def open_for_reading(hdf5_file):
+    """
+    Open an HDF5 file for reading while a writer may be appending to it. The file is not locked, so a writer in
+    another process can open it while it is being read.
+
+    Args:
+        hdf5_file (str): Path to the HDF5 file.
+
+    Returns:
+        file (h5py.File): File opened read-only in SWMR mode, seeing every row flushed by the writer so far.
+    """
+    return h5py.File(hdf5_file, 'r', swmr=True, locking=False)
+
+def embeddings_chunk_rows(dimension, dtype):
+    """
+    Number of embedding rows per chunk, so a chunk holds about EMBEDDINGS_CHUNK_BYTES.
+
+    Args:
+        dimension (int): Dimension of the embeddings.
+        dtype (np.dtype): Storage data type of the embeddings.
+
+    Returns:
+        rows (int): Rows per chunk.
+    """
+    return max(1, EMBEDDINGS_CHUNK_BYTES // (dimension * np.dtype(dtype).itemsize))
+
+def write_quantization(dataset, quantization):
+    """
+    Record the storage precision of an embeddings dataset in its attributes.
+
+    Args:
+        dataset (h5py.Dataset): The embeddings dataset.
+        quantization (dict): Encoding returned by quantize.
+    """
+    dataset.attrs['precision'] = quantization["precision"]
+    if quantization["precision"] == "int8":
+        scale, offset, rows, samples = int8_blocks(quantization)
+        dataset.attrs['scale'] = scale
+        dataset.attrs['offset'] = offset
+        dataset.attrs['rows'] = rows
+        dataset.attrs['samples'] = samples
+
+def read_quantization(dataset):
+    """
+    Read the storage precision of an embeddings dataset from its attributes.
+
+    Args:
+        dataset (h5py.Dataset): The embeddings dataset.
+
+    Returns:
+        quantization (dict): Encoding of an int8 dataset, or None for float storage.
+    """
+    if dataset.attrs.get('precision') != "int8":
+        return None
+    quantization = {
+        "precision": "int8",
+        "scale": np.asarray(dataset.attrs['scale'], dtype='float32'),
+        "offset": np.asarray(dataset.attrs['offset'], dtype='float32')
+    }
+    # Datasets written before stores were split into blocks hold one block, whose sample size is unknown
+    for key in ("rows", "samples"):
+        if key in dataset.attrs:
+            quantization[key] = np.asarray(dataset.attrs[key], dtype='int64')
+    return quantization
+
+class HDF5StoreWriter:
+    """
+    Append batches of embeddings and metadata rows to chunked, resizable HDF5 datasets.
+    """
+
+    def __init__(self, hdf5_file="latent_memory.h5", append=False, precision="float32", compression=COMPRESSION, metadata_db=None):
+        """
+        Open the HDF5 file for writing.
+
+        Args:
+            hdf5_file (str): Path to the HDF5 file.
+            append (bool): Continue an existing file instead of overwriting it.
+            precision (str): Storage precision of a new file ("float32", "float16" or "int8").
+                An existing file keeps its own precision.
+            compression (str): HDF5 compression filter of a new file ("lzf", "gzip" or None).
+            metadata_db (str): Optional SQLite file that also receives the metadata, keyed by FAISS id
+                (see latent_memory/storage/sqlite_metadata.py).
+        """
+        self.precision = precision
+        self.compression = compression
+        append = append and os.path.exists(hdf5_file)
+        # The latest file format is required for SWMR
+        self.file = h5py.File(hdf5_file, 'a' if append else 'w', libver='latest')
+        self.rows = len(self.file['metadata']) if 'metadata' in self.file else 0
+        self.quantization = None
+        if 'embeddings' in self.file:
+            # Datasets without a precision attribute hold plain floats
+            self.quantization = read_quantization(self.file['embeddings']) or {"precision": "float32"}
+            self._start_swmr()
+        self.metadata_db = SQLiteMetadataWriter(metadata_db, append=append) if metadata_db else None
+
+    def _start_swmr(self):
+        """
+        Switch to SWMR mode once every dataset and attribute exists, since none can be created afterwards.
+        """
+        try:
+            self.file.swmr_mode = True
+        except (RuntimeError, ValueError):
+            # Files created with an older file format cannot be written in SWMR mode
+            pass
+
+    def _create_datasets(self, embeddings):
+        """
+        Create empty datasets that can be extended along the row axis.
+
+        Args:
+            embeddings (np.ndarray): First batch, used for the dimension and dtype.
+        """
+        dimension = embeddings.shape[1]
+        # Whole rows per chunk, so reading one embedding decompresses a single chunk
+        self.file.create_dataset(
+            'embeddings', shape=(0, dimension), maxshape=(None, dimension), dtype=embeddings.dtype,
+            chunks=(embeddings_chunk_rows(dimension, embeddings.dtype), dimension),
+            compression=self.compression, shuffle=self.compression is not None
+        )
+        self.file.create_dataset(
+            'metadata', shape=(0,), maxshape=(None,), dtype=METADATA_DTYPE,
+            chunks=(METADATA_CHUNK_ROWS,), compression=self.compression
+        )
+
+    def append(self, embeddings, metadata):
+        """
+        Append one batch to the file.
+
+        Args:
+            embeddings (np.ndarray): Array of embeddings for the batch.
+            metadata (list): List of metadata entries as (conversation_id, summary, timestamp, tokens) tuples.
+        """
+        stored, quantization = quantize(embeddings, self.precision, self.quantization, start=self.rows)
+        if 'embeddings' not in self.file:
+            # The first batch of a new file fixes its precision
+            self._create_datasets(stored)
+            write_quantization(self.file['embeddings'], quantization)
+            self.quantization = quantization
+            self._start_swmr()
+        elif quantization is not self.quantization:
+            # The batch starts a new int8 block, recorded before its rows are written
+            write_quantization(self.file['embeddings'], quantization)
+            self.quantization = quantization
+        start, end = self.rows, self.rows + len(embeddings)
+        embeddings_dataset = self.file['embeddings']
+        metadata_dataset = self.file['metadata']
+        # Embeddings first: readers take the length of the metadata dataset as the number of complete rows
+        embeddings_dataset.resize(end, axis=0)
+        embeddings_dataset[start:end] = stored
+        embeddings_dataset.flush()
+        # Files created before a field was added keep their layout, and the extra fields are dropped
+        fields = len(metadata_dataset.dtype.names)
+        metadata_dataset.resize(end, axis=0)
+        metadata_dataset[start:end] = np.array([tuple(entry)[:fields] for entry in metadata], dtype=metadata_dataset.dtype)
+        self.file.flush()
+        if self.metadata_db is not None:
+            self.metadata_db.append([dict(zip(METADATA_DTYPE.names, entry)) for entry in metadata], start=start)
+        self.rows = end
+
+    def close(self):
+        self.file.close()
+        if self.metadata_db is not None:
+            self.metadata_db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class HDF5MetadataReader:
+    """
+    Read-only view of the `metadata` dataset that reads rows on demand, so the metadata table is never loaded
+    into memory as a whole. The file stays open in SWMR mode, so Step1 can keep appending to it from another
+    process while Step3 serves: rows past the known length are picked up by refreshing the dataset, or by
+    reopening the file when a writer that opened it after this reader wrote them.
+    """
+
+    def __init__(self, hdf5_file="latent_memory.h5"):
+        """
+        Open the HDF5 file for reading.
+
+        Args:
+            hdf5_file (str): Path to the HDF5 file.
+        """
+        self.hdf5_file = hdf5_file
+        self.file = None
+        self._open()
+
+    def _open(self):
+        self.file = open_for_reading(self.hdf5_file)
+        self.metadata = self.file['metadata']
+        self.stat = os.stat(self.hdf5_file)
+
+    def _sync(self, rows=None):
+        """
+        Bring the open dataset up to date when more rows are needed than it knows of and the file has changed.
+
+        Args:
+            rows (int): Number of rows the caller needs, or None when it needs the current length.
+
+        Returns:
+            dataset (h5py.Dataset): The metadata dataset.
+        """
+        if self.file is None:
+            self._open()
+        elif rows is None or rows > len(self.metadata):
+            stat = os.stat(self.hdf5_file)
+            if (stat.st_size, stat.st_mtime_ns) != (self.stat.st_size, self.stat.st_mtime_ns):
+                # Rows flushed by a writer already in SWMR mode when the file was opened appear after a refresh
+                if self.file.swmr_mode:
+                    self.metadata.refresh()
+                # A writer that opened the file after this handle is only seen by reopening it
+                if rows is None or rows > len(self.metadata):
+                    self.close()
+                    self._open()
+        return self.metadata
+
+    def _read(self, rows, key):
+        """
+        Read from the metadata dataset.
+
+        Args:
+            rows (int): Number of rows the read needs (see _sync).
+            key: Row, slice or row numbers to read.
+
+        Returns:
+            entries: The rows read.
+        """
+        try:
+            return self._sync(rows)[key]
+        except OSError:
+            # A refreshed handle can still point at space a later writer reallocated
+            self.close()
+            return self._sync(rows)[key]
+
+    def __len__(self):
+        return len(self._sync())
+
+    def __getitem__(self, row):
+        return self._read(row + 1 if isinstance(row, (int, np.integer)) and row >= 0 else None, row)
+
+    def fetch_rows(self, rows):
+        """
+        Read several metadata rows with a single fancy-index read.
+
+        Args:
+            rows (np.ndarray): Sorted, unique row numbers.
+
+        Returns:
+            entries (np.ndarray): Structured array with one entry per row, in the same order.
+        """
+        if len(rows) == 0:
+            return self._read(0, slice(0, 0))
+        rows = np.asarray(rows, dtype='int64')
+        return self._read(int(rows[-1]) + 1, rows)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
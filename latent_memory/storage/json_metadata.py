@@ -0,0 +1,319 @@
+# json_metadata.py
+"""
+JSON Lines metadata storage for the CSV and NumPy variants.
+
+metadata.jsonl holds one JSON object per line and is only ever appended to. Two index files sit next to it:
+metadata.jsonl.offsets holds the byte offset where each line ends (little-endian int64, one per row), and
+metadata.jsonl.ids holds the conversation_id of each row (one JSON value per line). Readers seek straight
+to the rows they need instead of parsing the whole file.
+"""
+
+import json
+import os
+
+import numpy as np
+
+def offsets_file(metadata_file):
+    """
+    Path of the row index of a JSON Lines metadata file.
+
+    Args:
+        metadata_file (str): Path to the metadata .jsonl file.
+
+    Returns:
+        path (str): Path of the offsets file.
+    """
+    return metadata_file + ".offsets"
+
+def ids_file(metadata_file):
+    """
+    Path of the conversation_id index of a JSON Lines metadata file.
+
+    Args:
+        metadata_file (str): Path to the metadata .jsonl file.
+
+    Returns:
+        path (str): Path of the ids file.
+    """
+    return metadata_file + ".ids"
+
+def legacy_json_file(metadata_file):
+    """
+    Path of the indented JSON array that earlier versions wrote instead of a .jsonl file.
+
+    Args:
+        metadata_file (str): Path to the metadata .jsonl file.
+
+    Returns:
+        path (str): Path of the matching metadata.json file.
+    """
+    return os.path.splitext(metadata_file)[0] + ".json"
+
+def convert_json_to_jsonl(json_file="metadata.json", metadata_file="metadata.jsonl"):
+    """
+    Convert a metadata JSON array (as written by json.dump(metadata, f, indent=2)) to JSON Lines with its indexes.
+
+    Args:
+        json_file (str): Path to the metadata JSON file.
+        metadata_file (str): Path of the .jsonl file to write.
+
+    Returns:
+        rows (int): Number of entries converted.
+    """
+    with open(json_file, 'r') as f:
+        metadata = json.load(f)
+    with JSONLMetadataWriter(metadata_file) as writer:
+        writer.append(metadata)
+    return len(metadata)
+
+def scan_lines(metadata_file, position=0):
+    """
+    Find the end offsets of the complete lines of a file from a byte position.
+    A last line without a newline (left by an interrupted write) is not counted.
+
+    Args:
+        metadata_file (str): Path to the metadata .jsonl file.
+        position (int): Byte offset where scanning starts (the end of the last indexed line).
+
+    Returns:
+        ends (np.ndarray): Int64 array with the offset just past each complete line.
+    """
+    ends = []
+    with open(metadata_file, 'rb') as f:
+        f.seek(position)
+        for block in iter(lambda: f.read(1 << 20), b""):
+            newlines = np.flatnonzero(np.frombuffer(block, dtype='uint8') == ord("\n"))
+            ends.append(newlines + position + 1)
+            position += len(block)
+    return np.concatenate(ends).astype('int64') if ends else np.zeros(0, dtype='int64')
+
+def read_line_ids(metadata_file, ends, first):
+    """
+    Read the conversation_id of each row from first onwards.
+
+    Args:
+        metadata_file (str): Path to the metadata .jsonl file.
+        ends (np.ndarray): End offsets of all lines.
+        first (int): First row to read.
+
+    Returns:
+        ids (list): conversation_id of each row (None for rows without one).
+    """
+    ids = []
+    with open(metadata_file, 'rb') as f:
+        f.seek(int(ends[first - 1]) if first else 0)
+        for _ in range(first, len(ends)):
+            ids.append(json.loads(f.readline()).get("conversation_id"))
+    return ids
+
+def sync_index(metadata_file):
+    """
+    Read the row index of a JSON Lines metadata file, bringing both index files up to date with it first.
+
+    Lines appended without index entries are scanned and added; an index describing more data than the file
+    holds is rebuilt from scratch. When only the metadata.json of an earlier version exists, it is converted.
+
+    Args:
+        metadata_file (str): Path to the metadata .jsonl file.
+
+    Returns:
+        ends (np.ndarray): Int64 array with the offset just past each line, one per row.
+    """
+    if not os.path.exists(metadata_file) and os.path.exists(legacy_json_file(metadata_file)):
+        convert_json_to_jsonl(legacy_json_file(metadata_file), metadata_file)
+
+    path = offsets_file(metadata_file)
+    raw = b""
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            raw = f.read()
+    # A torn trailing entry is dropped and the file rewritten, so later appends stay aligned
+    stale = not os.path.exists(path) or len(raw) % 8 != 0
+    ends = np.frombuffer(raw[:len(raw) - len(raw) % 8], dtype='<i8')
+    size = os.path.getsize(metadata_file)
+    if len(ends) and ends[-1] > size:
+        ends, stale = ends[:0], True
+    end = int(ends[-1]) if len(ends) else 0
+    if end < size:
+        scanned = scan_lines(metadata_file, end)
+        stale = stale or len(scanned) > 0
+        ends = np.concatenate([ends, scanned])
+    ends = ends.astype('int64')
+    if stale:
+        ends.astype('<i8').tofile(path)
+
+    # The ids file has one line per row; entries missing from it are read back from the metadata
+    path = ids_file(metadata_file)
+    indexed, last = 0, b"\n"
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                indexed += block.count(b"\n")
+                last = block[-1:]
+    if indexed > len(ends) or last != b"\n":
+        indexed = 0
+    if indexed < len(ends) or not os.path.exists(path):
+        ids = read_line_ids(metadata_file, ends, indexed)
+        with open(path, 'ab' if indexed else 'wb') as f:
+            f.write("".join(json.dumps(i) + "\n" for i in ids).encode('utf-8'))
+    return ends
+
+def load_metadata(metadata_file="metadata.jsonl", start=0):
+    """
+    Load the metadata entries of a JSON Lines file.
+
+    Args:
+        metadata_file (str): Path to the metadata .jsonl file.
+        start (int): First row to return; the lines before it are skipped without being parsed.
+
+    Returns:
+        metadata (list): List of metadata entries as dicts.
+    """
+    ends = sync_index(metadata_file)
+    if start >= len(ends):
+        return []
+    with open(metadata_file, 'rb') as f:
+        f.seek(int(ends[start - 1]) if start else 0)
+        data = f.read(int(ends[-1]) - f.tell())
+    return [json.loads(line) for line in data.splitlines()]
+
+class JSONLMetadataWriter:
+    """
+    Append metadata entries to a JSON Lines file and its row and conversation_id indexes, without rewriting earlier lines.
+    """
+
+    def __init__(self, metadata_file="metadata.jsonl", append=False):
+        """
+        Open the metadata file and its indexes for writing.
+
+        Args:
+            metadata_file (str): Path to the metadata .jsonl file.
+            append (bool): Continue an existing file instead of starting a new one.
+        """
+        self.metadata_file = metadata_file
+        append = append and (os.path.exists(metadata_file) or os.path.exists(legacy_json_file(metadata_file)))
+        self.position = 0
+        self.rows = 0
+        if append:
+            ends = sync_index(metadata_file)
+            self.rows = len(ends)
+            self.position = int(ends[-1]) if len(ends) else 0
+            # Drop a line left incomplete by an interrupted write
+            with open(metadata_file, 'r+b') as f:
+                f.truncate(self.position)
+        mode = 'ab' if append else 'wb'
+        self.file = open(metadata_file, mode)
+        self.offsets = open(offsets_file(metadata_file), mode)
+        self.ids = open(ids_file(metadata_file), mode)
+
+    def append(self, metadata):
+        """
+        Append metadata entries, one line each, and index them.
+
+        Args:
+            metadata (list): List of metadata entries as dicts.
+        """
+        if not metadata:
+            return
+        lines = [(json.dumps(entry) + "\n").encode('utf-8') for entry in metadata]
+        self.file.write(b"".join(lines))
+        self.file.flush()
+
+        # Index entries are written after the data, so they never point past the end of the file
+        ends = self.position + np.cumsum([len(line) for line in lines], dtype='int64')
+        self.offsets.write(ends.astype('<i8').tobytes())
+        self.offsets.flush()
+        self.ids.write("".join(json.dumps(entry.get("conversation_id")) + "\n" for entry in metadata).encode('utf-8'))
+        self.ids.flush()
+        self.position = int(ends[-1])
+        self.rows += len(metadata)
+
+    def close(self):
+        self.file.close()
+        self.offsets.close()
+        self.ids.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class JSONLMetadataReader:
+    """
+    Read-only view of a JSON Lines metadata file that keeps it open and parses rows on demand,
+    by row number or by conversation_id, so Step 3 never parses the whole file.
+    """
+
+    def __init__(self, metadata_file="metadata.jsonl"):
+        """
+        Open the metadata file for reading.
+
+        Args:
+            metadata_file (str): Path to the metadata .jsonl file.
+        """
+        self.metadata_file = metadata_file
+        self.ends = sync_index(metadata_file)
+        self.starts = np.concatenate([[0], self.ends[:-1]]).astype('int64')
+        self.file = open(metadata_file, 'rb')
+        self.rows_by_id = None
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self.ends)
+        if not 0 <= row < len(self.ends):
+            raise IndexError(f"Row {row} is out of range for {len(self.ends)} metadata entries")
+        self.file.seek(int(self.starts[row]))
+        return json.loads(self.file.read(int(self.ends[row] - self.starts[row])))
+
+    def fetch_rows(self, rows):
+        """
+        Read several metadata rows, seeking straight to each line.
+
+        Args:
+            rows (np.ndarray): Sorted, unique row numbers.
+
+        Returns:
+            entries (list): One metadata dict per row, in the same order.
+        """
+        return [self[int(row)] for row in rows]
+
+    def row_of(self, conversation_id):
+        """
+        Find the row of a conversation.
+
+        Args:
+            conversation_id (str): Conversation id to look up.
+
+        Returns:
+            row (int): Row number of the conversation (the last one if the id was stored more than once).
+        """
+        if self.rows_by_id is None:
+            # The ids file is read once, on the first lookup
+            with open(ids_file(self.metadata_file), 'rb') as f:
+                self.rows_by_id = {json.loads(line): row for row, line in enumerate(f)}
+        return self.rows_by_id[conversation_id]
+
+    def get(self, conversation_id):
+        """
+        Read the metadata entry of a conversation.
+
+        Args:
+            conversation_id (str): Conversation id to look up.
+
+        Returns:
+            entry (dict): Metadata entry of the conversation.
+        """
+        return self[self.row_of(conversation_id)]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,170 @@
+# npy_store.py
+"""
+Incremental writer for the NumPy+JSON variant: embeddings grow inside a single .npy file
+and metadata entries are appended to the JSON Lines file, one batch at a time.
+"""
+
+import os
+import struct
+
+import numpy as np
+
+from latent_memory.precision import load_quantization, quantize, save_quantization
+from latent_memory.storage.json_metadata import JSONLMetadataWriter
+from latent_memory.storage.sqlite_metadata import SQLiteMetadataWriter
+
+# Total size of the .npy preamble written for new files, large enough for any row count
+NPY_HEADER_SIZE = 128
+
+def npy_header(rows, dimension, dtype, header_size):
+    """
+    Build a version 1.0 .npy preamble padded to a fixed size, so it can be rewritten in place as rows are added.
+
+    Args:
+        rows (int): Number of rows in the array.
+        dimension (int): Number of columns in the array.
+        dtype (np.dtype): Data type of the array.
+        header_size (int): Total size of the preamble in bytes (magic string included).
+
+    Returns:
+        header (bytes): Preamble to write at the start of the file.
+    """
+    text = "{'descr': %r, 'fortran_order': False, 'shape': (%d, %d), }" % (
+        np.lib.format.dtype_to_descr(dtype), rows, dimension
+    )
+    header_len = header_size - 10
+    if len(text) + 1 > header_len:
+        raise ValueError(f"A {header_size}-byte .npy header cannot describe shape ({rows}, {dimension})")
+    text = text.ljust(header_len - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack('<H', header_len) + text.encode('latin1')
+
+class NpyAppendWriter:
+    """
+    Append rows to a 2D .npy file. The header is updated after every append, so the file
+    can be read with np.load after each batch.
+    """
+
+    def __init__(self, embeddings_file, append=False):
+        """
+        Open the .npy file for writing.
+
+        Args:
+            embeddings_file (str): Path to the embeddings .npy file.
+            append (bool): Continue an existing file instead of overwriting it.
+        """
+        self.embeddings_file = embeddings_file
+        self.file = None
+        self.rows = 0
+        self.dimension = None
+        self.dtype = None
+        self.header_size = NPY_HEADER_SIZE
+        if append and os.path.exists(embeddings_file):
+            self._open_existing()
+
+    def _open_existing(self):
+        """
+        Read the header of an existing .npy file and position the file at its end.
+        """
+        self.file = open(self.embeddings_file, 'r+b')
+        version = np.lib.format.read_magic(self.file)
+        if version != (1, 0):
+            raise ValueError(f"Only version 1.0 .npy files can be appended to, got {version}")
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(self.file)
+        if fortran_order or len(shape) != 2:
+            raise ValueError(f"{self.embeddings_file} does not hold a C-ordered 2D array")
+        self.header_size = self.file.tell()
+        self.rows, self.dimension = shape
+        self.dtype = dtype
+        self.file.seek(self.header_size + self.rows * self.dimension * dtype.itemsize)
+        self.file.truncate()
+
+    def append(self, embeddings):
+        """
+        Append a batch of rows.
+
+        Args:
+            embeddings (np.ndarray): Array of shape (n, dimension).
+        """
+        if self.file is None:
+            # The first batch fixes the dimension and dtype of the file
+            self.dimension = embeddings.shape[1]
+            self.dtype = embeddings.dtype
+            self.file = open(self.embeddings_file, 'w+b')
+            self.file.write(npy_header(0, self.dimension, self.dtype, self.header_size))
+        if embeddings.shape[1] != self.dimension:
+            raise ValueError(f"Expected embeddings of dimension {self.dimension}, got {embeddings.shape[1]}")
+        self.file.write(np.ascontiguousarray(embeddings, dtype=self.dtype).tobytes())
+        self.rows += len(embeddings)
+
+        # Rewrite the header with the new row count and go back to the end of the data
+        end = self.file.tell()
+        self.file.seek(0)
+        self.file.write(npy_header(self.rows, self.dimension, self.dtype, self.header_size))
+        self.file.seek(end)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+class NpyStoreWriter:
+    """
+    Append batches of embeddings and metadata to embeddings.npy and metadata.jsonl.
+    """
+
+    def __init__(self, embeddings_file="embeddings.npy", metadata_file="metadata.jsonl", append=False, precision="float32", metadata_db=None):
+        """
+        Open the store for writing.
+
+        Args:
+            embeddings_file (str): Path to the embeddings .npy file.
+            metadata_file (str): Path to the metadata JSON Lines file.
+            append (bool): Continue an existing store instead of overwriting it.
+            precision (str): Storage precision of a new store ("float32", "float16" or "int8").
+                An existing store keeps its own precision.
+            metadata_db (str): Optional SQLite file that also receives the metadata, keyed by FAISS id
+                (see latent_memory/storage/sqlite_metadata.py).
+        """
+        self.embeddings_file = embeddings_file
+        self.precision = precision
+        append = append and os.path.exists(embeddings_file)
+        # Stores without a sidecar hold plain floats, in the dtype of the .npy file
+        self.quantization = (load_quantization(embeddings_file) or {"precision": "float32"}) if append else None
+        self.embeddings_writer = NpyAppendWriter(embeddings_file, append=append)
+        self.metadata_writer = JSONLMetadataWriter(metadata_file, append=append)
+        self.metadata_db = SQLiteMetadataWriter(metadata_db, append=append) if metadata_db else None
+
+    @property
+    def rows(self):
+        return self.embeddings_writer.rows
+
+    def append(self, embeddings, metadata):
+        """
+        Append one batch to the store.
+
+        Args:
+            embeddings (np.ndarray): Array of embeddings for the batch.
+            metadata (list): List of metadata entries for the batch.
+        """
+        stored, quantization = quantize(embeddings, self.precision, self.quantization, start=self.rows)
+        if quantization is not self.quantization:
+            # The first batch of a new store fixes its precision, and an int8 batch may start a new block
+            save_quantization(self.embeddings_file, quantization)
+            self.quantization = quantization
+        start = self.rows
+        self.embeddings_writer.append(stored)
+        self.metadata_writer.append(metadata)
+        if self.metadata_db is not None:
+            self.metadata_db.append(metadata, start=start)
+
+    def close(self):
+        self.embeddings_writer.close()
+        self.metadata_writer.close()
+        if self.metadata_db is not None:
+            self.metadata_db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
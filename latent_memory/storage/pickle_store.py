@@ -0,0 +1,224 @@
+# pickle_store.py
+"""
+Append-only segmented pickle storage for the Pickle variant.
+
+A .pkl file is a sequence of ordinary pickle records written back to back. Each batch (segment)
+is stored as a {"metadata"} record followed by an {"embeddings", "quantization"} record, so metadata
+can be read without unpickling any embeddings. A compact offset table next to the file
+(latent_memory.pkl.offsets) gives the first row, row count and byte offsets of every segment.
+Files written by a single pickle.dump({"embeddings", "metadata"}) are still read: they form one segment,
+and their offset table is rebuilt by scanning the file.
+Only load .pkl files from trusted sources (see security.md).
+"""
+
+import os
+import pickle
+import struct
+
+import numpy as np
+
+from latent_memory.precision import dequantize, quantize
+from latent_memory.storage.sqlite_metadata import SQLiteMetadataWriter
+
+# Columns of the offset table: first row, row count, offset of the metadata record,
+# offset of the embeddings record and end offset of the segment
+OFFSET_COLUMNS = ("start", "rows", "metadata_offset", "embeddings_offset", "end_offset")
+
+# One little-endian int64 per column
+OFFSET_RECORD = struct.Struct('<5q')
+
+def offsets_file(pickle_file):
+    """
+    Path of the offset table of a .pkl file.
+
+    Args:
+        pickle_file (str): Path to the .pkl file.
+
+    Returns:
+        path (str): Path of the offset table.
+    """
+    return pickle_file + ".offsets"
+
+def scan_segments(pickle_file, position=0, start=0):
+    """
+    Build offset table entries by reading the records of a .pkl file from a byte position.
+
+    Scanning stops at the end of the file or at a truncated record left by an interrupted write.
+
+    Args:
+        pickle_file (str): Path to the .pkl file.
+        position (int): Byte offset where scanning starts (the end of the last known segment).
+        start (int): Row number of the first segment found.
+
+    Returns:
+        table (np.ndarray): Int64 array of shape (n_segments, 5), see OFFSET_COLUMNS.
+    """
+    entries = []
+    with open(pickle_file, 'rb') as f:
+        f.seek(position)
+        while True:
+            metadata_offset = f.tell()
+            try:
+                record = pickle.load(f)
+                if "embeddings" in record:
+                    # Legacy record holding both embeddings and metadata
+                    embeddings_offset = metadata_offset
+                else:
+                    embeddings_offset = f.tell()
+                    pickle.load(f)
+            except (EOFError, pickle.UnpicklingError):
+                break
+            rows = len(record["metadata"])
+            entries.append((start, rows, metadata_offset, embeddings_offset, f.tell()))
+            start += rows
+    return np.array(entries, dtype='int64').reshape(-1, len(OFFSET_COLUMNS))
+
+def read_offsets(pickle_file):
+    """
+    Read the offset table of a .pkl file, bringing it up to date with the file first.
+
+    Segments appended without a table entry (e.g. by older versions) are scanned and added to the table;
+    a table describing more data than the file holds is rebuilt from scratch.
+
+    Args:
+        pickle_file (str): Path to the .pkl file.
+
+    Returns:
+        table (np.ndarray): Int64 array of shape (n_segments, 5), see OFFSET_COLUMNS.
+    """
+    path = offsets_file(pickle_file)
+    table = np.zeros((0, len(OFFSET_COLUMNS)), dtype='int64')
+    if os.path.exists(path):
+        table = np.fromfile(path, dtype='<i8')
+        table = table[:len(table) - len(table) % len(OFFSET_COLUMNS)].reshape(-1, len(OFFSET_COLUMNS))
+
+    size = os.path.getsize(pickle_file)
+    end = int(table[-1, 4]) if len(table) else 0
+    if end > size:
+        table, end = table[:0], 0
+    if end < size:
+        start = int(table[-1, 0] + table[-1, 1]) if len(table) else 0
+        scanned = scan_segments(pickle_file, end, start)
+        if len(scanned) or not os.path.exists(path):
+            table = np.concatenate([table, scanned])
+            try:
+                table.astype('<i8').tofile(path)
+            except OSError:
+                # A read-only location still gets the scanned table, just not persisted
+                pass
+    return table
+
+def load_metadata(pickle_file, start=0):
+    """
+    Load the metadata of a .pkl file without unpickling the embeddings.
+
+    Args:
+        pickle_file (str): Path to the .pkl file.
+        start (int): First row to return; segments before it are not read.
+
+    Returns:
+        metadata (list): List of metadata entries.
+    """
+    metadata = []
+    with open(pickle_file, 'rb') as f:
+        for first, rows, metadata_offset, _, _ in read_offsets(pickle_file):
+            if first + rows <= start:
+                continue
+            f.seek(metadata_offset)
+            metadata.extend(pickle.load(f)["metadata"][max(start - first, 0):])
+    return metadata
+
+def load_segments(pickle_file, start=0):
+    """
+    Load and concatenate the segments of a .pkl file.
+
+    Args:
+        pickle_file (str): Path to the .pkl file.
+        start (int): First row to return; segments before it are not read.
+
+    Returns:
+        embeddings (np.ndarray): Array of embeddings.
+        metadata (list): List of metadata entries.
+    """
+    embeddings, metadata = [], []
+    with open(pickle_file, 'rb') as f:
+        for first, rows, metadata_offset, embeddings_offset, _ in read_offsets(pickle_file):
+            if first + rows <= start:
+                continue
+            offset = max(start - first, 0)
+            f.seek(metadata_offset)
+            record = pickle.load(f)
+            metadata.extend(record["metadata"][offset:])
+            if embeddings_offset != metadata_offset:
+                f.seek(embeddings_offset)
+                record = pickle.load(f)
+            # Each segment carries its own storage precision
+            embeddings.append(dequantize(record["embeddings"][offset:], record.get("quantization")))
+    if not embeddings:
+        return np.empty((0, 0), dtype='float32'), metadata
+    return np.concatenate(embeddings), metadata
+
+class PickleStoreWriter:
+    """
+    Append batches of embeddings and metadata to a .pkl file as new segments, without rewriting earlier ones.
+    """
+
+    def __init__(self, pickle_file="latent_memory.pkl", append=False, precision="float32", metadata_db=None):
+        """
+        Open the .pkl file and its offset table for writing.
+
+        Args:
+            pickle_file (str): Path to the .pkl file.
+            append (bool): Continue an existing file instead of overwriting it.
+            precision (str): Storage precision of the new segments ("float32", "float16" or "int8").
+            metadata_db (str): Optional SQLite file that also receives the metadata, keyed by FAISS id
+                (see latent_memory/storage/sqlite_metadata.py).
+        """
+        self.precision = precision
+        append = append and os.path.exists(pickle_file)
+        self.rows = 0
+        if append:
+            table = read_offsets(pickle_file)
+            self.rows = int(table[-1, 0] + table[-1, 1]) if len(table) else 0
+            # Drop a segment left incomplete by an interrupted write
+            with open(pickle_file, 'r+b') as f:
+                f.truncate(int(table[-1, 4]) if len(table) else 0)
+            # Rewrite the table so a torn trailing entry cannot misalign the new ones
+            table.astype('<i8').tofile(offsets_file(pickle_file))
+        self.file = open(pickle_file, 'ab' if append else 'wb')
+        self.offsets = open(offsets_file(pickle_file), 'ab' if append else 'wb')
+        self.metadata_db = SQLiteMetadataWriter(metadata_db, append=append) if metadata_db else None
+
+    def append(self, embeddings, metadata):
+        """
+        Append one batch to the file as a new segment and record it in the offset table.
+
+        Args:
+            embeddings (np.ndarray): Array of embeddings for the batch.
+            metadata (list): List of metadata entries for the batch.
+        """
+        stored, quantization = quantize(embeddings, self.precision)
+        metadata_offset = self.file.tell()
+        pickle.dump({"metadata": metadata}, self.file)
+        embeddings_offset = self.file.tell()
+        pickle.dump({"embeddings": stored, "quantization": quantization}, self.file)
+        self.file.flush()
+
+        # The table entry is written after the data, so it never points past the end of the file
+        self.offsets.write(OFFSET_RECORD.pack(self.rows, len(metadata), metadata_offset, embeddings_offset, self.file.tell()))
+        self.offsets.flush()
+        if self.metadata_db is not None:
+            self.metadata_db.append(metadata, start=self.rows)
+        self.rows += len(metadata)
+
+    def close(self):
+        self.file.close()
+        self.offsets.close()
+        if self.metadata_db is not None:
+            self.metadata_db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
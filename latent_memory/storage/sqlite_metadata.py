@@ -0,0 +1,225 @@
+# sqlite_metadata.py
+"""
+SQLite metadata store that any variant can write next to its own files and read in Step 3.
+
+Entries live in the conversation_summaries table shown in the README, keyed by FAISS id (row_id), with secondary
+indexes on conversation_id, timestamp and type. Lookups go through the B-tree indexes, so they stay O(log n) and
+only the rows asked for are held in memory, however large the store grows. The database runs in WAL mode, so
+Step 3 processes can read while Step 1 appends.
+"""
+
+import json
+import os
+import sqlite3
+from urllib.request import pathname2url
+
+# Columns of conversation_summaries besides row_id; other metadata keys are kept as JSON in the extra column
+METADATA_COLUMNS = ("conversation_id", "title", "timestamp", "type", "summary")
+
+# Maximum number of SQLite parameters used in a single lookup
+LOOKUP_CHUNK = 500
+
+def connect(metadata_db):
+    """
+    Open the metadata database in WAL mode, creating the table and its indexes if needed.
+
+    Args:
+        metadata_db (str): Path to the SQLite file.
+
+    Returns:
+        connection (sqlite3.Connection): Open connection.
+    """
+    connection = sqlite3.connect(metadata_db)
+    connection.execute("PRAGMA journal_mode=WAL")
+    # In WAL mode, NORMAL only syncs at checkpoints and still never corrupts the database
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS conversation_summaries ("
+        "row_id INTEGER PRIMARY KEY, conversation_id TEXT, title TEXT, timestamp TEXT, type TEXT, summary TEXT, extra TEXT)"
+    )
+    for column in ("conversation_id", "timestamp", "type"):
+        connection.execute(
+            f"CREATE INDEX IF NOT EXISTS conversation_summaries_{column} ON conversation_summaries ({column})"
+        )
+    connection.commit()
+    return connection
+
+def entry_to_row(row_id, entry):
+    """
+    Split a metadata entry into the values of a conversation_summaries row.
+
+    Args:
+        row_id (int): FAISS id of the entry.
+        entry (dict): Metadata entry.
+
+    Returns:
+        row (tuple): row_id, one value per METADATA_COLUMNS and the JSON of the remaining keys (or None).
+    """
+    extra = {key: value for key, value in entry.items() if key not in METADATA_COLUMNS}
+    return (row_id, *(entry.get(column) for column in METADATA_COLUMNS), json.dumps(extra) if extra else None)
+
+def row_to_entry(row):
+    """
+    Rebuild a metadata entry from a conversation_summaries row (without its row_id).
+
+    Args:
+        row (tuple): One value per METADATA_COLUMNS followed by the extra column.
+
+    Returns:
+        entry (dict): Metadata entry, without the columns that were NULL.
+    """
+    entry = {column: value for column, value in zip(METADATA_COLUMNS, row) if value is not None}
+    if row[-1] is not None:
+        entry.update(json.loads(row[-1]))
+    return entry
+
+class SQLiteMetadataWriter:
+    """
+    Insert batches of metadata entries into the metadata database, one transaction per batch.
+    """
+
+    def __init__(self, metadata_db="metadata.sqlite", append=False):
+        """
+        Open the database for writing.
+
+        Args:
+            metadata_db (str): Path to the SQLite file.
+            append (bool): Keep the existing entries instead of clearing the table.
+        """
+        self.connection = connect(metadata_db)
+        if not append:
+            with self.connection:
+                self.connection.execute("DELETE FROM conversation_summaries")
+        self.rows = self.connection.execute(
+            "SELECT COALESCE(MAX(row_id) + 1, 0) FROM conversation_summaries"
+        ).fetchone()[0]
+
+    def append(self, metadata, start=None):
+        """
+        Insert one batch of metadata entries.
+
+        Args:
+            metadata (list): List of metadata entries as dicts.
+            start (int): FAISS id of the first entry; defaults to the row after the last one stored.
+                Store writers pass their own row count, so ids match the vector store even if the database
+                was added later. Existing rows with the same ids are replaced.
+        """
+        start = self.rows if start is None else start
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO conversation_summaries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [entry_to_row(row_id, entry) for row_id, entry in enumerate(metadata, start)]
+            )
+        self.rows = max(self.rows, start + len(metadata))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class SQLiteMetadataReader:
+    """
+    Read-only view of the metadata database: rows are fetched by FAISS id through the primary key,
+    or by attribute through the secondary indexes.
+    """
+
+    def __init__(self, metadata_db="metadata.sqlite"):
+        """
+        Open the database for reading.
+
+        Args:
+            metadata_db (str): Path to the SQLite file, written by SQLiteMetadataWriter.
+        """
+        if not os.path.exists(metadata_db):
+            raise FileNotFoundError(f"No metadata database at {metadata_db}")
+        # Read-only, so a mistyped path is never created as an empty database and the schema is left to the writer.
+        # The connection may be opened in one thread and used or closed in another (the retrieval server loads
+        # it in its reload thread); callers never use it from two threads at once
+        self.connection = sqlite3.connect(
+            f"file:{pathname2url(os.path.abspath(metadata_db))}?mode=ro", uri=True, check_same_thread=False
+        )
+
+    def __len__(self):
+        # MAX on the primary key is a single B-tree descent, unlike COUNT(*)
+        return self.connection.execute(
+            "SELECT COALESCE(MAX(row_id) + 1, 0) FROM conversation_summaries"
+        ).fetchone()[0]
+
+    def __getitem__(self, row):
+        found = self.connection.execute(
+            f"SELECT {', '.join(METADATA_COLUMNS)}, extra FROM conversation_summaries WHERE row_id = ?", (int(row),)
+        ).fetchone()
+        if found is None:
+            raise IndexError(f"No metadata entry with FAISS id {row}")
+        return row_to_entry(found)
+
+    def fetch_rows(self, rows):
+        """
+        Read several metadata rows by FAISS id through the primary key.
+
+        Args:
+            rows (np.ndarray): Sorted, unique row numbers.
+
+        Returns:
+            entries (list): One metadata dict per row, in the same order.
+        """
+        rows = [int(row) for row in rows]
+        found = {}
+        for start in range(0, len(rows), LOOKUP_CHUNK):
+            chunk = rows[start:start + LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            for row in self.connection.execute(
+                f"SELECT row_id, {', '.join(METADATA_COLUMNS)}, extra FROM conversation_summaries WHERE row_id IN ({placeholders})",
+                chunk
+            ):
+                found[row[0]] = row_to_entry(row[1:])
+        missing = [row for row in rows if row not in found]
+        if missing:
+            raise IndexError(f"No metadata entries with FAISS ids {missing[:10]}")
+        return [found[row] for row in rows]
+
+    def find_rows(self, **conditions):
+        """
+        Find the FAISS ids of the entries whose columns equal the given values, using the secondary indexes.
+
+        Args:
+            **conditions: Column values to match, e.g. type="image generation" or timestamp="2025-04-01 10:00:00".
+
+        Returns:
+            rows (list): Matching FAISS ids in ascending order.
+        """
+        unknown = set(conditions) - set(METADATA_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown metadata columns {sorted(unknown)}, expected some of {METADATA_COLUMNS}")
+        where = " AND ".join(f"{column} = ?" for column in conditions) or "1"
+        return [row for (row,) in self.connection.execute(
+            f"SELECT row_id FROM conversation_summaries WHERE {where} ORDER BY row_id", list(conditions.values())
+        )]
+
+    def get(self, conversation_id):
+        """
+        Read the metadata entry of a conversation.
+
+        Args:
+            conversation_id (str): Conversation id to look up.
+
+        Returns:
+            entry (dict): Metadata entry of the conversation (the last one if the id was stored more than once).
+        """
+        rows = self.find_rows(conversation_id=conversation_id)
+        if not rows:
+            raise KeyError(conversation_id)
+        return self[rows[-1]]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
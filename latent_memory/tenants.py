@@ -0,0 +1,243 @@
+# tenants.py
+"""
+Multi-tenant layout: every tenant (user) has its own directory holding the usual files of a variant
+(faiss_index.bin and its sidecars, the embedding store and the metadata), so memories of different tenants never
+share an index and each search only touches the vectors of one tenant.
+
+    tenants/
+        alice/faiss_index.bin, metadata.jsonl, ...
+        bob/faiss_index.bin, metadata.jsonl, ...
+
+Step1 and Step2 write a tenant by passing paths inside tenant_directory(tenant_id, create=True). A resident
+process serves every tenant through TenantIndexes: an index is loaded on the first query of its tenant and kept
+in a least-recently-used cache whose estimated memory stays under a budget, so thousands of tenants can share one
+machine while only the active ones are resident.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from latent_memory.filters import load_columns
+from latent_memory.indexing import index_generation
+from latent_memory.query_cache import QueryCache
+from latent_memory.sharding import index_files
+
+# Root directory of the tenant directories
+TENANTS_DIRECTORY = "tenants"
+
+# Default memory budget of the loaded tenant indexes, in bytes
+DEFAULT_MEMORY_BUDGET = 2 << 30
+
+# Bytes counted per indexed row for the lazy metadata readers (offset and id arrays)
+METADATA_BYTES_PER_ROW = 16
+
+# Query embeddings and result sets cached per loaded tenant
+TENANT_CACHE_ENTRIES = 256
+
+# Tenant ids are used as directory names, so they are restricted to a safe set of characters
+TENANT_ID = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,127}")
+
+def tenant_directory(tenant_id, root=TENANTS_DIRECTORY, create=False):
+    """
+    Directory holding the files of a tenant.
+
+    Args:
+        tenant_id (str): Tenant id: letters, digits, "_", "." and "-", starting with a letter or digit.
+        root (str): Root directory of the tenants.
+        create (bool): Create the directory if it does not exist, e.g. before Step1 writes a new tenant.
+
+    Returns:
+        directory (str): Path of the tenant directory.
+    """
+    if not isinstance(tenant_id, str) or not TENANT_ID.fullmatch(tenant_id):
+        raise ValueError(f"Invalid tenant id {tenant_id!r}")
+    directory = os.path.join(root, tenant_id)
+    if create:
+        os.makedirs(directory, exist_ok=True)
+    return directory
+
+def list_tenants(root=TENANTS_DIRECTORY, index_name="faiss_index.bin"):
+    """
+    List the tenants that have an index.
+
+    Args:
+        root (str): Root directory of the tenants.
+        index_name (str): File name of the FAISS index inside a tenant directory.
+
+    Returns:
+        tenant_ids (list): Sorted tenant ids.
+    """
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if TENANT_ID.fullmatch(name) and all(os.path.exists(path) for path in index_files(os.path.join(root, name, index_name)))
+    )
+
+def estimated_bytes(index_file, index, columns):
+    """
+    Estimate the memory a loaded tenant holds.
+
+    The index counts as the size of its file (or shard files), whether it is read or memory-mapped (the pages a search touches become
+    resident either way), plus the filter columns and the per-row arrays of the lazy metadata readers.
+
+    Args:
+        index_file (str): Path of the FAISS index.
+        index (faiss.Index): The loaded index.
+        columns (dict): Filter columns loaded with it, or None.
+
+    Returns:
+        size (int): Estimated number of bytes.
+    """
+    size = sum(os.path.getsize(path) for path in index_files(index_file)) + METADATA_BYTES_PER_ROW * index.ntotal
+    if columns:
+        size += sum(values.nbytes for values in columns.values())
+    return size
+
+class TenantIndexes:
+    """
+    Least-recently-used cache of loaded tenant indexes, bounded by a memory budget. Thread-safe; loads are serialized.
+    """
+
+    def __init__(self, load, root=TENANTS_DIRECTORY, memory_budget=DEFAULT_MEMORY_BUDGET, index_name="faiss_index.bin",
+                 cache=True):
+        """
+        Create an empty cache; nothing is loaded until a tenant is queried.
+
+        Args:
+            load (callable): load(directory) returning (index, metadata) for a tenant directory,
+                e.g. the variant's Step3 load_tenant.
+            root (str): Root directory of the tenants.
+            memory_budget (int): Estimated bytes the loaded tenants may hold together. The least recently used
+                tenants are evicted to stay under it; the tenant being queried is always kept.
+            index_name (str): File name of the FAISS index inside a tenant directory.
+            cache (bool): Keep a small QueryCache per loaded tenant.
+        """
+        self.load = load
+        self.root = root
+        self.memory_budget = memory_budget
+        self.index_name = index_name
+        self.cache = cache
+        self.entries = OrderedDict()
+        self.resident_bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "loads": 0, "reloads": 0, "evictions": 0}
+
+    def index_file(self, tenant_id):
+        """
+        Path of the FAISS index of a tenant.
+
+        Args:
+            tenant_id (str): Tenant id.
+
+        Returns:
+            path (str): Path of the index file.
+        """
+        return os.path.join(tenant_directory(tenant_id, self.root), self.index_name)
+
+    def _load(self, tenant_id):
+        """
+        Load the index, metadata and filter columns of a tenant.
+
+        Args:
+            tenant_id (str): Tenant id.
+
+        Returns:
+            entry (dict): generation, index, metadata, columns, bytes and cache of the tenant.
+        """
+        index_file = self.index_file(tenant_id)
+        if not all(os.path.exists(path) for path in index_files(index_file)):
+            raise FileNotFoundError(f"Unknown tenant {tenant_id!r}: no index at {index_file}")
+        generation = index_generation(index_file)
+        index, metadata = self.load(os.path.dirname(index_file))
+        columns = load_columns(index_file)
+        return {
+            "generation": generation,
+            "index": index,
+            "metadata": metadata,
+            "columns": columns,
+            "bytes": estimated_bytes(index_file, index, columns),
+            "cache": QueryCache(index_file, TENANT_CACHE_ENTRIES, TENANT_CACHE_ENTRIES) if self.cache else None
+        }
+
+    def get(self, tenant_id):
+        """
+        Return the loaded state of a tenant, loading it on first use, reloading it when Step2 saved a new
+        generation of its index, and evicting least recently used tenants beyond the memory budget.
+
+        Args:
+            tenant_id (str): Tenant id.
+
+        Returns:
+            entry (dict): "index", "metadata", "columns" (for filters and recency), "cache" (QueryCache or None),
+                "generation" and "bytes" of the tenant.
+        """
+        with self.lock:
+            entry = self.entries.get(tenant_id)
+            if entry is not None and entry["generation"] != index_generation(self.index_file(tenant_id)):
+                # Step2 saved the tenant again: drop the stale state and load the new one below
+                self._remove(tenant_id)
+                entry = None
+                self.counters["reloads"] += 1
+            if entry is None:
+                entry = self._load(tenant_id)
+                self.entries[tenant_id] = entry
+                self.resident_bytes += entry["bytes"]
+                self.counters["loads"] += 1
+            else:
+                self.counters["hits"] += 1
+            self.entries.move_to_end(tenant_id)
+
+            # Evict from the least recently used end until the budget holds
+            while self.resident_bytes > self.memory_budget and len(self.entries) > 1:
+                self._remove(next(iter(self.entries)))
+                self.counters["evictions"] += 1
+            return entry
+
+    def evict(self, tenant_id):
+        """
+        Unload a tenant, e.g. after deleting its directory.
+
+        Args:
+            tenant_id (str): Tenant id.
+        """
+        with self.lock:
+            if tenant_id in self.entries:
+                self._remove(tenant_id)
+                self.counters["evictions"] += 1
+
+    def _remove(self, tenant_id):
+        entry = self.entries.pop(tenant_id)
+        self.resident_bytes -= entry["bytes"]
+        for resource in (entry["metadata"], entry["index"]):
+            # Metadata readers hold open files, and sharded indexes their shard workers
+            if hasattr(resource, 'close'):
+                resource.close()
+
+    def stats(self):
+        """
+        Report the cache counters.
+
+        Returns:
+            stats (dict): hits, loads, reloads and evictions, the number of loaded tenants, their estimated
+                resident bytes and the memory budget.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats["loaded"] = len(self.entries)
+            stats["resident_bytes"] = self.resident_bytes
+            stats["memory_budget"] = self.memory_budget
+            return stats
+
+    def close(self):
+        with self.lock:
+            while self.entries:
+                self._remove(next(iter(self.entries)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
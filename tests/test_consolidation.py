@@ -0,0 +1,87 @@
+# test_consolidation.py
+"""
+Consolidate, append, update and retrieve through the Step scripts of the NumPy + JSON variant.
+"""
+
+import importlib.util
+import os
+import sys
+
+import faiss
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from latent_memory.consolidation import consolidate, load_consolidation, records_file
+from latent_memory.encoding import HashingEncoder, get_encoder, set_encoder
+from latent_memory.filters import load_columns
+from latent_memory.indexing import indexed_rows
+from latent_memory.storage.json_metadata import load_metadata
+
+def load_step(step, variant="2. npy and json"):
+    spec = importlib.util.spec_from_file_location(f"step{step}", os.path.join(ROOT, variant, f"Step{step}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture
+def steps(tmp_path, monkeypatch):
+    # Deterministic embeddings, so an exact-text query finds its own conversation
+    monkeypatch.chdir(tmp_path)
+    previous = get_encoder()
+    set_encoder(HashingEncoder())
+    yield load_step(1), load_step(2), load_step(3)
+    set_encoder(previous)
+
+def test_update_after_consolidation_indexes_new_rows_under_their_store_row(steps):
+    step1, step2, step3 = steps
+    conversations = [f"conversation {i} about topic {i} with words w{i}a w{i}b" for i in range(40)]
+
+    step1.ingest_stream(conversations[:25])
+    step2.update_faiss_index()
+    index = step2.consolidate_faiss_index(max_age_days=0, members_per_centroid=5)
+    ntotal = index.ntotal
+    assert ntotal < 25
+
+    step1.ingest_stream(conversations[25:], append=True)
+    index = step2.update_faiss_index()
+    assert index.ntotal == ntotal + 15
+    assert indexed_rows("faiss_index.bin", index) == 40
+
+    index, metadata = step3.load_data()
+    try:
+        for row in (25, 37, 39):
+            hits = step3.retrieve_relevant_conversations(conversations[row], index, metadata, k=1, columns=load_columns())
+            assert hits[0]["conversation_id"] == f"conv_{row}"
+    finally:
+        metadata.close()
+
+    # A second consolidation removes the new rows it replaces instead of growing the index
+    index = step2.consolidate_faiss_index(max_age_days=0, members_per_centroid=5)
+    assert index.ntotal < ntotal + 15
+
+def test_records_left_by_an_interrupted_consolidation_are_dropped(steps):
+    step1, step2, _ = steps
+    step1.ingest_stream([f"conversation {i} about topic {i}" for i in range(20)])
+    step2.update_faiss_index()
+    step2.consolidate_faiss_index(max_age_days=0, members_per_centroid=5)
+    centroids = len(load_consolidation()["centroids"])
+
+    # A run that wrote its records but crashed before saving the state
+    with open(records_file("faiss_index.bin"), 'a') as f:
+        f.write('{"conversation_id": "orphan"}\n')
+
+    step1.ingest_stream([f"conversation {i} about topic {i}" for i in range(20, 40)], append=True)
+    step2.update_faiss_index()
+    step2.consolidate_faiss_index(max_age_days=0, members_per_centroid=5)
+    records = load_metadata(records_file("faiss_index.bin"))
+    assert len(records) == len(load_consolidation()["centroids"]) > centroids
+    assert [record["conversation_id"] for record in records] == [f"consolidated_{i}" for i in range(len(records))]
+
+def test_consolidate_rejects_indexes_without_ids(tmp_path):
+    index = faiss.IndexFlatIP(8)
+    index.add(np.random.rand(4, 8).astype('float32'))
+    with pytest.raises(ValueError):
+        consolidate(index, str(tmp_path / "faiss_index.bin"), np.zeros((4, 8), dtype='float32'), [{}] * 4)
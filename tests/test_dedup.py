@@ -0,0 +1,63 @@
+# test_dedup.py
+"""
+Near-duplicate merging: every duplicate must link to the first distinct row, within a chunk and across chunks.
+"""
+
+import os
+import sys
+
+import faiss
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from latent_memory.dedup import add_distinct, dedup_report, linked_rows
+
+def distinct_vectors(rows, dimension=32, seed=0):
+    # Random directions in 32 dimensions are far below the 0.95 cosine threshold of each other
+    return np.random.default_rng(seed).standard_normal((rows, dimension)).astype('float32')
+
+def store_rows():
+    # Rows 2 and 5 repeat row 0 (scaled, so only their cosine matches), row 4 repeats row 1
+    a, b, c, d = distinct_vectors(4)
+    return np.stack([a, b, 3 * a, c, b, a, d])
+
+def indexed_ids(index):
+    return sorted(faiss.vector_to_array(index.id_map).tolist())
+
+def new_index(dimension=32):
+    return faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+
+@pytest.mark.parametrize("chunk_size", [4096, 2, 1])
+def test_duplicates_link_to_the_first_distinct_row(chunk_size):
+    # One chunk checks every pair in its similarity matrix; chunks of 1 or 2 rows find the earlier rows in the index
+    index = new_index()
+    dedup = add_distinct(index, store_rows(), 0, chunk_size=chunk_size)
+
+    assert dedup["canonical"].tolist() == [-1, -1, 0, -1, 1, 0, -1]
+    assert indexed_ids(index) == [0, 1, 3, 6]
+    assert linked_rows(dedup, 0).tolist() == [2, 5]
+    assert dedup_report(dedup)["duplicates"] == 3
+
+def test_repeats_within_a_chunk_link_to_the_first_row_not_to_each_other():
+    a = distinct_vectors(1)[0]
+    index = new_index()
+    dedup = add_distinct(index, np.stack([a, a, 2 * a, a]), 0)
+
+    assert dedup["canonical"].tolist() == [-1, 0, 0, 0]
+    assert indexed_ids(index) == [0]
+
+def test_appended_rows_link_to_rows_of_earlier_builds():
+    rows = store_rows()
+    index = new_index()
+    dedup = add_distinct(index, rows[:4], 0)
+
+    # A later batch repeating rows of the first one, and repeating itself
+    later = np.stack([rows[1], distinct_vectors(1, seed=1)[0], rows[0], rows[1]])
+    dedup = add_distinct(index, later, 4, dedup=dedup)
+
+    assert dedup["canonical"].tolist() == [-1, -1, 0, -1, 1, -1, 0, 1]
+    assert indexed_ids(index) == [0, 1, 3, 5]
+    assert len(dedup["norms"]) == 8
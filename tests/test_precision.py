@@ -0,0 +1,49 @@
+# test_precision.py
+"""
+int8 storage of streamed batches: every batch must come back close to what was written.
+"""
+
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from latent_memory.precision import MIN_FIT_ROWS, dequantize, load_quantization, quantize
+from latent_memory.storage.npy_store import NpyStoreWriter
+
+def test_batches_after_a_one_row_fit_start_a_new_block():
+    rng = np.random.default_rng(0)
+    first, second = rng.random((1, 16)) - 5, rng.random((200, 16))
+    stored_first, quantization = quantize(first, "int8")
+    stored_second, quantization = quantize(second, "int8", quantization, start=1)
+    assert quantization["rows"].tolist() == [0, 1]
+    restored = dequantize(np.concatenate([stored_first, stored_second]), quantization)
+    assert np.abs(restored - np.concatenate([first, second])).max() < 1 / 255
+
+def test_batches_within_a_large_fit_reuse_it_and_others_are_not_clipped():
+    rng = np.random.default_rng(1)
+    base = rng.random((MIN_FIT_ROWS, 16)) * 2 - 1
+    _, quantization = quantize(base, "int8")
+    inside = rng.random((10, 16)) * 0.5
+    _, reused = quantize(inside, "int8", quantization, start=MIN_FIT_ROWS)
+    assert reused is quantization
+    outside = rng.random((10, 16)) * 4
+    stored, extended = quantize(outside, "int8", quantization, start=MIN_FIT_ROWS)
+    assert extended["rows"].tolist() == [0, MIN_FIT_ROWS]
+    assert np.abs(dequantize(stored, extended, MIN_FIT_ROWS) - outside).max() < 4 / 255
+
+def test_streamed_npy_store_round_trips(tmp_path):
+    rng = np.random.default_rng(2)
+    batches = [rng.random((1, 8)), rng.random((300, 8)) * 3 - 1, rng.random((5, 8)) * 10]
+    embeddings_file = str(tmp_path / "embeddings.npy")
+    for number, batch in enumerate(batches):
+        metadata = [{"conversation_id": f"conv_{number}_{row}"} for row in range(len(batch))]
+        with NpyStoreWriter(embeddings_file, str(tmp_path / "metadata.jsonl"), append=number > 0, precision="int8") as writer:
+            writer.append(batch.astype('float32'), metadata)
+    expected = np.concatenate(batches)
+    for start in (0, 1, 250):
+        restored = dequantize(np.load(embeddings_file)[start:], load_quantization(embeddings_file), start)
+        assert np.abs(restored - expected[start:]).max() < 10 / 255
@@ -0,0 +1,85 @@
+# test_sharding.py
+"""
+Sharded search must return what one flat index over the same rows returns, across shard boundaries and with padding.
+"""
+
+import os
+import sys
+
+import faiss
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from latent_memory.sharding import create_shards, merge_results, open_index
+
+def embeddings(rows, dimension=16, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((rows, dimension)).astype('float32')
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def flat_search(vectors, queries, k, ids=None):
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+    rows = np.arange(len(vectors), dtype='int64')
+    if ids is not None:
+        rows = rows[ids]
+        vectors = vectors[ids]
+    index.add_with_ids(vectors, rows)
+    return index.search(queries, k)
+
+def assert_same_hits(sharded, flat):
+    distances, indices = sharded
+    flat_distances, flat_indices = flat
+    np.testing.assert_array_equal(indices, flat_indices)
+    found = indices >= 0
+    np.testing.assert_allclose(distances[found], flat_distances[found], rtol=1e-5, atol=1e-6)
+
+def test_merge_keeps_the_global_top_k_and_pads_with_minus_one():
+    # Shard 0 found two rows, shard 1 only one (FAISS pads with -1 and the lowest float)
+    distances = [np.array([[0.9, 0.1]], dtype='float32'), np.array([[0.5, -3.4e38]], dtype='float32')]
+    indices = [np.array([[3, 7]]), np.array([[12, -1]])]
+
+    merged_distances, merged_indices = merge_results(distances, indices, 3)
+    assert merged_indices.tolist() == [[3, 12, 7]]
+    np.testing.assert_allclose(merged_distances, [[0.9, 0.5, 0.1]])
+
+    merged_distances, merged_indices = merge_results(distances, indices, 4)
+    assert merged_indices.tolist() == [[3, 12, 7, -1]]
+    assert merged_distances.dtype == np.float32
+
+@pytest.mark.parametrize("rows, shards, k", [(103, 4, 10), (103, 4, 40), (10, 3, 5), (10, 3, 15)])
+def test_sharded_search_matches_a_flat_index(tmp_path, rows, shards, k):
+    # k of 40 exceeds each 25 or 26 row shard, and k of 15 the 10 rows in total, so padding comes through
+    vectors = embeddings(rows)
+    queries = embeddings(7, seed=1)
+    index_file = str(tmp_path / "faiss_index.bin")
+    index = create_shards(vectors, index_file, shards)
+    try:
+        assert len(index.shards) == shards
+        assert index.ntotal == rows
+        assert_same_hits(index.search(queries, k), flat_search(vectors, queries, k))
+    finally:
+        index.close()
+
+    # The saved shards give the same results once reopened
+    index = open_index(index_file)
+    try:
+        assert_same_hits(index.search_shards(queries, k), flat_search(vectors, queries, k))
+    finally:
+        index.close()
+
+def test_filtered_sharded_search_matches_a_filtered_flat_index(tmp_path):
+    vectors = embeddings(60)
+    queries = embeddings(5, seed=2)
+    index = create_shards(vectors, str(tmp_path / "faiss_index.bin"), 3)
+
+    # Rows on both sides of the shard bounds (20 and 40), fewer than k in total
+    ids = np.array([1, 19, 20, 21, 39, 40, 59], dtype='int64')
+    try:
+        sharded = index.search_shards(queries, 10, selector=faiss.IDSelectorBatch(ids))
+        assert_same_hits(sharded, flat_search(vectors, queries, 10, ids))
+        assert (sharded[1][:, len(ids):] == -1).all()
+    finally:
+        index.close()